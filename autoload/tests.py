@@ -1,6 +1,17 @@
 import unittest
 import vimcalc
 import math
+import decimal
+import os
+import socket
+import tempfile
+import threading
+import tracemalloc
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 class SanityCheckTestCase(unittest.TestCase):
     def runTest(self):
@@ -259,6 +270,33 @@ class PrecisionTestCase(unittest.TestCase):
         self.assertEqual(vimcalc.vimcalc_parse(":float"),  "CHANGED OUTPUT PRECISION TO FLOATING POINT.")
         self.assertEqual(vimcalc.vimcalc_parse("(8/3) * (4/3)"), "ans = 3.5555555555555554")
 
+    def testIntegerIsExact(self):
+        vimcalc.vimcalc_parse(":int")
+        self.assertEqual(vimcalc.vimcalc_parse("9007199254740993"), "ans = 9007199254740993")
+        self.assertEqual(vimcalc.vimcalc_parse("2**53 + 1"), "ans = 9007199254740993")
+        self.assertEqual(vimcalc.vimcalc_parse("12345678901234567890123 * 3"), "ans = 37037036703703703670369")
+        self.assertEqual(vimcalc.vimcalc_parse("1e30 / 7"), "ans = 142857142857142857142857142857")
+        self.assertEqual(vimcalc.vimcalc_parse("(2**100 + 1) % 2**100"), "ans = 1")
+        self.assertEqual(vimcalc.vimcalc_parse("choose(200, 100)"),
+                         "ans = 90548514656103281165404177077484163874504589675413336841320")
+
+    def testIntegerDivAssign(self):
+        vimcalc.vimcalc_parse(":int")
+        vimcalc.vimcalc_parse("let precx = 10**30 + 1")
+        self.assertEqual(vimcalc.vimcalc_parse("precx /= 3"), "precx = 333333333333333333333333333333")
+
+    def testHugeIntegers(self):
+        vimcalc.vimcalc_parse(":int")
+        result = vimcalc.vimcalc_parse("3**20000")
+        self.assertEqual(len(result), len("ans = ") + 9543)
+        self.assertEqual(vimcalc.vimcalc_parse(result[len("ans = "):] + " % 1000"), "ans = 1")
+
+    def testIntToStr(self):
+        for n in [0, 7, -7, 10**5000, 3**20000 - 1, -(2**40000)]:
+            digits = vimcalc.vimcalc_intToStr(n)
+            self.assertEqual(digits, decimal.Decimal(n).to_eng_string())
+            self.assertEqual(vimcalc.vimcalc_strToInt(digits.lstrip('-')), abs(n))
+
 class VarListingTestCase(unittest.TestCase):
     def setUp(self):
         self.resetSymbolTable()
@@ -434,11 +472,21 @@ class FunctionsTestCase(unittest.TestCase):
     def testMax(self):
         self.assertEqual(vimcalc.vimcalc_parse("max(3,7)"),      "ans = 7.0", 'test max(x,y)')
         self.assertEqual(vimcalc.vimcalc_parse("max(3.2,7.6)"),  "ans = 7.6", 'test max(x,y)')
+    def testMean(self):
+        self.assertEqual(vimcalc.vimcalc_parse("mean(1,2,3,4)"),   "ans = 2.5", 'test mean(x,...)')
+        self.assertEqual(vimcalc.vimcalc_parse("mean()"),          "Parse error: mean() requires at least one value.", 'test mean(x,...)')
+    def testMedian(self):
+        self.assertEqual(vimcalc.vimcalc_parse("median(5,1,3)"),   "ans = 3.0", 'test median(x,...)')
+        self.assertEqual(vimcalc.vimcalc_parse("median(4,1,3,2)"), "ans = 2.5", 'test median(x,...)')
     def testMin(self):
         self.assertEqual(vimcalc.vimcalc_parse("min(3,7)"),      "ans = 3.0", 'test min(x,y)')
         self.assertEqual(vimcalc.vimcalc_parse("min(3.2,7.6)"),  "ans = 3.2", 'test min(x,y)')
     def testNrt(self):
         self.assertEqual(vimcalc.vimcalc_parse("nrt(27,3)"),     "ans = 3.0", 'test nrt(x,n)')
+    def testPercentile(self):
+        self.assertEqual(vimcalc.vimcalc_parse("percentile(90,1,2,3,4,5,6,7,8,9,10)"), "ans = 9.1", 'test percentile(p,x,...)')
+        self.assertEqual(vimcalc.vimcalc_parse("percentile(0,3,1,2)"),   "ans = 1.0", 'test percentile(p,x,...)')
+        self.assertEqual(vimcalc.vimcalc_parse("percentile(101,3,1,2)"), "Parse error: percentile() requires a percentile between 0 and 100.", 'test percentile(p,x,...)')
     def testPerms(self):
         self.assertEqual(vimcalc.vimcalc_parse("perms(3,2)"),    "ans = 6", 'test perms(n,k)')
     def testPow(self):
@@ -462,10 +510,1023 @@ class FunctionsTestCase(unittest.TestCase):
         self.assertEqual(vimcalc.vimcalc_parse("sqrt(64)"),      "ans = 8.0", 'test sqrt(x)')
         self.assertEqual(vimcalc.vimcalc_parse("sqrt(0)"),       "ans = 0.0", 'test sqrt(x)')
         self.assertEqual(vimcalc.vimcalc_parse("sqrt(2)"),       "ans = 1.4142135623730951", 'test sqrt(x)')
+    def testStddev(self):
+        self.assertEqual(vimcalc.vimcalc_parse("stddev(2,4,4,4,5,5,7,9)"), "ans = 2.138089935299395", 'test stddev(x,...)')
+    def testSum(self):
+        self.assertEqual(vimcalc.vimcalc_parse("sum(1,2,3)"),      "ans = 6.0", 'test sum(x,...)')
+        self.assertEqual(vimcalc.vimcalc_parse("sum(0.1,0.2,0.3)"), "ans = 0.6", 'test sum(x,...)')
     def testTan(self):
         self.assertEqual(vimcalc.vimcalc_parse("tan(0)"),        "ans = 0.0", 'test tan(x)')
     def testTanh(self):
         self.assertEqual(vimcalc.vimcalc_parse("tanh(0)"),       "ans = 0.0", 'test tanh(x)')
+    def testVar(self):
+        self.assertEqual(vimcalc.vimcalc_parse("var(2,4,4,4,5,5,7,9)"), "ans = 4.571428571428571", 'test var(x,...)')
+        self.assertEqual(vimcalc.vimcalc_parse("var(2)"),          "Parse error: var() requires at least two values.", 'test var(x,...)')
+
+class AggregateTestCase(unittest.TestCase):
+    def testSequenceArguments(self):
+        self.assertEqual(vimcalc.vimcalc_sum(1, (2, 3), [4, [5]]), 15)
+        self.assertEqual(vimcalc.vimcalc_median([9, 1, 5], 3), 4.0)
+
+    def testExactSums(self):
+        self.assertEqual(vimcalc.vimcalc_sum(2**80, 1), 2**80 + 1)
+        self.assertEqual(vimcalc.vimcalc_sum([1e100, 1.0, -1e100]), 1.0)
+
+    def testSelect(self):
+        values = [7, 3, 9, 1, 3, 8, 2]
+        self.assertEqual(vimcalc.vimcalc_select(values, 3), 3)
+        self.assertTrue(all(v >= 3 for v in values[4:]))
+
+@unittest.skipUnless(numpy, 'requires NumPy')
+class VectorTestCase(unittest.TestCase):
+    def setUp(self):
+        vimcalc.vimcalc_parse(":dec")
+        vimcalc.vimcalc_parse(":float")
+
+    def tearDown(self):
+        vimcalc.vimcalc_parse(":dec")
+        vimcalc.vimcalc_parse(":float")
+
+    def testLiterals(self):
+        self.assertEqual(vimcalc.vimcalc_parse("[1,2,3]"),        "ans = [1.0, 2.0, 3.0]")
+        self.assertEqual(vimcalc.vimcalc_parse("[[1,2],[3,4]]"),  "ans = [[1.0, 2.0], [3.0, 4.0]]")
+        self.assertEqual(vimcalc.vimcalc_parse("[]"),             "ans = []")
+
+    def testElementwise(self):
+        self.assertEqual(vimcalc.vimcalc_parse("[1,2]*2+[3,4]"),  "ans = [5.0, 8.0]")
+        self.assertEqual(vimcalc.vimcalc_parse("[1,2,3]+1"),      "ans = [2.0, 3.0, 4.0]")
+        self.assertEqual(vimcalc.vimcalc_parse("sqrt([4,9])"),    "ans = [2.0, 3.0]")
+
+    def testLinearAlgebra(self):
+        vimcalc.vimcalc_parse("v = [1,2,3]")
+        self.assertEqual(vimcalc.vimcalc_parse("dot(v,v)"),       "ans = 14.0")
+        self.assertEqual(vimcalc.vimcalc_parse("solve([[3,1],[1,2]],[9,8])"), "ans = [2.0, 3.0]")
+        self.assertEqual(vimcalc.vimcalc_parse("round(det([[1,2],[3,4]]))"), "ans = -2")
+        self.assertEqual(vimcalc.vimcalc_parse("inv([[2,0],[0,4]])"), "ans = [[0.5, 0.0], [0.0, 0.25]]")
+        self.assertEqual(vimcalc.vimcalc_parse("inv(2)"),         "ans = 0.5")
+
+    def testAggregates(self):
+        vimcalc.vimcalc_parse("v = [1,2,3]")
+        self.assertEqual(vimcalc.vimcalc_parse("mean(v, 4)"),     "ans = 2.5")
+
+    def testOutput(self):
+        vimcalc.vimcalc_parse(":hex")
+        self.assertEqual(vimcalc.vimcalc_parse("[10,16]"),        "ans = [0xa, 0x10]")
+        vimcalc.vimcalc_parse(":dec")
+        vimcalc.vimcalc_parse(":int")
+        self.assertEqual(vimcalc.vimcalc_parse("[1,2,3,4,5,6,7,8,9,10,11,12]"),
+                         "ans = [1, 2, 3, 4, 5, ..., 8, 9, 10, 11, 12]")
+
+    def testErrors(self):
+        self.assertEqual(vimcalc.vimcalc_parse("[[1,2],[3]]"),    "Parse error: rows of a matrix must all be the same length.")
+        self.assertEqual(vimcalc.vimcalc_parse("[1,2"),           "Parse error: missing matching bracket in vector.")
+
+@unittest.skipUnless(numpy, 'requires NumPy')
+class LoadTestCase(unittest.TestCase):
+    def setUp(self):
+        vimcalc.vimcalc_parse(":dec")
+        vimcalc.vimcalc_parse(":float")
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def write(self, name, text):
+        path = os.path.join(self.dir.name, name)
+        with open(path, 'w') as f:
+            f.write(text)
+        return path
+
+    def testCsvColumns(self):
+        path = self.write('m.csv', "t,ms\n1,2.5\n2,3.5\n3,\n4,6\n")
+        self.assertEqual(vimcalc.vimcalc_parse(":load ms = %s[ms]" % path), "LOADED 4 VALUES INTO ms.")
+        self.assertTrue(math.isnan(vimcalc.vimcalc_lookupSymbol('ms')[2]))
+        self.assertEqual(vimcalc.vimcalc_parse(":load t = %s" % path), "LOADED 4 VALUES INTO t.")
+        self.assertEqual(vimcalc.vimcalc_parse("sum(t)"), "ans = 10.0")
+        self.assertEqual(vimcalc.vimcalc_parse(":load t = %s[1]" % path), "LOADED 4 VALUES INTO t.")
+        self.assertEqual(vimcalc.vimcalc_parse("t*2"), "ans = [5.0, 7.0, nan, 12.0]")
+
+    def testBinary(self):
+        path = os.path.join(self.dir.name, 'v.f64')
+        numpy.arange(10, dtype=numpy.float64).tofile(path)
+        self.assertEqual(vimcalc.vimcalc_parse(":load v = %s" % path), "LOADED 10 VALUES INTO v.")
+        self.assertTrue(isinstance(vimcalc.vimcalc_lookupSymbol('v'), numpy.memmap))
+        self.assertEqual(vimcalc.vimcalc_parse("mean(v)"), "ans = 4.5")
+        self.assertEqual(vimcalc.vimcalc_parse("median(v, 100)"), "ans = 5.0")
+        self.assertEqual(vimcalc.vimcalc_parse("max(v, 3)"), "ans = 9.0")
+        self.assertEqual(vimcalc.vimcalc_parse("var(v)"), "ans = 9.166666666666666")
+
+    def testChunkedAggregates(self):
+        chunk = vimcalc.VIMCALC_ARRAY_CHUNK
+        vimcalc.VIMCALC_ARRAY_CHUNK = 3
+        try:
+            values = numpy.array([2.0, 4, 4, 4, 5, 5, 7, 9])
+            self.assertEqual(vimcalc.vimcalc_sum(values, 1), 41.0)
+            self.assertAlmostEqual(vimcalc.vimcalc_var(values), 4.571428571428571)
+            self.assertEqual(vimcalc.vimcalc_mean(values, [1]), 41.0 / 9)
+            self.assertEqual(vimcalc.vimcalc_percentile(25, values), 4.0)
+        finally:
+            vimcalc.VIMCALC_ARRAY_CHUNK = chunk
+
+    def testRankCopiesOnce(self):
+        path = os.path.join(self.dir.name, 'big.f64')
+        numpy.random.default_rng(1).random(1 << 20).tofile(path)
+        vimcalc.vimcalc_parse(":load big = %s" % path)
+        values = vimcalc.vimcalc_lookupSymbol('big')
+        median = float(numpy.median(values))
+        tracemalloc.start()
+        try:
+            self.assertEqual(vimcalc.vimcalc_median(values), median)
+            self.assertLess(tracemalloc.get_traced_memory()[1], 1.5 * values.nbytes)
+        finally:
+            tracemalloc.stop()
+
+    def testErrors(self):
+        path = self.write('m.csv', "t,ms\n1,x\n")
+        missing = os.path.join(self.dir.name, 'none.csv')
+        self.assertEqual(vimcalc.vimcalc_parse(":load a = %s[ms]" % path),
+                         "Parse error: line 2 of '%s' has no number in column 1." % path)
+        self.assertEqual(vimcalc.vimcalc_parse(":load a = %s[s]" % path),
+                         "Parse error: '%s' has no column 's'." % path)
+        self.assertEqual(vimcalc.vimcalc_parse(":load a = %s" % missing),
+                         "Parse error: cannot read '%s': No such file or directory." % missing)
+        self.assertEqual(vimcalc.vimcalc_parse(":load a"),
+                         "Parse error: usage: :load name = path or :load name = path[col].")
+
+class HistoryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'history')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def testBrowse(self):
+        history = vimcalc.VimCalcHistory(10)
+        for expr in ["1+1", "sin(2)", "2+2", "sqrt(9)"]:
+            history.record(expr)
+        self.assertEqual(history.previous(), (3, "sqrt(9)"))
+        self.assertEqual(history.previous("", 3), (2, "2+2"))
+        self.assertEqual(history.following("", 2), (3, "sqrt(9)"))
+        self.assertEqual(history.following("", 3), None)
+
+    def testPrefixSearch(self):
+        history = vimcalc.VimCalcHistory(10)
+        for expr in ["sin(1)", "2+2", "sqrt(9)", "sin(2)", "3+3"]:
+            history.record(expr)
+        self.assertEqual(history.previous("s"), (3, "sin(2)"))
+        self.assertEqual(history.previous("s", 3), (2, "sqrt(9)"))
+        self.assertEqual(history.previous("sin", 3), (0, "sin(1)"))
+        self.assertEqual(history.previous("sin", 0), None)
+        self.assertEqual(history.following("sin", 0), (3, "sin(2)"))
+
+    def testDuplicatesRecalledOnce(self):
+        history = vimcalc.VimCalcHistory(10)
+        for expr in ["x", "y", "x"]:
+            history.record(expr)
+        self.assertEqual(history.previous(), (2, "x"))
+        self.assertEqual(history.previous("", 2), (1, "y"))
+        self.assertEqual(history.previous("", 1), None)
+
+    def testCapacity(self):
+        history = vimcalc.VimCalcHistory(3)
+        for i in range(10):
+            history.record(str(i))
+        self.assertEqual(len(history), 3)
+        self.assertEqual(history.previous("", 7), None)
+        self.assertEqual(history.previous("1"), None)
+
+    def testSharedFile(self):
+        first = vimcalc.VimCalcHistory(10, self.path)
+        second = vimcalc.VimCalcHistory(10, self.path)
+        first.record("1+1")
+        second.record("2+2")
+        first.refresh()
+        self.assertEqual(first.previous()[1], "2+2")
+        self.assertEqual(vimcalc.VimCalcHistory(10, self.path).previous("1")[1], "1+1")
+
+    def testFileCompacted(self):
+        history = vimcalc.VimCalcHistory(5, self.path)
+        for i in range(20):
+            history.record("x" + str(i))
+        with open(self.path) as f:
+            lines = f.read().split()
+        self.assertTrue(len(lines) <= 10)
+        self.assertEqual(lines[-1], "x19")
+        self.assertEqual(vimcalc.VimCalcHistory(5, self.path).previous()[1], "x19")
+
+class EvalLinesTestCase(unittest.TestCase):
+    def setUp(self):
+        vimcalc.vimcalc_parse(":dec")
+        vimcalc.vimcalc_parse(":float")
+
+    def tearDown(self):
+        vimcalc.vimcalc_parse(":dec")
+
+    def testAppend(self):
+        lines = ["let w = 3", "", "w * 4", ":hex", "255"]
+        self.assertEqual(vimcalc.vimcalc_evalLines(lines, " = "),
+                         (["let w = 3 = 3.0", "", "w * 4 = 12.0", ":hex", "255 = 0xff"], []))
+
+    def testReevaluate(self):
+        lines = ["let w = 5 = 3.0", "w * 4 = 12.0"]
+        self.assertEqual(vimcalc.vimcalc_evalLines(lines, " = "),
+                         (["let w = 5 = 5.0", "w * 4 = 20.0"], []))
+
+    def testReplace(self):
+        self.assertEqual(vimcalc.vimcalc_evalLines(["let w = 2*3", "w + 1"]),
+                         (["w = 6.0", "7.0"], []))
+
+    def testErrors(self):
+        self.assertEqual(vimcalc.vimcalc_evalLines(["1+1", "nosuchsymbol", "(2"], " = "),
+                         (["1+1 = 2.0", "nosuchsymbol", "(2"],
+                          [(1, "Parse error: symbol 'nosuchsymbol' is not defined."),
+                           (2, "Parse error: missing matching parenthesis in expression.")]))
+
+class IntegerRootsTestCase(unittest.TestCase):
+    def tearDown(self):
+        vimcalc.vimcalc_parse(":float")
+
+    def testIntegerRoots(self):
+        for n in [0, 1, 2, 99, 10**40, 3**2000 - 1, 7**5000 + 3]:
+            for k in [2, 3, 5, 17]:
+                r = vimcalc.vimcalc_iroot(n, k)
+                self.assertTrue(r**k <= n < (r+1)**k, (n, k))
+        self.assertEqual(vimcalc.vimcalc_iroot(-27, 3), -3)
+        self.assertEqual(vimcalc.vimcalc_isqrt(10**100), 10**50)
+        self.assertRaises(ValueError, vimcalc.vimcalc_iroot, -4, 2)
+        self.assertRaises(ValueError, vimcalc.vimcalc_iroot, 8, 0)
+
+    def testIntegerLogarithms(self):
+        for d in [1, 15, 16, 308, 5000]:
+            self.assertEqual(vimcalc.vimcalc_ilog10(10**d), d)
+            self.assertEqual(vimcalc.vimcalc_ilog10(10**d - 1), d - 1)
+        self.assertEqual(vimcalc.vimcalc_ilog2(2**4000), 4000)
+        self.assertEqual(vimcalc.vimcalc_ilog2(2**4000 - 1), 3999)
+        self.assertRaises(ValueError, vimcalc.vimcalc_ilog2, 0)
+
+    def testIntModeIsExact(self):
+        vimcalc.vimcalc_parse(":int")
+        self.assertEqual(vimcalc.vimcalc_parse("sqrt(10**100)"), "ans = 1" + "0" * 50)
+        self.assertEqual(vimcalc.vimcalc_parse("nrt(10**90 + 1, 3)"), "ans = 1" + "0" * 30)
+        self.assertEqual(vimcalc.vimcalc_parse("lg(1000)"), "ans = 9")
+        self.assertEqual(vimcalc.vimcalc_parse("log10(10**50 - 1)"), "ans = 49")
+        self.assertEqual(vimcalc.vimcalc_parse("isqrt(17)"), "ans = 4")
+
+    def testFloatModeFallsBackOnOverflow(self):
+        self.assertEqual(vimcalc.vimcalc_parse("sqrt(16)"), "ans = 4.0")
+        self.assertEqual(vimcalc.vimcalc_parse("lg(8)"), "ans = 3.0")
+        self.assertEqual(vimcalc.vimcalc_parse("nrt(27,3)"), "ans = 3.0")
+        self.assertEqual(vimcalc.vimcalc_parse("iroot(28, 3)"), "ans = 3")
+        self.assertEqual(vimcalc.vimcalc_parse("sqrt(300!)")[:16], "ans = 1749449948")
+        self.assertEqual(vimcalc.vimcalc_parse("nrt(300!, 3)")[:16], "ans = 6739086248")
+        self.assertEqual(vimcalc.vimcalc_parse("lg(300!)"), "ans = 2041.2776530405333")
+
+class ModularTestCase(unittest.TestCase):
+    def tearDown(self):
+        vimcalc.vimcalc_parse(":float")
+
+    def testPowerThenModulo(self):
+        self.assertEqual(vimcalc.vimcalc_parse("2**10 % 1000"), "ans = 24.0")
+        self.assertEqual(vimcalc.vimcalc_parse("2**3**2 % 1000"), "ans = 512.0")
+        self.assertEqual(vimcalc.vimcalc_parse("7**2 % -5"), "ans = -1.0")
+        self.assertEqual(vimcalc.vimcalc_parse("2**-1 % 3"), "ans = 0.5")
+        self.assertEqual(vimcalc.vimcalc_parse("2**10 % 1000 * 3"), "ans = 72.0")
+        self.assertEqual(vimcalc.vimcalc_parse("2**10 % 0"), "Parse error: float modulo")
+
+    def testHugeExponents(self):
+        vimcalc.vimcalc_parse(":int")
+        self.assertEqual(vimcalc.vimcalc_parse("3**(10**30) % 1000003"),
+                         "ans = %d" % pow(3, 10**30, 1000003))
+        self.assertEqual(vimcalc.vimcalc_parse("let p = 2**521 - 1"), "p = %d" % (2**521 - 1))
+        self.assertEqual(vimcalc.vimcalc_parse("5**(p-1) % p"), "ans = 1")
+
+    def testBuiltins(self):
+        self.assertEqual(vimcalc.vimcalc_parse("powmod(3,200,7)"), "ans = 2.0")
+        self.assertEqual(vimcalc.vimcalc_parse("pow(2,10,1000)"), "ans = 24.0")
+        self.assertEqual(vimcalc.vimcalc_parse("modinv(3,7)"), "ans = 5")
+        self.assertEqual(vimcalc.vimcalc_parse("modinv(2,4)"),
+                         "Parse error: base is not invertible for the given modulus")
+        self.assertEqual(vimcalc.vimcalc_parse("gcd(12,18,27)"), "ans = 3")
+        self.assertEqual(vimcalc.vimcalc_parse("lcm(4,6,10)"), "ans = 60")
+        self.assertEqual(vimcalc.vimcalc_parse("gcd(12.5,5)"), "Parse error: gcd() requires whole number arguments.")
+        self.assertEqual(vimcalc.vimcalc_parse("gcd(12.0,[18,27])"), "ans = 3")
+        self.assertEqual(vimcalc.vimcalc_parse("modinv(3.5,7)"), "Parse error: modinv() requires whole number arguments.")
+
+    def testRoundedFloats(self):
+        #floats from 2**53 on are no longer the numbers that were typed
+        self.assertEqual(vimcalc.vimcalc_parse("powmod(3, 10**100, 1000000007)"),
+                         "Parse error: powmod() requires whole numbers below 2**53 in float mode, use :int for larger ones.")
+        self.assertEqual(vimcalc.vimcalc_parse("modinv(3, 2**61-1)"),
+                         "Parse error: modinv() requires whole numbers below 2**53 in float mode, use :int for larger ones.")
+        self.assertEqual(vimcalc.vimcalc_parse("crt(2, 3, 3, 10**20)"),
+                         "Parse error: crt() requires whole numbers below 2**53 in float mode, use :int for larger ones.")
+        self.assertEqual(vimcalc.vimcalc_parse("2**60 % 7"), "ans = %r" % (2.0**60 % 7))
+        vimcalc.vimcalc_parse(":int")
+        self.assertEqual(vimcalc.vimcalc_parse("powmod(3, 10**100, 1000000007)"),
+                         "ans = %d" % pow(3, 10**100, 1000000007))
+        self.assertEqual(vimcalc.vimcalc_parse("crt(2,3,3,5,2,7)"), "ans = 23")
+        self.assertEqual(vimcalc.vimcalc_parse("crt(1,4,3,6)"), "ans = 9")
+        self.assertEqual(vimcalc.vimcalc_parse("crt(1,4,2,6)"),
+                         "Parse error: crt() congruences have no common solution.")
+        self.assertEqual(vimcalc.vimcalc_parse("crt(1,4,3)"),
+                         "Parse error: crt() requires pairs of residues and moduli.")
+
+class PrimesTestCase(unittest.TestCase):
+    def setUp(self):
+        vimcalc.vimcalc_parse(":int")
+
+    def tearDown(self):
+        vimcalc.vimcalc_parse(":float")
+
+    def testIsPrime(self):
+        self.assertEqual([n for n in range(30) if vimcalc.vimcalc_isprime(n)],
+                         [2, 3, 5, 7, 11, 13, 17, 19, 23, 29])
+        self.assertEqual(vimcalc.vimcalc_parse("isprime(561)"), "ans = 0")
+        self.assertEqual(vimcalc.vimcalc_parse("isprime(2**61 - 1)"), "ans = 1")
+        self.assertEqual(vimcalc.vimcalc_parse("isprime(3215031751)"), "ans = 0")
+        self.assertEqual(vimcalc.vimcalc_parse("isprime(2**127 - 1)"), "ans = 1")
+        self.assertEqual(vimcalc.vimcalc_parse("isprime(2**64 + 1)"), "ans = 0")
+
+    def testSieveGrows(self):
+        size = len(vimcalc.VIMCALC_SIEVE)
+        sieve = vimcalc.vimcalc_sieve(2 * size + 100)
+        self.assertTrue(len(sieve) > 2 * size + 100)
+        self.assertEqual(sum(sieve[:1000]), 168)
+        self.assertTrue(sieve[7919] and not sieve[7917])
+
+    def testFactor(self):
+        self.assertEqual(vimcalc.vimcalc_parse("factor(360)"), "ans = [2, 2, 2, 3, 3, 5]")
+        self.assertEqual(vimcalc.vimcalc_parse("factor(1)"), "ans = []")
+        self.assertEqual(vimcalc.vimcalc_parse("factor(2**64 + 1)"), "ans = [274177, 67280421310721]")
+        self.assertEqual(vimcalc.vimcalc_parse("factor(1000000007 * 998244353)"),
+                         "ans = [998244353, 1000000007]")
+        self.assertEqual(vimcalc.vimcalc_parse("factor(0)"), "Parse error: factor() requires a positive integer.")
+
+    def testNonWholeNumbers(self):
+        vimcalc.vimcalc_parse(":float")
+        self.assertEqual(vimcalc.vimcalc_parse("factor(12.5)"), "Parse error: factor() requires whole number arguments.")
+        self.assertEqual(vimcalc.vimcalc_parse("factor(12.0)"), "ans = [2, 2, 3]")
+        self.assertEqual(vimcalc.vimcalc_parse("isprime(2.5)"), "Parse error: isprime() requires whole number arguments.")
+        self.assertEqual(vimcalc.vimcalc_parse("isprime(7.0)"), "ans = 1")
+        #floats this large are no longer the numbers that were typed
+        self.assertEqual(vimcalc.vimcalc_parse("factor(1000000016000000063)"),
+                         "Parse error: factor() requires whole numbers below 2**53 in float mode, use :int for larger ones.")
+        self.assertEqual(vimcalc.vimcalc_parse("isprime(2**61-1)"),
+                         "Parse error: isprime() requires whole numbers below 2**53 in float mode, use :int for larger ones.")
+        self.assertEqual(vimcalc.vimcalc_parse("isprime(2**53-111)"), "ans = 1")
+
+    def testNextPrimeAndPrimePi(self):
+        self.assertEqual(vimcalc.vimcalc_parse("nextprime(100)"), "ans = 101")
+        self.assertEqual(vimcalc.vimcalc_parse("nextprime(2**64)"), "ans = 18446744073709551629")
+        self.assertEqual(vimcalc.vimcalc_parse("primepi(100)"), "ans = 25")
+        self.assertEqual(vimcalc.vimcalc_parse("primepi(10**6)"), "ans = 78498")
+        self.assertEqual(vimcalc.vimcalc_parse("primepi(10**8)"), "ans = 5761455")
+
+    def testPreviewGivesUp(self):
+        previewer = vimcalc.VimCalcPreviewer()
+        self.assertEqual(previewer.preview("primepi(10**12)"), None)
+        self.assertEqual(previewer.preview("factor((2**61 - 1) * (2**89 - 1))"), None)
+        self.assertEqual(previewer.preview("isprime(2**4423 - 1)"), None)
+        self.assertEqual(previewer.preview("isprime(97)"), "ans = 1")
+        self.assertEqual(previewer.preview("primepi(100)"), "ans = 25")
+
+class ExpressionFunctionsTestCase(unittest.TestCase):
+    def setUp(self):
+        vimcalc.vimcalc_parse("let fy = 9")
+
+    def testIntegrate(self):
+        self.assertEqual(vimcalc.vimcalc_parse("integrate(x**2, x, 0, 3)"), "ans = 9.0")
+        self.assertEqual(vimcalc.vimcalc_parse("integrate(sin(x), x, 0, pi)"), "ans = 2.0")
+        self.assertEqual(vimcalc.vimcalc_parse("integrate(sqrt(1-x*x), x, 0-1, 1)*2"), "ans = 3.141592653589793")
+        self.assertEqual(vimcalc.vimcalc_parse("integrate(x, x, 1, 0)"), "ans = -0.5")
+        self.assertEqual(vimcalc.vimcalc_parse("integrate(x*fy, x, 0, 1)"), "ans = 4.5")
+        self.assertEqual(vimcalc.vimcalc_parse("integrate(integrate(x*y, y, 0, 1), x, 0, 1)"), "ans = 0.25")
+
+    def testIntegrateWithoutElementwiseFunctions(self):
+        #nrt has no array version and max would fold the whole batch together
+        self.assertEqual(vimcalc.vimcalc_parse("integrate(nrt(x,3), x, 0, 8)"), "ans = 12.0")
+        self.assertEqual(vimcalc.vimcalc_parse("integrate(max(x, 0.5), x, 0, 1)"), "ans = 0.625")
+
+    def testAggregatesAreNotBatched(self):
+        #max folds a whole batch of points into one value
+        self.assertEqual(vimcalc.vimcalc_parse("integrate(max(x,0-x), x, 0-1, 1)"), "ans = 1.0")
+        sample = vimcalc.vimcalc_sampler('plot', vimcalc.vimcalc_tokenize("max(x,0-x)"), 'x')
+        self.assertEqual(sample([-1.0, -0.5, 0.0, 0.5, 1.0]), [1.0, 0.5, 0.0, 0.5, 1.0])
+        sample = vimcalc.vimcalc_sampler('plot', vimcalc.vimcalc_tokenize("fy + 1"), 'x')
+        self.assertEqual(sample([0.0, 1.0]), [10.0, 10.0])
+
+    def testIntegrateErrors(self):
+        self.assertEqual(vimcalc.vimcalc_parse("integrate(x, 0, 1)"), "Parse error: usage: integrate(expr,x,a,b).")
+        self.assertEqual(vimcalc.vimcalc_parse("integrate(x+, x, 0, 1)"),
+                         "Parse error: invalid expression given to integrate().")
+        self.assertEqual(vimcalc.vimcalc_parse("integrate(nosuchsymbol, x, 0, 1)"),
+                         "Parse error: symbol 'nosuchsymbol' is not defined.")
+        self.assertEqual(vimcalc.vimcalc_parse("integrate(1/x, x, 0-1, 1)"),
+                         "Parse error: integrate() requires an expression that is finite between the limits.")
+
+    def testSolve(self):
+        self.assertEqual(vimcalc.vimcalc_parse("solve(x**2-2, x, 1)"), "ans = 1.414213562373095")
+        self.assertEqual(vimcalc.vimcalc_parse("solve(cos(x)-x, x, 0)"), "ans = 0.7390851332151607")
+        self.assertEqual(vimcalc.vimcalc_parse("solve(x**3-x, x, 0.6)"), "ans = 1.0")
+        self.assertEqual(vimcalc.vimcalc_parse("solve(x*x-fy, x, 0, 10)"), "ans = 3.0")
+        self.assertEqual(vimcalc.vimcalc_parse("solve(x**2+1, x, 0)"),
+                         "Parse error: solve() could not find a sign change near the guess.")
+        self.assertEqual(vimcalc.vimcalc_parse("solve(x-1, x, 2, 3)"),
+                         "Parse error: solve() requires the expression to change sign between a and b.")
+
+    def testLinearSolveIsUnchanged(self):
+        self.assertEqual(vimcalc.vimcalc_parse("solve([[2,0],[0,4]],[2,4])"), "ans = [1.0, 1.0]")
+
+    def testSeriesClosedForms(self):
+        self.assertEqual(vimcalc.vimcalc_parse("series(i, 1, 10, i)"), "ans = 55.0")
+        self.assertEqual(vimcalc.vimcalc_parse("series(i, 1, 100, i**3 - 2*i + 7)"), "ans = 25493100.0")
+        self.assertEqual(vimcalc.vimcalc_parse("series(i, 0, 20, 2**i)"), "ans = 2097151.0")
+        self.assertEqual(vimcalc.vimcalc_parse("series(i, -5, 5, i**2 * 2**i)"), "ans = 1150.40625")
+        self.assertEqual(vimcalc.vimcalc_parse("series(i, 5, 1, i)"), "ans = 0.0")
+        vimcalc.vimcalc_parse(":int")
+        try:
+            self.assertEqual(vimcalc.vimcalc_parse("series(i, 1, 10**9, i**2)"), "ans = 333333333833333333500000000")
+            self.assertEqual(vimcalc.vimcalc_parse("series(i, 1, 100, 3**i * i**2)"),
+                             "ans = %d" % sum(3**i * i**2 for i in range(1, 101)))
+        finally:
+            vimcalc.vimcalc_parse(":float")
+
+    def testSeriesTermByTerm(self):
+        self.assertEqual(vimcalc.vimcalc_parse("series(i, 1, 1000, sin(i))"),
+                         "ans = %r" % math.fsum(math.sin(i) for i in range(1, 1001)))
+        self.assertEqual(vimcalc.vimcalc_parse("series(i, 1, 10**5, i % 7)"),
+                         "ans = %r" % float(sum(i % 7 for i in range(1, 10**5 + 1))))
+        self.assertEqual(vimcalc.vimcalc_parse("series(i, 1, 10, nrt(i, 3))"),
+                         "ans = %r" % math.fsum(i ** (1/3) for i in range(1, 11)))
+        self.assertEqual(vimcalc.vimcalc_parse("series(i, 0-3, 3, 1/i)"), "Parse error: float division by zero")
+        self.assertEqual(vimcalc.vimcalc_parse("series(i, 1, 2.5, i)"), "Parse error: series() requires whole number limits.")
+        #max folds a whole batch of terms into one value
+        self.assertEqual(vimcalc.vimcalc_parse("series(i, 0-3, 3, max(i,0-i))"), "ans = 12.0")
+        self.assertEqual(vimcalc.vimcalc_parse("product(i, 1, 4, max(i,2))"), "ans = 48.0")
+
+    def testProduct(self):
+        self.assertEqual(vimcalc.vimcalc_parse("product(i, 1, 10, i)"), "ans = 3628800.0")
+        self.assertEqual(vimcalc.vimcalc_parse("product(i, 0-3, 0-1, i)"), "ans = -6.0")
+        self.assertEqual(vimcalc.vimcalc_parse("product(i, 1, 10, 2**i)"), "ans = %r" % 2.0**55)
+        self.assertEqual(vimcalc.vimcalc_parse("product(i, 1, 20, 1 + 1/i)"), "ans = 21.0")
+        self.assertEqual(vimcalc.vimcalc_parse("prod(2, 3, 4)"), "ans = 24.0")
+
+class SessionTestCase(unittest.TestCase):
+    def tearDown(self):
+        vimcalc.vimcalc_parse(":dec")
+        vimcalc.vimcalc_parse(":float")
+
+    def testSessionsAreIndependent(self):
+        first = vimcalc.VimCalcCalculator()
+        second = vimcalc.VimCalcCalculator()
+        self.assertEqual(first.parse("sessx = 2"), "sessx = 2.0")
+        self.assertEqual(first.parse(":hex"), "CHANGED OUTPUT BASE TO HEXADECIMAL.")
+        self.assertEqual(first.parse("sessx * 8"), "ans = 0x10")
+        self.assertEqual(second.parse("sessx"), "Parse error: symbol 'sessx' is not defined.")
+        self.assertEqual(second.parse("16"), "ans = 16.0")
+        self.assertEqual(vimcalc.vimcalc_parse("sessx"), "Parse error: symbol 'sessx' is not defined.")
+        self.assertEqual(vimcalc.vimcalc_parse(":s"), "STATUS: OUTPUT BASE: DECIMAL; PRECISION: FLOATING POINT.")
+
+    def testCloneIsCopyOnWrite(self):
+        base = vimcalc.VimCalcCalculator()
+        base.parse("cowx = 1")
+        base.parse(":int")
+        clone = base.clone()
+        self.assertTrue(clone.symbols is base.symbols)
+        self.assertEqual(clone.parse("cowx + 1"), "ans = 2")
+        self.assertFalse(clone.symbols is base.symbols)
+        self.assertEqual(base.parse("ans"), "ans = 0")
+        base.parse("cowx = 5")
+        self.assertEqual(clone.parse("cowx"), "ans = 1")
+        self.assertEqual(base.parse("cowx"), "ans = 5")
+
+    def testDefaultSessionUsesGlobals(self):
+        vimcalc.vimcalc_parse(":oct")
+        self.assertEqual(vimcalc.VIMCALC_OUTPUT_BASE, "octal")
+        vimcalc.vimcalc_parse("defaultx = 3")
+        self.assertEqual(vimcalc.VIMCALC_SYMBOL_TABLE["defaultx"], 3.0)
+        clone = vimcalc.vimcalc_session().clone()
+        vimcalc.vimcalc_parse("defaultx = 4")
+        self.assertEqual(clone.parse("defaultx"), "ans = 03")
+        self.assertEqual(vimcalc.VIMCALC_SYMBOL_TABLE["defaultx"], 4.0)
+
+    def testThreadPool(self):
+        from concurrent.futures import ThreadPoolExecutor
+        base = vimcalc.VimCalcCalculator()
+        base.parse("k = 3")
+        def work(n):
+            session = base.clone()
+            outputs = []
+            for i in range(200):
+                session.parse("acc = %d * k + %d" % (n, i))
+                outputs.append(session.parse("acc - %d" % i))
+            return set(outputs)
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            results = list(pool.map(work, range(8)))
+        self.assertEqual(results, [set(["ans = %s" % float(n*3)]) for n in range(8)])
+
+    def testSharedSessionAcrossThreads(self):
+        from concurrent.futures import ThreadPoolExecutor
+        session = vimcalc.VimCalcCalculator()
+        session.parse("total = 0")
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            list(pool.map(session.parse, ["total += 1"] * 400))
+        self.assertEqual(session.parse("total"), "ans = 400.0")
+
+class UndoTestCase(unittest.TestCase):
+    def setUp(self):
+        self.calc = vimcalc.VimCalcCalculator()
+
+    def testUndoRedo(self):
+        self.calc.parse("x = 5")
+        self.calc.parse("x *= 1000")
+        self.assertEqual(self.calc.parse(":undo"), "UNDID LINE 2: x = 5.0")
+        self.assertEqual(self.calc.parse("x"), "ans = 5.0")
+        self.assertEqual(self.calc.parse(":undo"), "UNDID LINE 3: ans = 0")
+        self.assertEqual(self.calc.parse(":undo"), "UNDID LINE 1: x is undefined")
+        self.assertEqual(self.calc.parse(":undo"), "NOTHING TO UNDO.")
+        self.assertEqual(self.calc.parse(":redo"), "REDID LINE 1: x = 5.0")
+        self.assertEqual(self.calc.parse("x"), "ans = 5.0")
+
+    def testNewLineClearsRedo(self):
+        self.calc.parse("x = 1")
+        self.calc.parse(":undo")
+        self.calc.parse("y = 2")
+        self.assertEqual(self.calc.parse(":redo"), "NOTHING TO REDO.")
+        self.assertEqual(self.calc.parse("x"), "Parse error: symbol 'x' is not defined.")
+
+    def testVarsAtLine(self):
+        self.calc.parse("a = 1")
+        self.calc.parse(":hex")
+        self.calc.parse("a += 1")
+        self.calc.parse("b = 7")
+        self.assertEqual(self.calc.parse(":vars @2"),
+                         "VARIABLES AT LINE 2:\n--------------------\n" +
+                         " a   : 0x2\n ans : 0x0\n e   : 0x2\n phi : 0x1\n pi  : 0x3\n")
+        self.assertEqual(self.calc.symbolsAt(0), vimcalc.VIMCALC_INITIAL_SYMBOLS)
+        self.assertEqual(self.calc.parse(":vars @4"), "Parse error: there is no line 4 yet.")
+        self.assertEqual(self.calc.parse(":vars @x"), "Parse error: expected a line number after @.")
+
+    def testJournalIsBounded(self):
+        size = vimcalc.VIMCALC_JOURNAL_SIZE
+        vimcalc.VIMCALC_JOURNAL_SIZE = 3
+        try:
+            for i in range(6):
+                self.calc.parse("j = %d" % i)
+            self.assertEqual(self.calc.symbolsAt(3)['j'], 2.0)
+            self.assertEqual(self.calc.parse(":vars @2"), "Parse error: line 2 is too old to be recalled.")
+            for i in range(3):
+                self.calc.undo()
+            self.assertEqual(self.calc.parse(":undo"), "NOTHING TO UNDO.")
+            self.assertEqual(self.calc.parse("j"), "ans = 2.0")
+        finally:
+            vimcalc.VIMCALC_JOURNAL_SIZE = size
+
+class ResultHistoryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.calc = vimcalc.VimCalcCalculator()
+
+    def testReferences(self):
+        self.calc.parse("2**10")
+        self.calc.parse("x = 3")
+        self.calc.parse(":hex")
+        self.assertEqual(self.calc.parse("$1 + $2"), "ans = 0x403")
+        self.assertEqual(self.calc.parse("ans[-1] + ans[-3]"), "ans = 0x803")
+        self.assertEqual(self.calc.parse("$9"), "Parse error: there is no result 9 yet.")
+        self.assertEqual(self.calc.parse("ans[-9]"), "Parse error: there are only 4 results so far.")
+        self.assertEqual(self.calc.parse("ans[1]"), "Parse error: ans[-k] requires a negative whole number k.")
+
+    def testEviction(self):
+        history = vimcalc.VIMCALC_RESULT_HISTORY
+        vimcalc.VIMCALC_RESULT_HISTORY = 3
+        try:
+            for i in range(5):
+                self.calc.parse("%d" % i)
+            self.assertEqual(self.calc.parse("$2"), "Parse error: result 2 is too old to be recalled.")
+            self.assertEqual(self.calc.parse("$5"), "ans = 4.0")
+        finally:
+            vimcalc.VIMCALC_RESULT_HISTORY = history
+
+    def testBudget(self):
+        budget = vimcalc.VIMCALC_RESULT_BUDGET
+        vimcalc.VIMCALC_RESULT_BUDGET = 1000
+        try:
+            self.calc.parse(":int")
+            self.calc.parse("1")
+            self.calc.parse("x = 3**5000")
+            self.assertEqual(self.calc.parse("$1"), "Parse error: result 1 is too old to be recalled.")
+            self.assertEqual(self.calc.evaluate("$2")[0].result, 3**5000)
+        finally:
+            vimcalc.VIMCALC_RESULT_BUDGET = budget
+
+    def testCompactIntegers(self):
+        for n in [2**100000, -(3**20000), 0, -1]:
+            compact = vimcalc.VimCalcCompactInt(n)
+            self.assertEqual(compact.value(), n)
+        self.assertTrue(vimcalc.VimCalcCompactInt(2**100000).size() < 1000)
+
+    def testBatchLinesInOrder(self):
+        self.assertEqual(vimcalc.vimcalc_independentLines(["1+1", "$1*2", "ans[-1]"]), [True, False, False])
+
+class EvaluatorTestCase(unittest.TestCase):
+    def setUp(self):
+        self.calc = vimcalc.VimCalcCalculator()
+        self.evaluator = vimcalc.VimCalcEvaluator(self.calc)
+
+    def testValues(self):
+        self.calc.parse("x = 4")
+        self.assertEqual(self.evaluator.value("x*2"), "8.0")
+        self.assertEqual(self.evaluator.value("y = 3"), "3.0")
+        self.assertEqual(self.evaluator.value("y"), None)
+        self.assertEqual(self.evaluator.value("ans"), "0")
+        self.assertEqual(self.evaluator.value(":hex"), None)
+        self.assertEqual(self.calc.base, 'decimal')
+        self.assertEqual(self.evaluator.value("foo("), None)
+        self.assertEqual(self.evaluator.value("9**9**9", 0.001), None)
+
+    def testRemembersValues(self):
+        self.calc.parse("x = 4")
+        self.assertEqual(self.evaluator.value("x*2"), "8.0")
+        self.calc.symbols['x'] = 5.0   #behind the session's back
+        self.assertEqual(self.evaluator.value("x*2"), "8.0")
+        self.calc.parse("x = 6")
+        self.assertEqual(self.evaluator.value("x*2"), "12.0")
+        self.calc.parse(":hex")
+        self.assertEqual(self.evaluator.value("x*2"), "0xc")
+
+class WordSizeTestCase(unittest.TestCase):
+    def setUp(self):
+        self.calc = vimcalc.VimCalcCalculator()
+
+    def testWrapping(self):
+        self.assertEqual(self.calc.parse(":bits 8"), "CHANGED WORD SIZE TO 8 BITS SIGNED.")
+        self.assertEqual(self.calc.parse("127+1"), "ans = -128")
+        self.assertEqual(self.calc.parse("x = 1 << 200"), "x = 0")
+        self.assertEqual(self.calc.parse("x = 0x70"), "x = 112")
+        self.assertEqual(self.calc.parse("x |= 0x80"), "x = -16")
+        self.assertEqual(self.calc.parse("x >> 2"), "ans = -4")
+        self.assertEqual(self.calc.parse(":bits 8 unsigned"), "CHANGED WORD SIZE TO 8 BITS UNSIGNED.")
+        self.assertEqual(self.calc.parse("0-1"), "ans = 255")
+        self.assertEqual(self.calc.parse("sqrt(17)"), "ans = 4")
+        self.assertEqual(self.calc.parse(":bits off"), "CHANGED WORD SIZE TO UNBOUNDED.")
+        self.assertEqual(self.calc.parse("1 << 70"), "ans = 1180591620717411303424")
+
+    def testOutput(self):
+        self.calc.parse(":bits 16")
+        self.assertEqual(self.calc.parse(":s"),
+                         "STATUS: OUTPUT BASE: DECIMAL; PRECISION: FLOATING POINT; WORD SIZE: 16 BITS SIGNED.")
+        self.calc.parse(":hex")
+        self.assertEqual(self.calc.parse("0-1"), "ans = 0xffff")
+        self.assertEqual(self.calc.parse("0x12"), "ans = 0x0012")
+        self.calc.parse(":bin")
+        self.assertEqual(self.calc.parse("5"), "ans = 0b0000000000000101")
+        self.calc.parse(":oct")
+        self.assertEqual(self.calc.parse("8"), "ans = 0000010")
+
+    def testBitFunctions(self):
+        self.assertEqual(self.calc.parse("popcount(0xf0f0)"), "ans = 8")
+        self.assertEqual(self.calc.parse("popcount(0-1)"),
+                         "Parse error: popcount() requires a non-negative number without a word size.")
+        self.assertEqual(self.calc.parse("clz(1)"),
+                         "Parse error: clz() requires a word size, set one with :bits or give it as the last argument.")
+        self.assertEqual(self.calc.parse("rotl(0x81, 1, 8)"), "ans = 3")
+        self.calc.parse(":bits 32")
+        self.assertEqual(self.calc.parse("clz(1)"), "ans = 31")
+        self.assertEqual(self.calc.parse("ctz(0)"), "ans = 32")
+        self.assertEqual(self.calc.parse("ctz(40)"), "ans = 3")
+        self.assertEqual(self.calc.parse("popcount(0-1)"), "ans = 32")
+        self.assertEqual(self.calc.parse("rotr(1, 1)"), "ans = -2147483648")
+        self.assertEqual(self.calc.parse("rotl(rotr(12345, 7), 7)"), "ans = 12345")
+
+    def testErrors(self):
+        self.assertEqual(self.calc.parse(":bits"), "Parse error: usage: :bits N [signed|unsigned] or :bits off.")
+        self.assertEqual(self.calc.parse(":bits 0"), "Parse error: the word size must be from 1 to 4096 bits.")
+        self.assertEqual(self.calc.parse(":bits 8 wide"), "Parse error: usage: :bits N [signed|unsigned] or :bits off.")
+
+    def testExact(self):
+        #numbers are exact integers with a word size, also past 2**53
+        self.calc.parse(":bits 64")
+        self.assertEqual(self.calc.parse("9007199254740993"), "ans = 9007199254740993")
+        self.assertEqual(self.calc.parse("0x20000000000001 * 3"), "ans = 27021597764222979")
+        self.assertEqual(self.calc.parse(":bits 64 unsigned"), "CHANGED WORD SIZE TO 64 BITS UNSIGNED.")
+        self.assertEqual(self.calc.parse("3**40"), "ans = 12157665459056928801")
+        self.assertEqual(self.calc.parse("7/2"), "ans = 3")
+
+    def testOperandsStaySmall(self):
+        #powers are taken modulo the word, so they never build the full number
+        self.calc.parse(":int")
+        self.calc.parse(":bits 8")
+        self.assertEqual(self.calc.parse("3**(10**8)"), "ans = 1")
+        self.assertEqual(self.calc.parse("3**100"), "ans = " + str(vimcalc.vimcalc_wrap(3**100, 8, True)))
+        self.assertEqual(self.calc.parse("x = 3"), "x = 3")
+        self.assertEqual(self.calc.parse("x **= 2**60"), "x = 1")
+        self.assertEqual(self.calc.parse("100000!"), "ans = 0")
+        self.assertEqual(self.calc.parse("5!"), "ans = 120")
+        self.assertEqual(self.calc.parse("100 * 100 + 1"), "ans = 17")
+
+    def testPowerModulo(self):
+        #the power wraps before the modulo, as it does in parentheses
+        self.calc.parse(":bits 8")
+        self.assertEqual(self.calc.parse("3**5 % 7"), "ans = 1")
+        self.assertEqual(self.calc.parse("(3**5) % 7"), "ans = 1")
+        self.assertEqual(self.calc.parse("3**200 % 7"), "ans = 0")
+        self.assertEqual(self.calc.parse("(3**200) % 7"), "ans = 0")
+        self.assertEqual(self.calc.parse("powmod(3, 5, 7)"), "ans = 5")
+
+    def testClones(self):
+        self.calc.parse(":bits 8")
+        self.assertEqual(self.calc.clone().parse("200"), "ans = -56")
+
+class MemoryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.calc = vimcalc.VimCalcCalculator()
+        self.calc.parse(":int")
+
+    def testReport(self):
+        self.calc.parse("x = 3**100000")
+        report = self.calc.parse(":mem")
+        self.assertTrue(report.startswith("MEMORY:\n-------\n symbols       : "))
+        self.assertTrue(" token cache   : " in report)
+        self.assertTrue(" last line     : stored 20.7 KB\n" in report)
+        self.assertTrue(" budget        : 256.0 MB, spilling the largest values\n" in report)
+        self.assertTrue("\nSYMBOLS BY SIZE:\n---------------\n x   : 20.7 KB\n" in report)
+
+    def testSpill(self):
+        self.assertEqual(self.calc.parse(":mem budget 60 kb"), "CHANGED MEMORY BUDGET TO 60.0 KB.")
+        self.calc.parse("x = 3**100000")
+        self.calc.parse("y = 3**100001")
+        output = self.calc.parse("z = 3**100002")
+        self.assertEqual(output.split("\n")[1:],
+                         ["WARNING: SPILLED x (20.7 KB) TO DISK TO STAY WITHIN THE MEMORY BUDGET."])
+        #spilled values are read back when used
+        self.assertEqual(self.calc.parse("x - 3**100000"), "ans = 0")
+        self.assertTrue(" x   : 19.4 KB, spilled\n" in self.calc.parse(":mem"))
+        self.assertEqual(self.calc.parse(":undo"), "UNDID LINE 4: ans = 0")
+        self.assertTrue(self.calc.parse(":vars").find(" x   : " + vimcalc.vimcalc_intToStr(3**100000)) > 0)
+
+    def testDrop(self):
+        self.calc.parse(":mem budget 50 kb")
+        self.assertEqual(self.calc.parse(":mem drop"), "VALUES OVER THE MEMORY BUDGET WILL BE DROPPED.")
+        self.assertEqual(self.calc.parse(":mem pin x"), "PINNED x.")
+        self.calc.parse("x = 3**100000")
+        self.calc.parse("y = 3**100001")
+        output = self.calc.parse("z = 3**100002")
+        self.assertEqual(output.split("\n")[1:],
+                         ["WARNING: DROPPED y (20.7 KB) TO STAY WITHIN THE MEMORY BUDGET."])
+        self.assertEqual(self.calc.parse("y"), "Parse error: symbol 'y' is not defined.")
+        self.assertEqual(self.calc.parse("x % 10"), "ans = 1")
+        self.assertEqual(self.calc.parse(":mem unpin x"), "UNPINNED x.")
+
+    def testDropStopsUndo(self):
+        #undoing past a dropped value would bring back the wrong one
+        self.calc.parse(":mem budget 1 kb")
+        self.calc.parse(":mem drop")
+        self.calc.parse("x = 10**3000")
+        output = self.calc.parse("x = 1")
+        self.assertEqual(output, "x = 1\nWARNING: DROPPED an old value of x (1.3 KB) TO STAY WITHIN THE MEMORY BUDGET.")
+        self.assertEqual(self.calc.parse(":undo"), "NOTHING TO UNDO.")
+        self.assertEqual(self.calc.parse("x"), "ans = 1")
+
+    def testUndoHistory(self):
+        #old values kept for :undo count towards the budget too
+        self.calc.parse(":mem budget 10 kb")
+        self.calc.parse("x = 3**100000")
+        output = self.calc.parse("x = 1")
+        self.assertEqual(output, "x = 1\nWARNING: SPILLED an old value of x (20.7 KB) TO DISK TO STAY WITHIN THE MEMORY BUDGET.")
+        self.assertEqual(self.calc.parse(":undo"), "UNDID LINE 2: x = " + vimcalc.vimcalc_intToStr(3**100000))
+        self.assertEqual(self.calc.parse("x % 10"), "ans = 1")
+
+    def testClone(self):
+        self.calc.parse(":mem budget 30 kb")
+        self.calc.parse("x = 3**100000")
+        self.calc.parse("y = 3**100001")
+        clone = self.calc.clone()
+        self.assertEqual(clone.parse("x % 10"), "ans = 1")
+        self.assertEqual(self.calc.snapshot()[0]['x'], 3**100000)
+
+    def testTrace(self):
+        self.assertEqual(self.calc.parse(":mem trace"), "STARTED TRACING MEMORY.")
+        try:
+            self.calc.parse("x = 3**100000")
+            self.assertTrue(", heap +" in self.calc.parse(":mem"))
+        finally:
+            self.assertEqual(self.calc.parse(":mem trace off"), "STOPPED TRACING MEMORY.")
+        self.assertFalse(", heap " in self.calc.parse(":mem"))
+
+    def testErrors(self):
+        usage = "Parse error: usage: :mem [budget N [kb|mb|gb] | budget off | spill | drop | pin X... | unpin X... | trace [off]]."
+        self.assertEqual(self.calc.parse(":mem budget"), usage)
+        self.assertEqual(self.calc.parse(":mem budget 1 tb"), usage)
+        self.assertEqual(self.calc.parse(":mem pin"), usage)
+        self.assertEqual(self.calc.parse(":mem budget 0"), "Parse error: the memory budget must be at least one byte.")
+        self.assertEqual(self.calc.parse(":mem budget off"), "CHANGED MEMORY BUDGET TO UNLIMITED.")
+        self.assertEqual(self.calc.parse(":mem budget 1.5 GB"), "CHANGED MEMORY BUDGET TO 1.5 GB.")
+
+class PreviewTestCase(unittest.TestCase):
+    def setUp(self):
+        self.calc = vimcalc.VimCalcCalculator()
+        self.calc.parse("x = 3")
+        self.previewer = vimcalc.VimCalcPreviewer(self.calc)
+
+    def testIncrementalTokenize(self):
+        edits = ["1", "1e", "1e+", "1e+5", "1e+5 ", "1e+5 *", "1e+5 * :s", "1e+5 * :status",
+                 "1e+5 * x", "1e+5 * (x", "1e+5 * (x)", "2e+5 * (x)", "2e+5 * (x)!", "", "let y'= 0b12"]
+        for expr in edits:
+            self.assertEqual(list(map(str, self.previewer.tokenize(expr))),
+                             list(map(str, vimcalc.vimcalc_tokenize(expr))))
+
+    def testPreview(self):
+        self.assertEqual(self.previewer.preview("x * 2"), "ans = 6.0")
+        self.assertEqual(self.previewer.preview("x * 2 +"), None)
+        self.assertEqual(self.previewer.preview("x * 2 + 1"), "ans = 7.0")
+        self.assertEqual(self.previewer.preview(""), None)
+        self.assertEqual(self.previewer.preview(":q"), None)
+        self.assertEqual(self.previewer.preview("nosuchsymbol"), None)
+
+    def testEditingLongSums(self):
+        expr = "+".join(["(%d*2-1)" % i for i in range(50)])
+        for i in range(1, len(expr)+1):
+            self.previewer.preview(expr[:i])
+        self.assertEqual(self.previewer.preview(expr), "ans = 2400.0")
+        self.assertEqual(self.previewer.preview(expr.replace("(3*2-1)", "(3*2-2)")), "ans = 2399.0")
+        self.assertEqual(self.previewer.preview("1-" + expr), "ans = 2403.0")
+        self.assertEqual(self.previewer.preview(expr + "*0"), "ans = 2303.0")
+
+    def testPreviewDoesNotChangeSession(self):
+        self.assertEqual(self.previewer.preview("x = 10"), "x = 10.0")
+        self.assertEqual(self.previewer.preview("x + 1"), "ans = 4.0")
+        self.assertEqual(self.calc.parse("x"), "ans = 3.0")
+        self.assertEqual(self.previewer.preview("ans + x"), "ans = 6.0")
+        self.calc.parse("x = 4")
+        self.assertEqual(self.previewer.preview("ans + x"), "ans = 7.0")
+
+    def testPreviewGivesUp(self):
+        self.calc.parse(":int")
+        self.assertEqual(self.previewer.preview("9**9**9"), None)
+        self.assertEqual(self.previewer.preview("1000000!"), None)
+        self.assertEqual(self.previewer.preview("2**100"), "ans = 1267650600228229401496703205376")
+        self.assertEqual(self.previewer.preview("1+1", cancelled=lambda: True), "ans = 2")
+        self.assertEqual(self.previewer.preview("+".join(["x"] * 200), cancelled=lambda: True), None)
+        self.assertEqual(self.previewer.preview("3+3", budget=-1), None)
+
+class BatchTestCase(unittest.TestCase):
+    def setUp(self):
+        vimcalc.vimcalc_parse(":dec")
+        vimcalc.vimcalc_parse(":float")
+
+    def testIndependentLines(self):
+        lines = ["x = 2", "3+4", "x*10", "y = 5", "ans+1", ":hex", "9"]
+        self.assertEqual(vimcalc.vimcalc_independentLines(lines),
+                         [True, True, False, True, False, False, False])
+
+    def testOpAssignReadsTarget(self):
+        self.assertEqual(vimcalc.vimcalc_independentLines(["x = 1", "x += 1"]), [True, False])
+        self.assertEqual(vimcalc.vimcalc_independentLines(["x = 1", "let x = 3"]), [True, True])
+
+    def testBatchMatchesSequential(self):
+        lines = ["batchx = 2", "3+4", "batchx*10", "ans+1", "sqrt(16)", "foo()", "2**10"]
+        self.assertEqual(vimcalc.vimcalc_parseBatch(lines, workers=2),
+                         ["batchx = 2.0", "ans = 7.0", "ans = 20.0", "ans = 21.0",
+                          "ans = 4.0", "Parse error: built-in function 'foo' does not exist.",
+                          "ans = 1024.0"])
+        self.assertEqual(vimcalc.vimcalc_parse("batchx + ans"), "ans = 1026.0")
+
+    def testWorksheets(self):
+        vimcalc.vimcalc_parse("sheety = 1")
+        sheets = [["sheety = 10", "sheety * 2"], ["sheety + 1"], ["sheety"]]
+        self.assertEqual(vimcalc.vimcalc_parseWorksheets(sheets, workers=2),
+                         [["sheety = 10.0", "ans = 20.0"], ["ans = 2.0"], ["ans = 1.0"]])
+        self.assertEqual(vimcalc.vimcalc_parse("sheety"), "ans = 1.0")
+
+class PlotTestCase(unittest.TestCase):
+    def setUp(self):
+        vimcalc.vimcalc_parse(":dec")
+        vimcalc.vimcalc_parse(":float")
+
+    def testPlot(self):
+        width, height = vimcalc.VIMCALC_PLOT_SIZE
+        lines = vimcalc.vimcalc_parse(":plot sin(plotx)/plotx, plotx=-20..20").split("\n")
+        self.assertEqual(lines[0], "PLOT OF sin(plotx)/plotx FOR plotx = -20 .. 20:")
+        self.assertEqual(len(lines), height + 3)
+        chart = [line[-width:] for line in lines[1:height+1]]
+        self.assertTrue(all(0x2800 <= ord(c) <= 0x28ff for c in "".join(chart)))
+        self.assertNotEqual(set("".join(chart)), set(["\u2800"]))
+        self.assertEqual(vimcalc.vimcalc_parse("plotx"), "Parse error: symbol 'plotx' is not defined.")
+
+    def testPlotRange(self):
+        lines = vimcalc.vimcalc_parse(":plot sqrt(t), t = 2-2 .. 2**2").split("\n")
+        self.assertEqual(lines[0], "PLOT OF sqrt(t) FOR t = 0 .. 4:")
+        self.assertTrue(lines[1].lstrip().startswith("2 "))
+
+    def testPlotErrors(self):
+        self.assertEqual(vimcalc.vimcalc_parse(":plot x"), "Parse error: usage: :plot expr, x=a..b.")
+        self.assertEqual(vimcalc.vimcalc_parse(":plot x, x=1"), "Parse error: usage: :plot expr, x=a..b.")
+        self.assertEqual(vimcalc.vimcalc_parse(":plot x, x=1..0"),
+                         "Parse error: the range of a plot must go from low to high.")
+
+    def testRangeLexing(self):
+        self.assertEqual(list(map(vimcalc.vimcalc_getID, vimcalc.vimcalc_tokenize("-20..20"))),
+                         ["subtract", "decnumber", "range", "decnumber"])
+        self.assertEqual(vimcalc.vimcalc_parse("3."), "ans = 3.0")
+        self.assertEqual(vimcalc.vimcalc_parse(".5"), "ans = 0.5")
+        self.assertEqual(vimcalc.vimcalc_parse("1.5e3"), "ans = 1500.0")
+
+@unittest.skipUnless(hasattr(socket, 'AF_UNIX'), 'requires Unix sockets')
+class ServerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'vimcalc.sock')
+        self.server = vimcalc.VimCalcServer(self.path)
+        self.thread = threading.Thread(target=self.server.serveForever)
+        self.thread.start()
+        self.client = vimcalc.VimCalcClient(self.path)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.shutdown()
+        self.thread.join()
+        self.dir.cleanup()
+
+    def testSharedSessions(self):
+        other = vimcalc.VimCalcClient(self.path)
+        self.assertEqual(self.client.call('parse', expr='srv = 7', session='s'), "srv = 7.0")
+        self.assertEqual(other.call('parse', expr='srv*2', session='s'), "ans = 14.0")
+        self.assertEqual(other.call('parse', expr='srv', session='t'), "Parse error: symbol 'srv' is not defined.")
+        self.assertEqual(vimcalc.vimcalc_remoteEvalLines(['srv+1', 'foo('], ' = ', self.path, 's'),
+                         (['srv+1 = 8.0', 'foo('], [(1, 'Parse error: missing matching parenthesis for function foo.')]))
+        self.assertEqual(self.client.call('preview', expr='srv+2', session='s', budget=1.0), "ans = 9.0")
+        other.close()
+
+    def testPooledConnections(self):
+        for i in range(5):
+            self.assertEqual(self.client.call('ping'), 'pong')
+        self.assertEqual(len(self.client._pool), 1)
+
+    def testErrors(self):
+        with self.assertRaises(vimcalc.VimCalcRPCError) as cm:
+            self.client.call('nothing')
+        self.assertEqual(cm.exception.code, -32601)
+        with self.assertRaises(vimcalc.VimCalcRPCError) as cm:
+            self.client.call('parse')
+        self.assertEqual(cm.exception.code, -32602)
+        self.assertEqual(self.server.respond(b'{'),
+                         {'jsonrpc': '2.0', 'id': None, 'error': {'code': -32700, 'message': 'Parse error'}})
+        with self.assertRaises(OSError):
+            vimcalc.VimCalcServer(self.path)
+
+    def testRefusedCallsFallBack(self):
+        self.assertEqual(vimcalc.vimcalc_remote(self.path, lambda: 'local', 'nothing'), 'local')
+
+    def testRestartedServer(self):
+        self.assertEqual(self.client.call('ping'), 'pong')
+        self.server.shutdown()
+        self.thread.join()
+        self.server = vimcalc.VimCalcServer(self.path)
+        self.thread = threading.Thread(target=self.server.serveForever)
+        self.thread.start()
+        #the pooled connection is found closed before the call is sent on it
+        self.assertEqual(self.client.call('parse', expr='restarted = 1', session='r'), "restarted = 1.0")
+
+    def testSilentServer(self):
+        #a server which reads calls but never answers them
+        path = os.path.join(self.dir.name, 'silent.sock')
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(path)
+        listener.listen(4)
+        received = []
+        def serve():
+            connection = listener.accept()[0]
+            received.append(connection.makefile('rb').readline())
+            connection.close()
+        thread = threading.Thread(target=serve)
+        thread.start()
+        client = vimcalc.VimCalcClient(path)
+        try:
+            with self.assertRaises(vimcalc.VimCalcRPCUnanswered):
+                client.call('parse', 0.05, expr='x += 1')
+            thread.join()
+            #the call was not sent a second time
+            self.assertEqual(len(received), 1)
+            #nor carried out here as well, as the server may still apply it
+            thread = threading.Thread(target=serve)
+            thread.start()
+            output = vimcalc.vimcalc_remote(path, lambda: 'local', 'parse', 0.05, expr='x += 1')
+            thread.join()
+            self.assertTrue(output.startswith("Server error: "))
+            self.assertEqual(len(received), 2)
+            self.assertEqual(vimcalc.vimcalc_remote(path, lambda: 'local', 'ping', 0.05), 'local')
+        finally:
+            client.close()
+            listener.close()
+
+    def testFallback(self):
+        self.client.call('shutdown')
+        self.thread.join()
+        self.assertFalse(os.path.exists(self.path))
+        vimcalc.vimcalc_parse(":dec")
+        vimcalc.vimcalc_parse(":float")
+        self.assertEqual(vimcalc.vimcalc_remoteParse("6*7", self.path), "ans = 42.0")
 
 if __name__ == "__main__":
     unittest.main()
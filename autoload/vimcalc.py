@@ -4,7 +4,14 @@
 # VERSION:             3.3, for Vim 7.0+
 # LICENSE:             Same terms as Vim itself (see :help license).
 
-import math, re, random
+import math, numbers, re, random, bisect, os, sys, decimal, fractions, threading, contextlib, collections, time
+import array, csv, gc, json, pickle, select, socket, tempfile, tracemalloc, weakref, zlib
+
+#optional faster big integer arithmetic used in integer mode
+try:
+    import gmpy2
+except ImportError:
+    gmpy2 = None
 
 #### LEXICAL ANALYSIS FUNCTIONS ################################################
 
@@ -27,7 +34,7 @@ import math, re, random
 #bindigit  = [01]
 #bindigits = bindigit+
 
-#decnumber   = digits(. digits)?(e[+-]? digits)?
+#decnumber   = digits(. digits)?(e[+-]? digits)?    -- a '.' followed by '.' is a range
 #hexnumber   = 0xhexdigits
 #octalnumber = 0 octdigits
 #binnumber   = 0bbindigits
@@ -52,7 +59,12 @@ import math, re, random
 
 #lParen    = '('
 #rParen    = ')'
+#lBracket  = '['
+#rBracket  = ']'
 #comma     = ','
+#at        = '@'
+#range     = '..'
+#resultRef = '$' digits
 #assign    = '='
 #pAssign   = '+='
 #sAssign   = '-='
@@ -61,7 +73,7 @@ import math, re, random
 #modAssign = '%='
 #expAssign = '**='
 
-#delimiters = lParen|rParen|comma|assign|pAssign|sAssign|mAssign|dAssign|modAssign|expAssign
+#delimiters = lParen|rParen|lBracket|rBracket|comma|at|range|resultRef|assign|pAssign|sAssign|mAssign|dAssign|modAssign|expAssign
 
 #let = 'let'
 #keywords = let
@@ -75,7 +87,13 @@ import math, re, random
 #statusDir  = ':status' | ':s'
 #varDir     = ':vars'
 #quitDir    = ':q'
+#undoDir    = ':undo'
+#redoDir    = ':redo'
+#plotDir    = ':plot'
+#loadDir    = ':load' anything    -- the rest of the line is the token
+#bitsDir    = ':bits'
 #directives = decDir | hexDir | octDir | binDir | intDir | floatDir | statusDir | varDir | quitDir
+#             | undoDir | redoDir | plotDir | loadDir | bitsDir
 
 class VimCalcToken(object):
     def __init__(self, tokenID, attrib):
@@ -108,7 +126,7 @@ vimcalc_lexemes = [VimCalcLexeme('whitespace', r'\s+'),
                    VimCalcLexeme('hexnumber',  r'0[xX][0-9a-fA-F]+'),
                    VimCalcLexeme('octnumber',  r'0[0-7]+'),
                    VimCalcLexeme('binnumber',  r'0[bB][01]+'),
-                   VimCalcLexeme('decnumber',  r'[0-9]*\.?([0-9]+)?([eE][+-]?[0-9]+)?'),
+                   VimCalcLexeme('decnumber',  r'(?=[0-9]|\.[0-9]|[eE][+-]?[0-9])[0-9]*(\.(?!\.))?([0-9]+)?([eE][+-]?[0-9]+)?'),
                    VimCalcLexeme('let',        r'let'),
                    VimCalcLexeme('ident',      r"[A-Za-z_][A-Za-z0-9_]*'?"),
                    VimCalcLexeme('expAssign',  r'\*\*='),
@@ -125,8 +143,13 @@ vimcalc_lexemes = [VimCalcLexeme('whitespace', r'\s+'),
                    VimCalcLexeme('exponent',   r'\*\*'),
                    VimCalcLexeme('assign',     r'='),
                    VimCalcLexeme('comma',      r','),
+                   VimCalcLexeme('at',         r'@'),
+                   VimCalcLexeme('range',      r'\.\.'),
+                   VimCalcLexeme('resultRef',  r'\$[0-9]+'),
                    VimCalcLexeme('lParen',     r'\('),
                    VimCalcLexeme('rParen',     r'\)'),
+                   VimCalcLexeme('lBracket',   r'\['),
+                   VimCalcLexeme('rBracket',   r'\]'),
                    VimCalcLexeme('factorial',  r'!'),
                    VimCalcLexeme('modulo',     r'%'),
                    VimCalcLexeme('divide',     r'/'),
@@ -144,24 +167,51 @@ vimcalc_lexemes = [VimCalcLexeme('whitespace', r'\s+'),
                    VimCalcLexeme('statusDir',  r':s'),         #shorthand
                    VimCalcLexeme('varDir',     r':vars'),
                    VimCalcLexeme('quitDir',    r':q'),
+                   VimCalcLexeme('undoDir',    r':undo'),
+                   VimCalcLexeme('redoDir',    r':redo'),
+                   VimCalcLexeme('plotDir',    r':plot'),
+                   VimCalcLexeme('loadDir',    r':load\b.*'),  #file names are not tokens
+                   VimCalcLexeme('bitsDir',    r':bits'),
+                   VimCalcLexeme('memDir',     r':mem'),
                    VimCalcLexeme('intDir',     r':int'),
                    VimCalcLexeme('floatDir',   r':float') ]
 
 #takes an expression and uses the language lexemes
 #to produce a sequence of tokens
 def vimcalc_tokenize(expr):
+    tokens, ends = vimcalc_scan(expr, 0)
+    if tokens != [] and tokens[-1].ID == 'ERROR':
+        return [tokens[-1]]
+    return tokens
+
+#tokenizes expr from pos on, returning (tokens, ends) where ends holds the
+#offset each token ends at. Whitespace is dropped. If the rest of expr cannot
+#be tokenized the last token is an ERROR token holding it.
+def vimcalc_scan(expr, pos):
     tokens = []
-    while expr != '':
-        matchedLexeme = False
-        for lexeme in vimcalc_lexemes:
-            match = vimcalc_matchesFront(lexeme.regex, expr)
-            if match != '':
-                tokens.append(VimCalcToken(lexeme.ID, match))
-                expr = expr[len(match):]
-                matchedLexeme = True
-                break
-        if not matchedLexeme: return [VimCalcToken('ERROR', expr)]
-    return [t for t in tokens if t.ID != 'whitespace']
+    ends = []
+    while pos < len(expr):
+        m = VIMCALC_LEXER.match(expr, pos)
+        if not m:
+            tokens.append(VimCalcToken('ERROR', expr[pos:]))
+            ends.append(len(expr))
+            break
+        ID = vimcalc_lexemes[m.lastindex-1].ID
+        pos = m.end()
+        if ID != 'whitespace':
+            tokens.append(VimCalcToken(ID, m.group()))
+            ends.append(pos)
+    return (tokens, ends)
+
+#all of the lexemes in a single regex, tried in order. Every lexeme is one
+#group (groups inside lexemes are made non-capturing) so the index of the group
+#that matched identifies the lexeme.
+#NOTE: lexemes must not match the empty string.
+def vimcalc_compileLexemes(lexemes):
+    return re.compile('|'.join('(' + re.sub(r'(?<!\\)\((?!\?)', '(?:', l.regex) + ')'
+                               for l in lexemes))
+
+VIMCALC_LEXER = vimcalc_compileLexemes(vimcalc_lexemes)
 
 #returns the match if regex matches beginning of string
 #otherwise returns the emtpy string
@@ -180,6 +230,11 @@ def vimcalc_getAttrib(token):
 def vimcalc_getID(token):
     return token.ID
 
+#how far past the end of a token the lexer may have to look to decide on it,
+#e.g. '1e+5' against '1e+x'. Editing a line only changes the tokens ending
+#closer than this to the edit.
+VIMCALC_LEXER_LOOKAHEAD = 8
+
 #### PARSER FUNCTIONS ##########################################################
 
 #TODO: this is all a bit messy due to passing essentially a vector around
@@ -188,7 +243,8 @@ def vimcalc_getID(token):
 
 #vcalc context-free grammar
 #line      -> directive | expr | assign
-#directive -> decDir | octDir | hexDir | binDir | intDir | floatDir | statusDir | varDir | quitDir
+#directive -> decDir | octDir | hexDir | binDir | intDir | floatDir | statusDir | varDir
+#             | varDir @ decnumber | quitDir | undoDir | redoDir
 #assign    -> let assign' | assign'
 #assign'   ->  ident = expr | ident += expr | ident -= expr
 #             | ident *= expr | ident /= expr | ident %= expr | ident **= expr
@@ -198,19 +254,20 @@ def vimcalc_getID(token):
 #term      -> term * factor | term / factor | term % factor
 #             | term << factor | term >> factor | term ! | factor
 #factor    -> expt ** factor | expt
-#expt      -> func | ident | - number | number | ( expr )
+#expt      -> func | ident | - number | number | ( expr ) | [ args ] | [ ]
 #number    -> decnumber | hexnumber | octalnumber | binnumber
 
 #vcalc context-free grammar LL(1) -- to be used with a recursive descent parser
 #line       -> directive | assign | expr
-#directive  -> decDir | octDir | hexDir | binDir | intDir | floatDir | statusDir | varDir | quitDir
+#directive  -> decDir | octDir | hexDir | binDir | intDir | floatDir | statusDir
+#              | varDir [@ decnumber] | quitDir | undoDir | redoDir
 #assign     -> [let] ident (=|+=|-=|*=|/=|%=|**=) expr
 #expr       -> term {(+|-) term}
 #func       -> ident ( args )
 #args       -> expr {, expr}
 #term       -> factor {(*|/|%|<<|>>) factor} [!]
 #factor     -> {expt **} expt
-#expt       -> func | ident | - number | number | ( expr )
+#expt       -> func | ident | - number | number | ( expr ) | [ [args] ]
 #number     -> decnumber | hexnumber | octalnumber | binnumber
 
 class VimCalcParseNode(object):
@@ -226,6 +283,8 @@ class VimCalcParseNode(object):
         return self._result
     def getConsumed(self):
         return self._consumedTokens
+    def setConsumed(self, val):
+        self._consumedTokens = val
     def getStoreInAns(self):
         return self._storeInAns
     def setStoreInAns(self, val):
@@ -238,7 +297,7 @@ class VimCalcParseNode(object):
                        doc='Successfully evaluated?')
     result = property(getResult,
                       doc='The evaluated result at this node.')
-    consumeCount = property(getConsumed,
+    consumeCount = property(getConsumed, setConsumed,
                             doc='Number of consumed tokens.')
     storeInAns = property(getStoreInAns, setStoreInAns,
                           doc='Should store in ans variable?')
@@ -259,45 +318,101 @@ class VimCalcParseException(Exception):
 # recursive descent parser -- simple and befitting the needs of this small
 # program generates the parse tree with evaluated decoration
 def vimcalc_parse(expr):
-    tokens = vimcalc_tokenize(expr)
+    return vimcalc_session().parse(expr)
+
+#the output string for the result of vimcalc_evaluate
+def vimcalc_output(lineNode, error):
+    if error is not None:
+        return error
+    if lineNode.storeInAns:
+        return 'ans = ' + vimcalc_process(lineNode.result)
+    else:
+        if lineNode.assignedSymbol == None:
+            return str(lineNode.result)
+        else:
+            return lineNode.assignedSymbol + ' = ' + vimcalc_process(lineNode.result)
+
+#evaluates a line in the current session, returning (lineNode, None) on success
+#or (None, message)
+def vimcalc_evaluate(expr):
+    return vimcalc_evaluateTokens(vimcalc_session().tokenize(expr))
+
+def vimcalc_evaluateTokens(tokens):
     if vimcalc_symbolCheck('ERROR', 0, tokens):
-        return 'Syntax error: ' + tokens[0].attrib
+        return (None, 'Syntax error: ' + tokens[0].attrib)
+    session = vimcalc_session()
+    isResult = False
+    result = None
+    heap = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else None
     try:
         lineNode = vimcalc_line(tokens)
         if lineNode.success:
             if lineNode.storeInAns:
                 vimcalc_storeSymbol('ans', lineNode.result)
-                return 'ans = ' + vimcalc_process(lineNode.result)
-            else:
-                if lineNode.assignedSymbol == None:
-                    return str(lineNode.result)
-                else:
-                    return lineNode.assignedSymbol + ' = ' + vimcalc_process(lineNode.result)
+            isResult = lineNode.storeInAns or lineNode.assignedSymbol != None
+            result = lineNode.result
+            return (lineNode, None)
         else:
-            return 'Parse error: the expression is invalid.'
+            return (None, 'Parse error: the expression is invalid.')
     except VimCalcParseException as pe:
-        return 'Parse error: ' + pe.message
+        return (None, 'Parse error: ' + pe.message)
+    except (ArithmeticError, ValueError, TypeError) as e:
+        #e.g. adding vectors of different shapes
+        return (None, 'Parse error: ' + str(e))
+    finally:
+        session.journalLine(isResult, result)
+        if heap is not None and tracemalloc.is_tracing():
+            session.lineHeap = tracemalloc.get_traced_memory()[0] - heap
 
-#this function returns an output string based on the global repl directives
+#this function returns an output string based on the session's repl directives
 def vimcalc_process(result):
-    if VIMCALC_OUTPUT_BASE == 'decimal':
+    if vimcalc_isVector(result):
+        return vimcalc_processVector(result)
+    session = vimcalc_session()
+    if session.base == 'decimal':
         output = result
-    elif VIMCALC_OUTPUT_BASE == 'hexadecimal':
-        return str(hex(int(result)))
-    elif VIMCALC_OUTPUT_BASE == 'octal':
-        return re.sub('0[Oo]|0[0o]0', '0', str(oct(int(result))))
-    elif VIMCALC_OUTPUT_BASE == 'binary':
-        return str(bin(int(result)))
+    elif session.bits and session.base != 'decimal':
+        return vimcalc_wordDigits(session, result)
+    elif session.base == 'hexadecimal':
+        return str(hex(vimcalc_int(result)))
+    elif session.base == 'octal':
+        return re.sub('0[Oo]|0[0o]0', '0', str(oct(vimcalc_int(result))))
+    elif session.base == 'binary':
+        return str(bin(vimcalc_int(result)))
     else:
         return 'ERROR'
 
-    if VIMCALC_OUTPUT_PRECISION == 'int':
-        return str(int(output))
-    elif VIMCALC_OUTPUT_PRECISION == 'float':
+    if session.precision == 'int':
+        return vimcalc_intToStr(vimcalc_int(output))
+    elif session.precision == 'float':
+        if isinstance(output, VIMCALC_INT_TYPES):
+            return vimcalc_intToStr(output)
         return str(output)
     else:
         return 'ERROR'
 
+#with a word size, the bits of the result padded to the full width of the word
+def vimcalc_wordDigits(session, result):
+    bits = vimcalc_wrap(result, session.bits, False)
+    if session.base == 'hexadecimal':
+        return '0x' + format(bits, '0%dx' % -(-session.bits // 4))
+    elif session.base == 'octal':
+        return '0' + format(bits, '0%do' % -(-session.bits // 3))
+    else:
+        return '0b' + format(bits, '0%db' % session.bits)
+
+#vectors are formatted element by element; long ones are elided in the middle
+VIMCALC_VECTOR_DISPLAY = 10
+
+def vimcalc_processVector(vector):
+    n = len(vector)
+    if n > VIMCALC_VECTOR_DISPLAY:
+        half = VIMCALC_VECTOR_DISPLAY // 2
+        elems = [vimcalc_process(vector[i]) for i in range(half)] + ['...'] + \
+                [vimcalc_process(vector[i]) for i in range(n-half, n)]
+    else:
+        elems = [vimcalc_process(x) for x in vector]
+    return '[' + ', '.join(elems) + ']'
 
 # Rename from line because there is an interference with plugin VOoM.
 def vimcalc_line(tokens):
@@ -316,42 +431,73 @@ def vimcalc_line(tokens):
     exprNode = vimcalc_expr(tokens)
     if exprNode.success:
         if exprNode.consumeCount == len(tokens):
+            if vimcalc_session().bits:
+                return VimCalcParseNode(True, vimcalc_word(exprNode.result), exprNode.consumeCount)
             return exprNode
         else:
             return VimCalcParseNode(False, 0, exprNode.consumeCount)
     return VimCalcParseNode(False, 0, 0)
 
+#output settings of the default session
 VIMCALC_OUTPUT_BASE      = 'decimal'
 VIMCALC_OUTPUT_PRECISION = 'float'
 
+#word size of the default session, 0 for unbounded integers
+VIMCALC_WORD_BITS   = 0
+VIMCALC_WORD_SIGNED = True
+
 def vimcalc_directive(tokens):
     #TODO: refactor this -- extract method
-    global VIMCALC_OUTPUT_BASE
-    global VIMCALC_OUTPUT_PRECISION
+    session = vimcalc_session()
     if vimcalc_symbolCheck('decDir', 0, tokens):
-        VIMCALC_OUTPUT_BASE = 'decimal'
+        session.base = 'decimal'
         return vimcalc_createDirectiveParseNode('CHANGED OUTPUT BASE TO DECIMAL.')
     if vimcalc_symbolCheck('hexDir', 0, tokens):
-        VIMCALC_OUTPUT_BASE = 'hexadecimal'
+        session.base = 'hexadecimal'
         return vimcalc_createDirectiveParseNode('CHANGED OUTPUT BASE TO HEXADECIMAL.')
     if vimcalc_symbolCheck('octDir', 0, tokens):
-        VIMCALC_OUTPUT_BASE = 'octal'
+        session.base = 'octal'
         return vimcalc_createDirectiveParseNode('CHANGED OUTPUT BASE TO OCTAL.')
     if vimcalc_symbolCheck('binDir', 0, tokens):
-        VIMCALC_OUTPUT_BASE = 'binary'
+        session.base = 'binary'
         return vimcalc_createDirectiveParseNode('CHANGED OUTPUT BASE TO BINARY.')
     if vimcalc_symbolCheck('floatDir', 0, tokens):
-        VIMCALC_OUTPUT_PRECISION = 'float'
+        session.precision = 'float'
         return vimcalc_createDirectiveParseNode('CHANGED OUTPUT PRECISION TO FLOATING POINT.')
     if vimcalc_symbolCheck('intDir', 0, tokens):
-        VIMCALC_OUTPUT_PRECISION = 'int'
+        session.precision = 'int'
         return vimcalc_createDirectiveParseNode('CHANGED OUTPUT PRECISION TO INTEGER.')
     if vimcalc_symbolCheck('statusDir', 0, tokens):
         return vimcalc_createDirectiveParseNode(vimcalc_statusMessage())
     if vimcalc_symbolCheck('varDir', 0, tokens):
+        if vimcalc_symbolCheck('at', 1, tokens):
+            if not vimcalc_symbolCheck('decnumber', 2, tokens) or not tokens[2].attrib.isdigit():
+                raise VimCalcParseException('expected a line number after @.', 2)
+            line = int(tokens[2].attrib)
+            node = vimcalc_createDirectiveParseNode(vimcalc_variablesMessage(line))
+            node.consumeCount = 3
+            return node
         return vimcalc_createDirectiveParseNode(vimcalc_variablesMessage())
     if vimcalc_symbolCheck('quitDir', 0, tokens):
         return vimcalc_createDirectiveParseNode('!!!q!!!')
+    if vimcalc_symbolCheck('undoDir', 0, tokens):
+        return vimcalc_createDirectiveParseNode(vimcalc_undoMessage('UNDID', session.undo()))
+    if vimcalc_symbolCheck('redoDir', 0, tokens):
+        return vimcalc_createDirectiveParseNode(vimcalc_undoMessage('REDID', session.redo()))
+    if vimcalc_symbolCheck('plotDir', 0, tokens):
+        node = vimcalc_createDirectiveParseNode(vimcalc_plotMessage(tokens[1:]))
+        node.consumeCount = len(tokens)
+        return node
+    if vimcalc_symbolCheck('loadDir', 0, tokens):
+        return vimcalc_createDirectiveParseNode(vimcalc_loadMessage(tokens[0].attrib))
+    if vimcalc_symbolCheck('bitsDir', 0, tokens):
+        node = vimcalc_createDirectiveParseNode(vimcalc_bitsMessage(tokens[1:]))
+        node.consumeCount = len(tokens)
+        return node
+    if vimcalc_symbolCheck('memDir', 0, tokens):
+        node = vimcalc_createDirectiveParseNode(vimcalc_memMessage(tokens[1:]))
+        node.consumeCount = len(tokens)
+        return node
     return VimCalcParseNode(False, 0, 0)
 
 def vimcalc_assign(tokens):
@@ -361,6 +507,9 @@ def vimcalc_assign(tokens):
         assignPos = 2
     else:
         return VimCalcParseNode(False, 0, 0)
+    #not an assignment, so leave the rest of the line to vimcalc_expr
+    if assignPos >= len(tokens) or tokens[assignPos].ID not in VIMCALC_ASSIGN_OPS:
+        return VimCalcParseNode(False, 0, assignPos)
 
     exprNode = vimcalc_expr(tokens[assignPos+1:])
     if exprNode.consumeCount+assignPos+1 == len(tokens):
@@ -378,23 +527,28 @@ def vimcalc_assign(tokens):
             elif vimcalc_symbolCheck('mAssign', assignPos, tokens):
                 result = result * exprNode.result
             elif vimcalc_symbolCheck('dAssign', assignPos, tokens):
-                result = result / exprNode.result
+                if not vimcalc_exact():
+                    result = result / exprNode.result
+                else:
+                    result = result // exprNode.result
             elif vimcalc_symbolCheck('modAssign', assignPos, tokens):
                 result = result % exprNode.result
 
             #arguments to bitwise operations must be plain or long integers
             elif vimcalc_symbolCheck('andAssign', assignPos, tokens):
-                result = int(result) & int(exprNode.result)
+                result = vimcalc_word(result) & vimcalc_word(exprNode.result)
             elif vimcalc_symbolCheck('orAssign', assignPos, tokens):
-                result = int(result) | int(exprNode.result)
+                result = vimcalc_word(result) | vimcalc_word(exprNode.result)
             elif vimcalc_symbolCheck('xorAssign', assignPos, tokens):
-                result = int(result) ^ int(exprNode.result)
+                result = vimcalc_word(result) ^ vimcalc_word(exprNode.result)
 
             elif vimcalc_symbolCheck('expAssign', assignPos, tokens):
-                result = result ** exprNode.result
+                result = vimcalc_power(result, exprNode.result)
             else:
                 return VimCalcParseNode(False, 0, assignPos)
 
+        if vimcalc_session().bits:
+            result = vimcalc_word(result)
         vimcalc_storeSymbol(symbol, result)
         node = VimCalcParseNode(True, result, exprNode.consumeCount+assignPos+1)
         node.storeInAns = False
@@ -407,23 +561,28 @@ def vimcalc_expr(tokens):
     termNode = vimcalc_term(tokens)
     consumed = termNode.consumeCount
     if termNode.success:
-        foldNode = vimcalc_foldlParseMult(vimcalc_term,
-                                  [lambda x, y:x+y, lambda x, y:x-y],
-                                  ['plus', 'subtract'],
-                                  termNode.result,
-                                  tokens[consumed:])
+        foldNode = vimcalc_exprTail(termNode.result, tokens[consumed:])
         consumed += foldNode.consumeCount
         return VimCalcParseNode(foldNode.success, foldNode.result, consumed)
     else:
         return VimCalcParseNode(False, 0, consumed)
 
+#the {(+|-) term} part of expr, folded onto initial
+def vimcalc_exprTail(initial, tokens):
+    return vimcalc_foldlParseMult(vimcalc_term, VIMCALC_SUM_OPS, VIMCALC_SUM_SYMS, initial, tokens)
+
 def vimcalc_func(tokens):
     if list(map(vimcalc_getID, tokens[0:2])) == ['ident', 'lParen']:
         sym = tokens[0].attrib
+        if sym in VIMCALC_BINDER_TABLE:
+            binderNode = vimcalc_binder(sym, tokens)
+            if binderNode.success:
+                return binderNode
         argsNode = vimcalc_args(tokens[2:])
         if vimcalc_symbolCheck('rParen', argsNode.consumeCount+2, tokens):
             try:
-                result = vimcalc_lookupFunc(sym)(*argsNode.result)
+                args = argsNode.result if argsNode.success else []
+                result = vimcalc_lookupFunc(sym, args)(*argsNode.result)
                 return VimCalcParseNode(True, result, argsNode.consumeCount+3)
             except TypeError as e:
                 raise VimCalcParseException(str(e), argsNode.consumeCount+3)
@@ -435,6 +594,50 @@ def vimcalc_func(tokens):
     else:
         return VimCalcParseNode(False, 0, 0)
 
+#a call like integrate(x**2, x, 0, 1) with an argument that is an expression
+#over a variable named by another; the expression is passed on unevaluated
+def vimcalc_binder(sym, tokens):
+    fn, counts, usage, body, var = VIMCALC_BINDER_TABLE[sym]
+    #split the arguments at the top level commas
+    spans = []
+    start = 2
+    depth = 0
+    end = None
+    for i in range(2, len(tokens)):
+        ID = tokens[i].ID
+        if ID in ['lParen', 'lBracket']:
+            depth += 1
+        elif ID in ['rParen', 'rBracket'] and depth > 0:
+            depth -= 1
+        elif ID == 'rParen':
+            spans.append(tokens[start:i])
+            end = i
+            break
+        elif ID == 'comma' and depth == 0:
+            spans.append(tokens[start:i])
+            start = i+1
+    if end is None:
+        return VimCalcParseNode(False, 0, 0)
+    if len(spans) not in counts or spans[body] == [] or \
+            list(map(vimcalc_getID, spans[var])) != ['ident']:
+        if sym in VIMCALC_FUNCTION_TABLE:
+            return VimCalcParseNode(False, 0, 0)
+        raise VimCalcParseException('usage: ' + usage + '.', end+1)
+    symbol = spans[var][0].attrib
+    args = []
+    for span in [spans[k] for k in range(len(spans)) if k not in (body, var)]:
+        exprNode = vimcalc_expr(span)
+        if not exprNode.success or exprNode.consumeCount != len(span):
+            raise VimCalcParseException('invalid argument to ' + sym + '().', end+1)
+        args.append(exprNode.result)
+    try:
+        result = fn(spans[body], symbol, *args)
+        return VimCalcParseNode(True, result, end+1)
+    except TypeError as e:
+        raise VimCalcParseException(str(e), end+1)
+    except ValueError as e:
+        raise VimCalcParseException(str(e), end+1)
+
 def vimcalc_args(tokens):
     #returns a list of exprNodes to be used as function arguments
     exprNode = vimcalc_expr(tokens)
@@ -446,21 +649,23 @@ def vimcalc_args(tokens):
         return VimCalcParseNode(False, [], consumed)
 
 def vimcalc_term(tokens):
-    factNode = vimcalc_factor(tokens)
-    consumed = factNode.consumeCount
-    if factNode.success:
-        foldNode = vimcalc_foldlParseMult(vimcalc_factor,
-                                  [lambda x, y:x*y,
-                                      lambda x, y: x/y if VIMCALC_OUTPUT_PRECISION == 'float' else x//y,
-                                      lambda x, y:x%y,
-                                      lambda x, y:int(x)&int(y),
-                                      lambda x, y:int(x)|int(y),
-                                      lambda x, y:int(x)^int(y),
-                                      lambda x, y:int(x)<<int(y), lambda x, y:int(x)>>int(y)],
-                                  ['multiply', 'divide', 'modulo', 'and', 'or',
-                                      'xor', 'lShift', 'rShift'],
-                                  factNode.result,
-                                  tokens[consumed:])
+    partsNode = vimcalc_powerParts(tokens)
+    consumed = partsNode.consumeCount
+    if partsNode.success:
+        base, exponents = partsNode.result
+        #a**b % m goes to three argument pow rather than building a**b. With a
+        #word size the power is already small and is wrapped before the modulo
+        if exponents != [] and not vimcalc_session().bits and vimcalc_symbolCheck('modulo', consumed, tokens):
+            modNode = vimcalc_factor(tokens[consumed+1:])
+            consumed += modNode.consumeCount+1
+            if not modNode.success:
+                return VimCalcParseNode(False, 0, consumed)
+            exponent = vimcalc_foldr(vimcalc_power, exponents[0], exponents[1:])
+            result = vimcalc_powmod(base, exponent, modNode.result, None)
+        else:
+            result = vimcalc_foldr(vimcalc_power, base, exponents)
+        foldNode = vimcalc_foldlParseMult(vimcalc_factor, VIMCALC_PRODUCT_OPS, VIMCALC_PRODUCT_SYMS,
+                                          result, tokens[consumed:])
         consumed += foldNode.consumeCount
         if vimcalc_symbolCheck('factorial', consumed, tokens):
             return VimCalcParseNode(foldNode.success, vimcalc_factorial(foldNode.result), consumed+1)
@@ -470,23 +675,46 @@ def vimcalc_term(tokens):
         return VimCalcParseNode(False, 0, consumed)
 
 def vimcalc_factor(tokens):
+    partsNode = vimcalc_powerParts(tokens)
+    if partsNode.success:
+        base, exponents = partsNode.result
+        return VimCalcParseNode(True, vimcalc_foldr(vimcalc_power, base, exponents), partsNode.consumeCount)
+    else:
+        return partsNode
+
+#the base and exponents of a chain of powers, left unevaluated so that the
+#caller can decide how to combine them
+def vimcalc_powerParts(tokens):
     exptNode = vimcalc_expt(tokens)
     consumed = exptNode.consumeCount
-    result = exptNode.result
     if exptNode.success:
-        foldNode = vimcalc_foldrParse(vimcalc_expt, lambda x, y:x**y, 'exponent', result, tokens[consumed:])
-        return VimCalcParseNode(foldNode.success, foldNode.result, consumed+foldNode.consumeCount)
-    else:
-        return VimCalcParseNode(False, 0, consumed)
+        chainNode = vimcalc_foldlParse(vimcalc_expt, vimcalc_snoc, 'exponent', [], tokens[consumed:])
+        consumed += chainNode.consumeCount
+        if chainNode.success:
+            return VimCalcParseNode(True, (exptNode.result, chainNode.result), consumed)
+    return VimCalcParseNode(False, 0, consumed)
 
 def vimcalc_expt(tokens):
+    vimcalc_session().checkDeadline()
     #function
     funcNode = vimcalc_func(tokens)
     if funcNode.success:
         return funcNode
+    #earlier result: ans[-k]
+    if list(map(vimcalc_getID, tokens[0:2])) == ['ident', 'lBracket'] and tokens[0].attrib == 'ans':
+        exprNode = vimcalc_expr(tokens[2:])
+        if not exprNode.success or not vimcalc_symbolCheck('rBracket', exprNode.consumeCount+2, tokens):
+            raise VimCalcParseException('missing matching bracket after ans.', exprNode.consumeCount+2)
+        back = vimcalc_wholeNumber(exprNode.result)
+        if back is None or back >= 0:
+            raise VimCalcParseException('ans[-k] requires a negative whole number k.', 2)
+        return VimCalcParseNode(True, vimcalc_session().recentResult(-back), exprNode.consumeCount+3)
     #identifier
     if vimcalc_symbolCheck('ident', 0, tokens):
         return VimCalcParseNode(True, vimcalc_lookupSymbol(tokens[0].attrib), 1)
+    #result of line N: $N
+    if vimcalc_symbolCheck('resultRef', 0, tokens):
+        return VimCalcParseNode(True, vimcalc_session().result(int(tokens[0].attrib[1:])), 1)
     #unary -
     if vimcalc_symbolCheck('subtract', 0, tokens):
         numberNode = vimcalc_number(tokens[1:])
@@ -496,6 +724,16 @@ def vimcalc_expt(tokens):
     numberNode = vimcalc_number(tokens)
     if numberNode.success:
         return numberNode
+    #[args] vector or matrix
+    if vimcalc_symbolCheck('lBracket', 0, tokens):
+        argsNode = vimcalc_args(tokens[1:])
+        if argsNode.success or argsNode.consumeCount == 0:
+            if vimcalc_symbolCheck('rBracket', argsNode.consumeCount+1, tokens):
+                vector = vimcalc_array(argsNode.result if argsNode.success else [])
+                return VimCalcParseNode(True, vector, argsNode.consumeCount+2)
+            else:
+                error = 'missing matching bracket in vector.'
+                raise VimCalcParseException(error, argsNode.consumeCount+1)
     #(expr)
     if vimcalc_symbolCheck('lParen', 0, tokens):
         exprNode = vimcalc_expr(tokens[1:])
@@ -509,19 +747,20 @@ def vimcalc_expt(tokens):
 
 def vimcalc_number(tokens):
     if vimcalc_symbolCheck('decnumber', 0, tokens):
-        if VIMCALC_OUTPUT_PRECISION == 'float':
+        precision = vimcalc_session().precision
+        if vimcalc_exact():
+            num = vimcalc_decToInt(tokens[0].attrib)
+        elif precision == 'float':
             num = float(tokens[0].attrib)
-        elif VIMCALC_OUTPUT_PRECISION == 'int':
-            num = int(float(tokens[0].attrib)) #int from float as string input
         else:
             num = 0 #error
         return VimCalcParseNode(True, num, 1)
     elif vimcalc_symbolCheck('hexnumber', 0, tokens):
-        return VimCalcParseNode(True, int(tokens[0].attrib, 16), 1)
+        return VimCalcParseNode(True, vimcalc_bigInt(int(tokens[0].attrib, 16)), 1)
     elif vimcalc_symbolCheck('octnumber', 0, tokens):
-        return VimCalcParseNode(True, int(tokens[0].attrib, 8), 1)
+        return VimCalcParseNode(True, vimcalc_bigInt(int(tokens[0].attrib, 8)), 1)
     elif vimcalc_symbolCheck('binnumber', 0, tokens):
-        return VimCalcParseNode(True, int(tokens[0].attrib, 2), 1)
+        return VimCalcParseNode(True, vimcalc_bigInt(int(tokens[0].attrib, 2)), 1)
     else:
         return VimCalcParseNode(False, 0, 0)
 
@@ -576,28 +815,162 @@ def vimcalc_createDirectiveParseNode(outputMsg):
     return node
 
 def vimcalc_statusMessage():
-    global VIMCALC_OUTPUT_BASE
-    global VIMCALC_OUTPUT_PRECISION
+    session = vimcalc_session()
 
-    base = VIMCALC_OUTPUT_BASE.upper()
-    if VIMCALC_OUTPUT_PRECISION   == 'float' : precision = 'FLOATING POINT'
-    elif VIMCALC_OUTPUT_PRECISION == 'int'   : precision = 'INTEGER'
-    else: VIMCALC_OUTPUT_PRECISION = 'ERROR'
+    base = session.base.upper()
+    if session.precision   == 'float' : precision = 'FLOATING POINT'
+    elif session.precision == 'int'   : precision = 'INTEGER'
+    else: precision = 'ERROR'
     msg = "STATUS: OUTPUT BASE: %s; PRECISION: %s." % (base, precision)
+    if session.bits:
+        msg = msg[:-1] + "; WORD SIZE: %s." % vimcalc_wordName(session)
+    return msg
+
+def vimcalc_wordName(session):
+    return '%d BITS %s' % (session.bits, 'SIGNED' if session.signed else 'UNSIGNED')
+
+#sets the word size from the arguments of :bits
+def vimcalc_bitsMessage(args):
+    session = vimcalc_session()
+    attribs = [t.attrib for t in args]
+    if attribs == ['off']:
+        session.bits = 0
+        return 'CHANGED WORD SIZE TO UNBOUNDED.'
+    if len(args) in [1, 2] and vimcalc_symbolCheck('decnumber', 0, args) and attribs[0].isdigit() \
+            and attribs[1:] in [[], ['signed'], ['unsigned']]:
+        bits = int(attribs[0])
+        if bits < 1 or bits > VIMCALC_MAX_BITS:
+            raise VimCalcParseException('the word size must be from 1 to %d bits.' % VIMCALC_MAX_BITS, 1)
+        session.bits = bits
+        session.signed = attribs[1:] != ['unsigned']
+        return 'CHANGED WORD SIZE TO %s.' % vimcalc_wordName(session)
+    raise VimCalcParseException('usage: :bits N [signed|unsigned] or :bits off.', 1)
+
+#byte multipliers for :mem budget
+VIMCALC_BYTE_UNITS = {'b':1, 'kb':1 << 10, 'k':1 << 10, 'mb':1 << 20, 'm':1 << 20,
+                      'gb':1 << 30, 'g':1 << 30}
+
+#the memory report, or the setting changed by the arguments of :mem
+def vimcalc_memMessage(args):
+    session = vimcalc_session()
+    attribs = [t.attrib for t in args]
+    usage = 'usage: :mem [budget N [kb|mb|gb] | budget off | spill | drop | pin X... | unpin X... | trace [off]].'
+    if attribs == []:
+        return vimcalc_memoryReport(session)
+    if attribs == ['budget', 'off']:
+        session.memoryBudget = 0
+        return 'CHANGED MEMORY BUDGET TO UNLIMITED.'
+    if attribs[0] == 'budget' and len(args) in [2, 3] and vimcalc_symbolCheck('decnumber', 1, args) \
+            and (len(args) == 2 or attribs[2].lower() in VIMCALC_BYTE_UNITS):
+        unit = VIMCALC_BYTE_UNITS[attribs[2].lower()] if len(args) == 3 else 1
+        budget = int(float(attribs[1]) * unit)
+        if budget < 1:
+            raise VimCalcParseException('the memory budget must be at least one byte.', 2)
+        session.memoryBudget = budget
+        return 'CHANGED MEMORY BUDGET TO %s.' % vimcalc_byteSize(budget)
+    if attribs in [['spill'], ['drop']]:
+        session.memoryPolicy = attribs[0]
+        if attribs[0] == 'spill':
+            return 'VALUES OVER THE MEMORY BUDGET WILL BE SPILLED TO DISK.'
+        return 'VALUES OVER THE MEMORY BUDGET WILL BE DROPPED.'
+    if attribs[0] in ['pin', 'unpin'] and len(args) > 1 and \
+            all([vimcalc_symbolCheck('ident', i, args) for i in range(1, len(args))]):
+        if attribs[0] == 'pin':
+            session.pinned.update(attribs[1:])
+            return 'PINNED %s.' % ', '.join(attribs[1:])
+        session.pinned.difference_update(attribs[1:])
+        return 'UNPINNED %s.' % ', '.join(attribs[1:])
+    if attribs == ['trace']:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        return 'STARTED TRACING MEMORY.'
+    if attribs == ['trace', 'off']:
+        tracemalloc.stop()
+        session.lineHeap = None
+        return 'STOPPED TRACING MEMORY.'
+    raise VimCalcParseException(usage, 1)
+
+#previewers and evaluators, whose caches :mem reports
+VIMCALC_MEMO_CACHES = weakref.WeakSet()
+
+def vimcalc_memoryReport(session):
+    held = session.heldValues()
+    bound = [v for v in held.values() if v[3]]
+    history = [v for v in held.values() if not v[3]]
+    rows = [('symbols', '%s in %d values' % (vimcalc_byteSize(sum([v[1] for v in bound])), len(bound))),
+            ('undo history', '%s in %d values' % (vimcalc_byteSize(sum([v[1] for v in history])), len(history)))]
+    store = session.spillStore()
+    if store is not None:
+        rows.append(('spill file', '%s on disk' % vimcalc_byteSize(store.bytes)))
+    rows.append(('results', '%s in %d values' % session.resultsSize()))
+    rows.append(('token cache', '%s in %d lines' % session.tokenCacheSize()))
+    for kind, name in [(VimCalcPreviewer, 'preview cache'), (VimCalcEvaluator, 'eval cache')]:
+        sizes = [c.cacheSize() for c in list(VIMCALC_MEMO_CACHES) if isinstance(c, kind)]
+        rows.append((name, '%s in %d values' % (vimcalc_byteSize(sum([b for b, n in sizes])),
+                                                sum([n for b, n in sizes]))))
+    rows.append(('prime sieve', vimcalc_byteSize(sys.getsizeof(VIMCALC_SIEVE))))
+    lastLine = 'stored ' + vimcalc_byteSize(session.lastLineBytes())
+    if tracemalloc.is_tracing() and session.lineHeap is not None:
+        sign = '-' if session.lineHeap < 0 else '+'
+        lastLine += ', heap %s%s' % (sign, vimcalc_byteSize(abs(session.lineHeap)))
+    rows.append(('last line', lastLine))
+    if session.memoryBudget:
+        policy = 'spilling' if session.memoryPolicy == 'spill' else 'dropping'
+        rows.append(('budget', '%s, %s the largest values' % (vimcalc_byteSize(session.memoryBudget), policy)))
+    else:
+        rows.append(('budget', 'unlimited'))
+    msg = "MEMORY:\n-------\n"
+    for name, text in rows:
+        msg += " " + name.ljust(13) + " : " + text + "\n"
+
+    #variables, largest first
+    sizes = []
+    for name, value in list(session.symbols.items()):
+        if isinstance(value, VimCalcSpilledValue):
+            sizes.append((value.size(), name, ', spilled'))
+        else:
+            sizes.append((vimcalc_valueSize(value), name, ''))
+    width = max([len(name) for size, name, note in sizes] + [0])
+    msg += "\nSYMBOLS BY SIZE:\n---------------\n"
+    for size, name, note in sorted(sizes, key=lambda x: (-x[0], x[1])):
+        if name in session.pinned:
+            note += ', pinned'
+        msg += " " + name.ljust(width) + " : " + vimcalc_byteSize(size) + note + "\n"
     return msg
 
-def vimcalc_variablesMessage():
-    msg = "VARIABLES:\n----------\n"
+#lists the variables, either as they are now or as they were after the given
+#result line
+def vimcalc_variablesMessage(line=None):
+    if line is None:
+        msg = "VARIABLES:\n----------\n"
+        symbols = vimcalc_session().symbols
+    else:
+        title = "VARIABLES AT LINE %d:" % line
+        msg = title + "\n" + "-" * len(title) + "\n"
+        symbols = vimcalc_session().symbolsAt(line)
     #find the longest variable length for alignment
     width = 0
-    for k in list(VIMCALC_SYMBOL_TABLE.keys()):
+    for k in list(symbols.keys()):
         width = max(width, len(k))
 
-    items = sorted(VIMCALC_SYMBOL_TABLE.items())
+    items = sorted(symbols.items())
     for k, v in items:
-        msg += " " + k.ljust(width) + " : " + vimcalc_process(v) + "\n"
+        msg += " " + k.ljust(width) + " : " + vimcalc_process(vimcalc_unspill(v)) + "\n"
     return msg
 
+#message for :undo and :redo, showing the values the variables now have
+def vimcalc_undoMessage(verb, changed):
+    if changed is None:
+        return "NOTHING TO %s." % ('UNDO' if verb == 'UNDID' else 'REDO')
+    line, symbols = changed
+    values = []
+    for symbol, value in symbols:
+        if value is VIMCALC_UNBOUND:
+            values.append(symbol + ' is undefined')
+        else:
+            values.append(symbol + ' = ' + vimcalc_process(vimcalc_unspill(value)))
+    return "%s LINE %d: %s" % (verb, line, ', '.join(values))
+
 # Rather literal haskell implementation of this, proably very unpythonic and
 # inefficient. Should do for the needs of vimcalc however. TODO: in the future
 # improve this!
@@ -613,6 +986,70 @@ def vimcalc_symbolCheck(symbol, index, tokens):
             return True
     return False
 
+#integer coercion that also works elementwise on vectors
+def vimcalc_int(x):
+    if isinstance(x, VIMCALC_INT_TYPES):
+        return x
+    if vimcalc_isArray(x):
+        return x.astype(int)
+    return int(x)
+
+#### BIG INTEGER FUNCTIONS #####################################################
+
+# In integer mode numbers are kept as exact integers. When gmpy2 is installed
+# they are gmpy2.mpz, whose multiplication, powers and shifts are much faster
+# on very large numbers; everything else works the same with plain ints.
+
+if gmpy2 is not None:
+    VIMCALC_INT_TYPES = (int, type(gmpy2.mpz(0)))
+else:
+    VIMCALC_INT_TYPES = (int,)
+
+#whether numbers are exact integers: in integer mode, and whenever there is a
+#word size so that wrapping never loses bits to floating point
+def vimcalc_exact():
+    session = vimcalc_session()
+    return session.precision == 'int' or session.bits != 0
+
+#the integer type used for integer mode numbers
+def vimcalc_bigInt(n):
+    if gmpy2 is not None and vimcalc_session().precision == 'int':
+        return gmpy2.mpz(n)
+    return n
+
+#exact integer value of a decimal literal, truncated towards zero
+def vimcalc_decToInt(literal):
+    if literal.isdigit():
+        return vimcalc_bigInt(vimcalc_strToInt(literal))
+    return vimcalc_bigInt(int(decimal.Decimal(literal)))
+
+#int() and str() refuse very long decimal numbers on newer Pythons, so those
+#are converted in halves
+VIMCALC_STR_DIGITS = 4000
+
+def vimcalc_strToInt(digits):
+    if gmpy2 is not None:
+        return int(gmpy2.mpz(digits))
+    if len(digits) <= VIMCALC_STR_DIGITS:
+        return int(digits)
+    half = len(digits) // 2
+    return vimcalc_strToInt(digits[:-half]) * 10**half + vimcalc_strToInt(digits[-half:])
+
+def vimcalc_intToStr(n):
+    if gmpy2 is not None:
+        return gmpy2.mpz(n).digits(10)
+    if n < 0:
+        return '-' + vimcalc_intToStr(-n)
+    #upper bound on the number of digits
+    digits = int(n.bit_length() * 0.30103) + 1
+    if digits <= VIMCALC_STR_DIGITS:
+        return str(n)
+    half = digits // 2
+    high, low = divmod(n, 10**half)
+    if high == 0:
+        return vimcalc_intToStr(low)
+    return vimcalc_intToStr(high) + vimcalc_intToStr(low).zfill(half)
+
 def vimcalc_snoc(seq, x):  #TODO: find more pythonic way of doing this
     a = seq
     a.append(x)
@@ -620,21 +1057,622 @@ def vimcalc_snoc(seq, x):  #TODO: find more pythonic way of doing this
 
 #### SYMBOL TABLE MANIPULATION FUNCTIONS #######################################
 
-#global symbol table NOTE: these can be rebound
-VIMCALC_SYMBOL_TABLE = {'ans':0,
-                        'e':math.e,
-                       'pi':math.pi,
-                      'phi':1.6180339887498948482}
+#the symbols every session starts with
+VIMCALC_INITIAL_SYMBOLS = {'ans':0,
+                             'e':math.e,
+                            'pi':math.pi,
+                           'phi':1.6180339887498948482}
+
+#symbol table of the default session NOTE: these can be rebound
+VIMCALC_SYMBOL_TABLE = dict(VIMCALC_INITIAL_SYMBOLS)
 
 def vimcalc_lookupSymbol(symbol):
-    if symbol in VIMCALC_SYMBOL_TABLE:
-        return VIMCALC_SYMBOL_TABLE[symbol]
-    else:
-        error = "symbol '" + symbol + "' is not defined."
-        raise VimCalcParseException(error, 0)
+    return vimcalc_session().lookupSymbol(symbol)
 
 def vimcalc_storeSymbol(symbol, value):
-    VIMCALC_SYMBOL_TABLE[symbol] = value
+    vimcalc_session().storeSymbol(symbol, value)
+
+#### CALCULATOR SESSIONS #######################################################
+
+# A session owns the output settings, the symbol table and the token cache of
+# one calculator, so several calculators can be used side by side and from
+# different threads. The parser functions always work on the current thread's
+# session, which the session methods below activate for the duration of a call;
+# anything else (vimcalc_parse, the REPL) uses the default session, whose state
+# is kept in the VIMCALC_OUTPUT_BASE, VIMCALC_OUTPUT_PRECISION and
+# VIMCALC_SYMBOL_TABLE globals.
+#
+# Clones share their parent's symbol table until either of them assigns to a
+# symbol, at which point the one assigning takes its own copy.
+#
+# Every change to the symbol table is journaled as (symbol, old, new), grouped
+# by the line that made it. Lines giving a result (expressions and
+# assignments) are numbered from 1. Undoing a line puts back the old values,
+# and the table as of an earlier line is the current one with the changes made
+# since then undone, so neither needs copies of the whole table.
+
+VIMCALC_TOKEN_CACHE_SIZE = 256
+
+#the number of lines with changes that can be undone
+VIMCALC_JOURNAL_SIZE = 10000
+
+#old value of a symbol that was not defined before
+VIMCALC_UNBOUND = object()
+
+# The value of every result line is also kept, for $N and ans[-k], in a ring
+# that forgets the oldest once it holds too many or too many bytes. Integers
+# of more than a few kilobytes are kept as compressed bytes, and rebuilt when
+# they are asked for.
+
+#the number of results kept
+VIMCALC_RESULT_HISTORY = 1000
+
+#the number of bytes the kept results may take, not counting arrays mapped from
+#files; the latest result is always kept
+VIMCALC_RESULT_BUDGET = 32 << 20
+
+#integers bigger than this are compacted
+VIMCALC_RESULT_COMPACT_BYTES = 1 << 12
+
+#approximate number of bytes a value takes
+def vimcalc_valueSize(value):
+    if vimcalc_isArray(value):
+        if isinstance(value, VIMCALC_NUMPY.memmap) or value.base is not None:
+            return sys.getsizeof(value)
+        if value.dtype == object:
+            return value.nbytes + sum(map(sys.getsizeof, value.flat))
+        return value.nbytes
+    return sys.getsizeof(value)
+
+class VimCalcCompactInt(object):
+    __slots__ = ['_data', '_compressed']
+    def __init__(self, n):
+        n = int(n)
+        data = n.to_bytes(n.bit_length() // 8 + 1, 'little', signed=True)
+        packed = zlib.compress(data, 1)
+        self._compressed = len(packed) < len(data)
+        self._data = packed if self._compressed else data
+    def value(self):
+        data = zlib.decompress(self._data) if self._compressed else self._data
+        return vimcalc_bigInt(int.from_bytes(data, 'little', signed=True))
+    def size(self):
+        return sys.getsizeof(self._data)
+
+class VimCalcResultRing(object):
+    def __init__(self):
+        self._entries = collections.deque()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def append(self, line, value):
+        size = vimcalc_valueSize(value)
+        if isinstance(value, VIMCALC_INT_TYPES) and size > VIMCALC_RESULT_COMPACT_BYTES:
+            value = VimCalcCompactInt(value)
+            size = value.size()
+        with self._lock:
+            self._entries.append((line, value, size))
+            self._bytes += size
+            while len(self._entries) > 1 and (len(self._entries) > VIMCALC_RESULT_HISTORY or
+                                              self._bytes > VIMCALC_RESULT_BUDGET):
+                self._bytes -= self._entries.popleft()[2]
+
+    #the result of the given line, raising VimCalcParseException if it is not
+    #kept, or lastLine is not reached yet
+    def get(self, line, lastLine):
+        with self._lock:
+            if line > lastLine or line < 1:
+                raise VimCalcParseException('there is no result %d yet.' % line, 0)
+            if not self._entries or line < self._entries[0][0]:
+                raise VimCalcParseException('result %d is too old to be recalled.' % line, 0)
+            value = self._entries[line - self._entries[0][0]][1]
+        if isinstance(value, VimCalcCompactInt):
+            return value.value()
+        return value
+
+    def copy(self):
+        ring = VimCalcResultRing()
+        with self._lock:
+            ring._entries = collections.deque(self._entries)
+            ring._bytes = self._bytes
+        return ring
+
+    def __len__(self):
+        return len(self._entries)
+
+    def getBytes(self):
+        return self._bytes
+    bytes = property(getBytes, doc='Bytes taken by the kept results.')
+
+# Sessions also keep an eye on how much memory the values of their variables
+# take, counting old values that are only kept so that lines can be undone.
+# Adding up every value after every line would be slow, so a session only adds
+# the size of each value it stores, and once that estimate goes over the
+# memory budget it measures what it really holds. If that is over the budget
+# too, the largest values are either spilled to a temporary file, to be read
+# back whenever they are used, or dropped, leaving their variables undefined.
+# Pinned variables and the values stored by the line just evaluated are never
+# touched. Each spill or drop comes with a warning after the line's output.
+
+#the default budget in bytes, 0 for none; see :mem
+VIMCALC_MEMORY_BUDGET = 256 << 20
+
+#what happens to values over the budget by default: spill or drop
+VIMCALC_MEMORY_POLICY = 'spill'
+
+#a temporary file values are spilled to, which is deleted once nothing refers
+#to it. Space is not reused.
+class VimCalcSpillStore(object):
+    def __init__(self):
+        self._file = tempfile.TemporaryFile(prefix='vimcalc-')
+        self._lock = threading.Lock()
+        self._bytes = 0
+        weakref.finalize(self, self._file.close)
+
+    def put(self, value):
+        size = vimcalc_valueSize(value)
+        if isinstance(value, VIMCALC_INT_TYPES):
+            value = VimCalcCompactInt(value)
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._file.seek(0, os.SEEK_END)
+            offset = self._file.tell()
+            self._file.write(data)
+            self._bytes += len(data)
+        return VimCalcSpilledValue(self, offset, len(data), size)
+
+    def get(self, offset, length):
+        with self._lock:
+            self._file.seek(offset)
+            data = self._file.read(length)
+        value = pickle.loads(data)
+        if isinstance(value, VimCalcCompactInt):
+            return value.value()
+        return value
+
+    def getBytes(self):
+        return self._bytes
+    bytes = property(getBytes, doc='Bytes written to the file.')
+
+#stands in for a spilled value in the symbol table and the undo journal
+class VimCalcSpilledValue(object):
+    __slots__ = ['_store', '_offset', '_length', '_size']
+    def __init__(self, store, offset, length, size):
+        self._store = store
+        self._offset = offset
+        self._length = length
+        self._size = size
+    def value(self):
+        return self._store.get(self._offset, self._length)
+    def size(self):
+        return self._length
+    def memorySize(self):
+        return self._size
+
+#the value itself, reading it back if it was spilled
+def vimcalc_unspill(value):
+    if isinstance(value, VimCalcSpilledValue):
+        return value.value()
+    return value
+
+#approximate number of bytes an object takes including everything it refers
+#to, for the caches; values are measured by vimcalc_valueSize
+def vimcalc_deepSize(obj, seen=None):
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    if vimcalc_isArray(obj):
+        return vimcalc_valueSize(obj)
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for k, v in obj.items():
+            size += vimcalc_deepSize(k, seen) + vimcalc_deepSize(v, seen)
+    elif isinstance(obj, (list, tuple, set, frozenset, collections.deque)):
+        for x in obj:
+            size += vimcalc_deepSize(x, seen)
+    elif type(obj).__module__ == __name__ and hasattr(obj, '__dict__'):
+        size += vimcalc_deepSize(vars(obj), seen)
+    return size
+
+#a number of bytes for people, e.g. 1.5 MB
+def vimcalc_byteSize(n):
+    if n < 1024:
+        return '%d B' % n
+    for unit in ['KB', 'MB', 'GB']:
+        n /= 1024.0
+        if n < 1024 or unit == 'GB':
+            return '%.1f %s' % (n, unit)
+
+def vimcalc_restore(symbols, symbol, value):
+    if value is VIMCALC_UNBOUND:
+        symbols.pop(symbol, None)
+    else:
+        symbols[symbol] = value
+
+class VimCalcCalculator(object):
+    def __init__(self, symbols=None, base='decimal', precision='float', bits=0, signed=True):
+        if symbols is None:
+            symbols = VIMCALC_INITIAL_SYMBOLS
+        self._symbols = dict(symbols)
+        self._sharedSymbols = False
+        self._base = base
+        self._precision = precision
+        self._bits = bits
+        self._signed = signed
+        self._tokenCache = collections.OrderedDict()
+        self._lock = threading.RLock()
+        self._lineCount = 0
+        self._changes = []
+        self._journal = collections.deque()
+        self._redo = []
+        self._forgotten = 0
+        self._version = 0
+        self._results = VimCalcResultRing()
+        self._pinned = set()
+        self._memoryBudget = None
+        self._memoryPolicy = None
+        self._spill = None
+        self._storedBytes = 0
+        self._lineBytes = 0
+        self._lastLineBytes = 0
+        self._warnings = []
+        #heap growth of the last line evaluated while tracemalloc was tracing
+        self.lineHeap = None
+    def getBase(self):
+        return self._base
+    def setBase(self, val):
+        self._base = val
+    def getPrecision(self):
+        return self._precision
+    def setPrecision(self, val):
+        self._precision = val
+    def getBits(self):
+        return self._bits
+    def setBits(self, val):
+        self._bits = val
+    def getSigned(self):
+        return self._signed
+    def setSigned(self, val):
+        self._signed = val
+    def getSymbols(self):
+        return self._symbols
+    def setSymbols(self, val):
+        self._symbols = val
+    def getVersion(self):
+        return self._version
+    def getPinned(self):
+        return self._pinned
+    def getMemoryBudget(self):
+        if self._memoryBudget is None:
+            return VIMCALC_MEMORY_BUDGET
+        return self._memoryBudget
+    def setMemoryBudget(self, val):
+        self._memoryBudget = val
+    def getMemoryPolicy(self):
+        if self._memoryPolicy is None:
+            return VIMCALC_MEMORY_POLICY
+        return self._memoryPolicy
+    def setMemoryPolicy(self, val):
+        self._memoryPolicy = val
+    base = property(getBase, setBase,
+                    doc='Output base: decimal, hexadecimal, octal or binary.')
+    precision = property(getPrecision, setPrecision,
+                         doc='Output precision: float or int.')
+    bits = property(getBits, setBits,
+                    doc='Word size integers are wrapped to, 0 for none.')
+    signed = property(getSigned, setSigned,
+                      doc='Whether words are two\'s complement [bool].')
+    symbols = property(getSymbols, setSymbols,
+                       doc='Symbol table [dict]. NOTE: may be shared with clones.')
+    version = property(getVersion,
+                       doc='Incremented whenever a symbol changes.')
+    pinned = property(getPinned,
+                      doc='Symbols kept in memory whatever the budget [set].')
+    memoryBudget = property(getMemoryBudget, setMemoryBudget,
+                            doc='Bytes the values of symbols may take, 0 for no limit.')
+    memoryPolicy = property(getMemoryPolicy, setMemoryPolicy,
+                            doc='What happens to values over the budget: spill or drop.')
+
+    @contextlib.contextmanager
+    def activated(self):
+        with self._lock:
+            previous = getattr(VIMCALC_THREAD_STATE, 'session', None)
+            VIMCALC_THREAD_STATE.session = self
+            try:
+                yield self
+            finally:
+                VIMCALC_THREAD_STATE.session = previous
+
+    def parse(self, expr):
+        with self.activated():
+            output = vimcalc_output(*vimcalc_evaluate(expr))
+            warnings = self.takeWarnings()
+            if warnings:
+                output = '\n'.join([output] + warnings)
+            return output
+
+    def evaluate(self, expr):
+        with self.activated():
+            return vimcalc_evaluate(expr)
+
+    def tokenize(self, expr):
+        with self._lock:
+            tokens = self._tokenCache.get(expr)
+            if tokens is None:
+                tokens = vimcalc_tokenize(expr)
+                self._tokenCache[expr] = tokens
+                if len(self._tokenCache) > VIMCALC_TOKEN_CACHE_SIZE:
+                    self._tokenCache.popitem(last=False)
+            else:
+                self._tokenCache.move_to_end(expr)
+            return tokens
+
+    def lookupSymbol(self, symbol):
+        symbols = self.symbols
+        if symbol in symbols:
+            return vimcalc_unspill(symbols[symbol])
+        else:
+            error = "symbol '" + symbol + "' is not defined."
+            raise VimCalcParseException(error, 0)
+
+    def storeSymbol(self, symbol, value):
+        with self._lock:
+            symbols = self._writableSymbols()
+            self._changes.append((symbol, symbols.get(symbol, VIMCALC_UNBOUND), value))
+            symbols[symbol] = value
+            self._version += 1
+            size = vimcalc_valueSize(value)
+            self._lineBytes += size
+            self._storedBytes += size
+
+    #hooks for evaluations that must not take long, see VimCalcPreviewCalculator
+    def checkDeadline(self):
+        pass
+
+    def checkCost(self, bits):
+        pass
+
+    def _writableSymbols(self):
+        if self._sharedSymbols:
+            self.symbols = dict(self.symbols)
+            self._sharedSymbols = False
+        return self.symbols
+
+    #files the changes made by the line just evaluated under its line number,
+    #and keeps its result
+    def journalLine(self, isResult, result=None):
+        with self._lock:
+            changes = self._changes
+            if isResult:
+                self._lineCount += 1
+                self._results.append(self._lineCount, result)
+            if self._changes:
+                self._journal.append((self._lineCount, self._changes))
+                self._changes = []
+                self._redo = []
+                if len(self._journal) > VIMCALC_JOURNAL_SIZE:
+                    self._forgotten = self._journal.popleft()[0]
+            self._lastLineBytes = self._lineBytes
+            self._lineBytes = 0
+            budget = self.memoryBudget
+            if budget and self._storedBytes > budget:
+                self._keepWithin(budget, changes)
+
+    #{id: (value, size, symbol, isBound)} for the values held in memory by the
+    #symbol table and the undo journal, isBound telling whether symbol is bound
+    #to the value now
+    def heldValues(self):
+        with self._lock:
+            held = {}
+            for symbol, value in self.symbols.items():
+                if id(value) not in held:
+                    held[id(value)] = (value, vimcalc_valueSize(value), symbol, True)
+            for line, changes in list(self._journal) + self._redo:
+                for symbol, old, new in changes:
+                    for value in (old, new):
+                        if id(value) not in held:
+                            held[id(value)] = (value, vimcalc_valueSize(value), symbol, False)
+            for key in [k for k, v in held.items()
+                        if v[0] is VIMCALC_UNBOUND or isinstance(v[0], VimCalcSpilledValue)]:
+                del held[key]
+            return held
+
+    #spills or drops the largest values until the rest fit in budget bytes
+    def _keepWithin(self, budget, latest):
+        held = self.heldValues()
+        total = sum([v[1] for v in held.values()])
+        kept = set([id(new) for symbol, old, new in latest])
+        kept.update([id(self.symbols[s]) for s in self._pinned if s in self.symbols])
+        for key in sorted(held, key=lambda k: held[k][1], reverse=True):
+            if total <= budget:
+                break
+            value, size, symbol, isBound = held[key]
+            if key in kept:
+                continue
+            self._evict(value)
+            total -= size
+            name = symbol if isBound else 'an old value of ' + symbol
+            if self.memoryPolicy == 'drop':
+                self._warnings.append('WARNING: DROPPED %s (%s) TO STAY WITHIN THE MEMORY BUDGET.'
+                                      % (name, vimcalc_byteSize(size)))
+            else:
+                self._warnings.append('WARNING: SPILLED %s (%s) TO DISK TO STAY WITHIN THE MEMORY BUDGET.'
+                                      % (name, vimcalc_byteSize(size)))
+        self._storedBytes = total
+
+    #replaces every reference to value by a spilled copy, or drops it
+    def _evict(self, value):
+        if self.memoryPolicy == 'drop':
+            replacement = VIMCALC_UNBOUND
+        else:
+            if self._spill is None:
+                self._spill = VimCalcSpillStore()
+            replacement = self._spill.put(value)
+        symbols = self._writableSymbols()
+        for symbol in [s for s, v in symbols.items() if v is value]:
+            vimcalc_restore(symbols, symbol, replacement)
+        refers = lambda entry: any([old is value or new is value for symbol, old, new in entry[1]])
+        if replacement is VIMCALC_UNBOUND:
+            #a dropped value cannot be brought back, so neither can the lines
+            #referring to it nor anything before them
+            lines = [i for i, entry in enumerate(self._journal) if refers(entry)]
+            for i in range(lines[-1] + 1 if lines else 0):
+                self._forgotten = self._journal.popleft()[0]
+            lines = [i for i, entry in enumerate(self._redo) if refers(entry)]
+            if lines:
+                self._redo = self._redo[lines[-1] + 1:]
+        else:
+            for line, changes in list(self._journal) + self._redo:
+                for i, (symbol, old, new) in enumerate(changes):
+                    if old is value or new is value:
+                        changes[i] = (symbol, replacement if old is value else old,
+                                      replacement if new is value else new)
+        self._version += 1
+
+    #the warnings of the lines evaluated since the last call
+    def takeWarnings(self):
+        if not self._warnings:
+            return []
+        with self._lock:
+            warnings = self._warnings
+            self._warnings = []
+            return warnings
+
+    #the spill file, or None if nothing was spilled
+    def spillStore(self):
+        return self._spill
+
+    #bytes stored by the last line
+    def lastLineBytes(self):
+        return self._lastLineBytes
+
+    #(size, count) of the kept results, the size for people
+    def resultsSize(self):
+        return (vimcalc_byteSize(self._results.bytes), len(self._results))
+
+    def tokenCacheSize(self):
+        with self._lock:
+            return (vimcalc_byteSize(vimcalc_deepSize(self._tokenCache)), len(self._tokenCache))
+
+    #reverts the latest journaled line, returning (line, [(symbol, value)]) with
+    #the restored values, or None if there is nothing to undo
+    def undo(self):
+        with self._lock:
+            if not self._journal:
+                return None
+            line, changes = self._journal.pop()
+            self._redo.append((line, changes))
+            self._version += 1
+            symbols = self._writableSymbols()
+            restored = []
+            for symbol, old, new in reversed(changes):
+                vimcalc_restore(symbols, symbol, old)
+                restored.append((symbol, old))
+            return (line, restored)
+
+    def redo(self):
+        with self._lock:
+            if not self._redo:
+                return None
+            line, changes = self._redo.pop()
+            self._journal.append((line, changes))
+            self._version += 1
+            symbols = self._writableSymbols()
+            for symbol, old, new in changes:
+                vimcalc_restore(symbols, symbol, new)
+            return (line, [(symbol, new) for symbol, old, new in changes])
+
+    #the result of the given result line ($N)
+    def result(self, line):
+        return self._results.get(line, self._lineCount)
+
+    #the result k lines back, ans[-1] being the latest
+    def recentResult(self, k):
+        if k > self._lineCount:
+            raise VimCalcParseException('there are only %d results so far.' % self._lineCount, 0)
+        return self.result(self._lineCount + 1 - k)
+
+    #the symbol table as it was after the given result line
+    def symbolsAt(self, line):
+        with self._lock:
+            if line > self._lineCount:
+                raise VimCalcParseException('there is no line %d yet.' % line, 2)
+            if line < self._forgotten:
+                raise VimCalcParseException('line %d is too old to be recalled.' % line, 2)
+            symbols = dict(self.symbols)
+            for entry in reversed(self._journal):
+                if entry[0] <= line:
+                    break
+                for symbol, old, new in reversed(entry[1]):
+                    vimcalc_restore(symbols, symbol, old)
+            return symbols
+
+    #a new session starting from this one's state
+    def clone(self):
+        with self._lock:
+            session = VimCalcCalculator(None, self.base, self.precision, self.bits, self.signed)
+            session._symbols = self.symbols
+            session._sharedSymbols = True
+            self._sharedSymbols = True
+            session._lineCount = self._lineCount
+            session._forgotten = self._lineCount
+            session._results = self._results.copy()
+            session._pinned = set(self._pinned)
+            session._memoryBudget = self._memoryBudget
+            session._memoryPolicy = self._memoryPolicy
+            session._spill = self._spill
+            return session
+
+    #(symbols, base, precision, bits, signed), a copy of the state that can be
+    #pickled
+    def snapshot(self):
+        with self._lock:
+            symbols = dict([(k, vimcalc_unspill(v)) for k, v in self.symbols.items()])
+            return (symbols, self.base, self.precision, self.bits, self.signed)
+
+#the default session keeps its state in the module globals
+class VimCalcGlobalCalculator(VimCalcCalculator):
+    def getBase(self):
+        return VIMCALC_OUTPUT_BASE
+    def setBase(self, val):
+        global VIMCALC_OUTPUT_BASE
+        VIMCALC_OUTPUT_BASE = val
+    def getPrecision(self):
+        return VIMCALC_OUTPUT_PRECISION
+    def setPrecision(self, val):
+        global VIMCALC_OUTPUT_PRECISION
+        VIMCALC_OUTPUT_PRECISION = val
+    def getBits(self):
+        return VIMCALC_WORD_BITS
+    def setBits(self, val):
+        global VIMCALC_WORD_BITS
+        VIMCALC_WORD_BITS = val
+    def getSigned(self):
+        return VIMCALC_WORD_SIGNED
+    def setSigned(self, val):
+        global VIMCALC_WORD_SIGNED
+        VIMCALC_WORD_SIGNED = val
+    def getSymbols(self):
+        return VIMCALC_SYMBOL_TABLE
+    def setSymbols(self, val):
+        global VIMCALC_SYMBOL_TABLE
+        VIMCALC_SYMBOL_TABLE = val
+    base = property(getBase, setBase)
+    precision = property(getPrecision, setPrecision)
+    bits = property(getBits, setBits)
+    signed = property(getSigned, setSigned)
+    symbols = property(getSymbols, setSymbols)
+
+VIMCALC_THREAD_STATE = threading.local()
+VIMCALC_DEFAULT_SESSION = VimCalcGlobalCalculator()
+
+#the session the current thread is evaluating in
+def vimcalc_session():
+    session = getattr(VIMCALC_THREAD_STATE, 'session', None)
+    if session is None:
+        return VIMCALC_DEFAULT_SESSION
+    return session
 
 
 #### VIMCALC BUILTIN FUNCTIONS #################################################
@@ -643,23 +1681,1207 @@ def vimcalc_loge(n):
     return math.log(n)
 
 def vimcalc_log2(n):
-    return math.log(n, 2)
+    if isinstance(n, VIMCALC_INT_TYPES) and vimcalc_exact():
+        return vimcalc_ilog2(n)
+    return math.log2(n)
+
+def vimcalc_log10(n):
+    if isinstance(n, VIMCALC_INT_TYPES) and vimcalc_exact():
+        return vimcalc_ilog10(n)
+    return math.log10(n)
+
+def vimcalc_sqrt(x):
+    if isinstance(x, VIMCALC_INT_TYPES):
+        if vimcalc_exact():
+            return vimcalc_isqrt(x)
+        try:
+            return math.sqrt(x)
+        except OverflowError:
+            #too big for floating point, the integer part is as close as it gets
+            return vimcalc_isqrt(x)
+    return math.sqrt(x)
 
 def vimcalc_nrt(x, y):
+    #literals are floats in float mode, so accept a whole-number root too
+    if isinstance(y, float) and y.is_integer():
+        y = int(y)
+    if isinstance(x, VIMCALC_INT_TYPES) and isinstance(y, VIMCALC_INT_TYPES) and y > 0:
+        if vimcalc_exact():
+            return vimcalc_iroot(x, y)
+        try:
+            return x**(1/y)
+        except OverflowError:
+            return vimcalc_iroot(x, y)
     return x**(1/y)
 
+#### exact integer roots and logarithms -- these take time roughly proportional
+#### to the number of bits (times the cost of a multiplication) so they stay
+#### usable on numbers with millions of digits
+
+def vimcalc_isqrt(x):
+    x = vimcalc_int(x)
+    if gmpy2 is not None:
+        return gmpy2.isqrt(x)
+    return math.isqrt(x)
+
+#floor of the nth root of x by Newton's iteration
+def vimcalc_iroot(x, n):
+    x = vimcalc_int(x)
+    n = int(n)
+    if n < 1:
+        raise ValueError('root must be a positive integer')
+    if x < 0:
+        if n % 2 == 0:
+            raise ValueError('even root of a negative number')
+        return -vimcalc_iroot(-x, n)
+    if n == 1 or x < 2:
+        return x
+    if n == 2:
+        return vimcalc_isqrt(x)
+    if gmpy2 is not None:
+        return gmpy2.iroot(x, n)[0]
+    bits = x.bit_length()
+    if n >= bits:
+        return 1
+    #start from the root of the leading bits, which is right to about half the
+    #bits of the result, so only a couple of full size steps are needed. Any
+    #starting point lands on or above the root after one step, after which
+    #the iteration decreases until it reaches it.
+    if bits < 960:
+        r = max(1, int(x ** (1.0/n)))
+    else:
+        k = bits // n // 2
+        r = (vimcalc_iroot(x >> (n*k), n) + 1) << k
+    r = ((n-1)*r + x // r**(n-1)) // n
+    while True:
+        s = ((n-1)*r + x // r**(n-1)) // n
+        if s >= r:
+            return r
+        r = s
+
+def vimcalc_ilog2(x):
+    x = vimcalc_int(x)
+    if x <= 0:
+        raise ValueError('math domain error')
+    return x.bit_length() - 1
+
+def vimcalc_ilog10(x):
+    x = vimcalc_int(x)
+    if x <= 0:
+        raise ValueError('math domain error')
+    #the floating point logarithm is only off for numbers just either side of
+    #a power of ten, which are checked exactly
+    estimate = math.log10(x)
+    d = int(estimate)
+    if abs(estimate - round(estimate)) < 1e-9 * max(1.0, estimate):
+        d = int(round(estimate))
+        if x < 10**d:
+            d -= 1
+    return d
+
 def vimcalc_factorial(n):
-    acc = 1
-    for i in range(int(n)):
-        acc *= i+1
-    return acc
+    n = max(int(n), 0)
+    bits = vimcalc_session().bits
+    #n! has n - popcount(n) factors of two, so it is soon 0 in a word
+    if bits and n - bin(n).count('1') >= bits:
+        return 0
+    vimcalc_session().checkCost(n * n.bit_length())
+    if gmpy2 is not None:
+        return vimcalc_bigInt(gmpy2.fac(n))
+    return math.factorial(n)
+
+#x**y, refusing to start on integer powers too big for the session
+def vimcalc_power(x, y):
+    bits = vimcalc_session().bits
+    if bits and not vimcalc_isArray(x) and not vimcalc_isArray(y):
+        x, y = vimcalc_word(x), vimcalc_word(y)
+        if y >= 0:
+            return vimcalc_word(pow(x, y, 1 << bits))
+        return vimcalc_word(x ** y)
+    if isinstance(x, VIMCALC_INT_TYPES) and isinstance(y, VIMCALC_INT_TYPES) and \
+            y > 0 and abs(x) > 1:
+        vimcalc_session().checkCost(y * abs(x).bit_length())
+    return x ** y
 
 def vimcalc_perms(n, k):
-    return int(vimcalc_factorial(n)/vimcalc_factorial(n-k))
+    return vimcalc_factorial(n) // vimcalc_factorial(n-k)
 
 def vimcalc_choose(n, k):
     denominator = vimcalc_factorial(k) * vimcalc_factorial(n-k)
-    return int(vimcalc_factorial(n)/denominator)
+    return vimcalc_factorial(n) // denominator
+
+#### modular arithmetic -- none of these build the full power, so they finish
+#### in milliseconds even on 4096-bit values
+
+#x as an exact integer, or None if it is not a whole number
+def vimcalc_wholeNumber(x):
+    if isinstance(x, VIMCALC_INT_TYPES):
+        return x
+    if isinstance(x, float) and x.is_integer():
+        return int(x)
+    return None
+
+#floats from this on have lost the last digits of the numbers they were
+#written as, so they can not stand in for exact whole numbers
+VIMCALC_FLOAT_WHOLE_LIMIT = 2**53
+
+#x as a whole number for name(), which refuses anything else rather than
+#truncating it
+def vimcalc_wholeArg(name, x):
+    n = vimcalc_wholeNumber(x)
+    if n is None and isinstance(x, numbers.Integral):
+        n = int(x)
+    if n is None:
+        raise ValueError(name + '() requires whole number arguments.')
+    vimcalc_checkExact(name, x)
+    return n
+
+#refuses a float for name() that may have been rounded from the whole number
+#it was written as
+def vimcalc_checkExact(name, x):
+    if isinstance(x, float) and abs(x) >= VIMCALC_FLOAT_WHOLE_LIMIT:
+        raise ValueError(name + '() requires whole numbers below 2**53 in float mode, use :int for larger ones.')
+
+#x**y % m, by three argument pow whenever all three are whole numbers. Floats
+#that may have been rounded are not taken as whole numbers: the builtins named
+#by name refuse them and the % operator works them out as floats instead
+def vimcalc_powmod(x, y, m, name='powmod'):
+    if name is not None:
+        for v in (x, y, m):
+            vimcalc_checkExact(name, v)
+    a, b, n = [None if isinstance(v, float) and abs(v) >= VIMCALC_FLOAT_WHOLE_LIMIT else vimcalc_wholeNumber(v)
+               for v in (x, y, m)]
+    if a is None or b is None or n is None or b < 0 or n == 0:
+        return vimcalc_power(x, y) % m
+    #keep the sign of the modulus as % does
+    result = pow(a, b, abs(n))
+    if n < 0 and result != 0:
+        result += n
+    if any(isinstance(v, float) for v in (x, y, m)):
+        return float(result)
+    return result
+
+def vimcalc_pow(x, y, m=None):
+    if m is None:
+        return math.pow(x, y)
+    return vimcalc_powmod(x, y, m, 'pow')
+
+def vimcalc_modinv(a, m):
+    return pow(vimcalc_wholeArg('modinv', a), -1, vimcalc_wholeArg('modinv', m))
+
+def vimcalc_gcd(*args):
+    result = 0
+    for x in vimcalc_iterArgs(args):
+        result = math.gcd(result, vimcalc_wholeArg('gcd', x))
+    return result
+
+def vimcalc_lcm(*args):
+    result = 1
+    for x in vimcalc_iterArgs(args):
+        x = vimcalc_wholeArg('lcm', x)
+        result = abs(result * x) // math.gcd(result, x) if x != 0 else 0
+    return result
+
+#the x with x = a1 (mod m1), x = a2 (mod m2), ... given as crt(a1,m1,a2,m2,...)
+#the moduli need not be coprime
+def vimcalc_crt(*args):
+    values = [vimcalc_wholeArg('crt', x) for x in vimcalc_iterArgs(args)]
+    if values == [] or len(values) % 2 != 0:
+        raise ValueError('crt() requires pairs of residues and moduli.')
+    x, m = 0, 1
+    for i in range(0, len(values), 2):
+        a, n = values[i], abs(values[i+1])
+        if n == 0:
+            raise ValueError('crt() requires nonzero moduli.')
+        g = math.gcd(m, n)
+        if (a - x) % g != 0:
+            raise ValueError('crt() congruences have no common solution.')
+        #step x by multiples of m until it is also a mod n
+        x += m * ((a - x) // g * pow(m // g, -1, n // g) % (n // g))
+        m = m // g * n
+    return x % m
+
+#### fixed width integers -- with ':bits N' every result, and every operand of
+#### a bitwise operator, is wrapped to N bits, so values stay small however
+#### often they are shifted
+
+VIMCALC_MAX_BITS = 4096
+
+#the value of the low bits of x, as two's complement if signed
+def vimcalc_wrap(x, bits, signed):
+    x = vimcalc_int(x) & ((1 << bits) - 1)
+    if signed and x >> (bits - 1):
+        x -= 1 << bits
+    return x
+
+#x as an integer, wrapped to the session's word size if it has one
+def vimcalc_word(x):
+    session = vimcalc_session()
+    if vimcalc_isArray(x):
+        if session.bits == 0:
+            return vimcalc_int(x)
+        return vimcalc_array([vimcalc_word(v) for v in x.flat]).reshape(x.shape)
+    if session.bits == 0:
+        return vimcalc_int(x)
+    return vimcalc_wrap(x, session.bits, session.signed)
+
+#a binary operator on the operands wrapped to the word size, wrapping its
+#result too, so that values never grow past the word
+def vimcalc_wordOp(fn):
+    def apply(x, y):
+        if vimcalc_session().bits:
+            return vimcalc_word(fn(vimcalc_word(x), vimcalc_word(y)))
+        return fn(x, y)
+    return apply
+
+def vimcalc_shiftLeft(x, y):
+    x, y = vimcalc_word(x), vimcalc_int(y)
+    bits = vimcalc_session().bits
+    if bits == 0:
+        return x << y
+    if y < 0:
+        raise ValueError('negative shift count')
+    return vimcalc_word(x << min(y, bits))
+
+#the operators of expr and term with the tokens naming them, built once here
+#rather than on every call to the parser
+VIMCALC_SUM_OPS = [vimcalc_wordOp(lambda x, y:x+y), vimcalc_wordOp(lambda x, y:x-y)]
+VIMCALC_SUM_SYMS = ['plus', 'subtract']
+VIMCALC_PRODUCT_OPS = [vimcalc_wordOp(lambda x, y:x*y),
+                       vimcalc_wordOp(lambda x, y: x//y if vimcalc_exact() else x/y),
+                       vimcalc_wordOp(lambda x, y:x%y),
+                       lambda x, y:vimcalc_word(x)&vimcalc_word(y),
+                       lambda x, y:vimcalc_word(x)|vimcalc_word(y),
+                       lambda x, y:vimcalc_word(x)^vimcalc_word(y),
+                       vimcalc_shiftLeft,
+                       lambda x, y:vimcalc_word(x)>>vimcalc_int(y)]
+VIMCALC_PRODUCT_SYMS = ['multiply', 'divide', 'modulo', 'and', 'or',
+                        'xor', 'lShift', 'rShift']
+
+#the word size for the functions below, either given or the session's
+def vimcalc_bitsFor(name, width):
+    if width is None:
+        width = vimcalc_session().bits
+        if width == 0:
+            raise ValueError(name + '() requires a word size, set one with :bits or give it as the last argument.')
+    width = vimcalc_int(width)
+    if width < 1 or width > VIMCALC_MAX_BITS:
+        raise ValueError(name + '() requires a word size from 1 to %d bits.' % VIMCALC_MAX_BITS)
+    return width
+
+#the bits of x as an unsigned number of the given width
+def vimcalc_bitsOf(name, x, width):
+    x = vimcalc_int(x)
+    if width is None and vimcalc_session().bits == 0:
+        if x < 0:
+            raise ValueError(name + '() requires a non-negative number without a word size.')
+        return x
+    return vimcalc_wrap(x, vimcalc_bitsFor(name, width), False)
+
+#applies fn to each element of an array, or to a single number
+def vimcalc_elementwise(fn):
+    def apply(x, *args):
+        if vimcalc_isArray(x):
+            return vimcalc_array([fn(v, *args) for v in x.flat]).reshape(x.shape)
+        return fn(x, *args)
+    return apply
+
+def vimcalc_popcount(x, width=None):
+    return bin(vimcalc_bitsOf('popcount', x, width)).count('1')
+
+def vimcalc_clz(x, width=None):
+    width = vimcalc_bitsFor('clz', width)
+    return width - vimcalc_bitsOf('clz', x, width).bit_length()
+
+def vimcalc_ctz(x, width=None):
+    x = vimcalc_bitsOf('ctz', x, width)
+    if x == 0:
+        return vimcalc_bitsFor('ctz', width)
+    return (x & -x).bit_length() - 1
+
+def vimcalc_rotl(x, n, width=None):
+    width = vimcalc_bitsFor('rotl', width)
+    x = vimcalc_wrap(x, width, False)
+    n = vimcalc_int(n) % width
+    rotated = ((x << n) | (x >> (width - n))) & ((1 << width) - 1)
+    return vimcalc_word(rotated) if vimcalc_session().bits else rotated
+
+def vimcalc_rotr(x, n, width=None):
+    width = vimcalc_bitsFor('rotr', width)
+    return vimcalc_rotl(x, -vimcalc_int(n) % width, width)
+
+#### prime numbers -- small numbers are looked up in a sieve which is only
+#### built, one byte per number, as far as it is needed; larger ones are left to
+#### Miller-Rabin and Pollard's rho
+
+VIMCALC_SIEVE = bytearray(b'\x00\x00\x01\x01')
+
+#the sieve never grows past this many numbers (one byte each)
+VIMCALC_SIEVE_MAX = 1 << 24
+
+#factor() trial divides by the primes below this before trying Pollard's rho,
+#and isprime() sieves rather than testing numbers below it
+VIMCALC_TRIAL_LIMIT = 1 << 16
+
+#Miller-Rabin with these bases is exact for every n below
+#3317044064679887385961981, which includes all 64-bit numbers
+VIMCALC_PRIME_BASES = [2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37]
+VIMCALC_PRIME_BASES_LIMIT = 3317044064679887385961981
+
+#random bases tried on top of those for larger numbers
+VIMCALC_PRIME_ROUNDS = 20
+
+#the sieve extended to cover n if it does not already; the new numbers are
+#sieved on their own using the primes already found
+def vimcalc_sieve(n):
+    global VIMCALC_SIEVE
+    sieve = VIMCALC_SIEVE
+    if n < len(sieve):
+        return sieve
+    old = len(sieve)
+    size = min(max(n + 1, 2 * old), VIMCALC_SIEVE_MAX)
+    session = vimcalc_session()
+    session.checkCost(8 * (size - old))
+    sieve = sieve + bytearray([1]) * (size - old)
+    for p in range(2, math.isqrt(size - 1) + 1):
+        if sieve[p]:
+            session.checkDeadline()
+            start = max(p * p, (old + p - 1) // p * p)
+            sieve[start::p] = bytes(len(range(start, size, p)))
+    VIMCALC_SIEVE = sieve
+    return sieve
+
+def vimcalc_isprime(n):
+    return int(vimcalc_isPrime(vimcalc_wholeArg('isprime', n)))
+
+def vimcalc_isPrime(n):
+    if n < VIMCALC_TRIAL_LIMIT:
+        return n >= 0 and vimcalc_sieve(n)[n] == 1
+    if n < len(VIMCALC_SIEVE):
+        return VIMCALC_SIEVE[n] == 1
+    #each round is a power modulo n with an exponent as long as n
+    session = vimcalc_session()
+    session.checkCost(n.bit_length() ** 2)
+    if gmpy2 is not None:
+        return gmpy2.is_prime(n, VIMCALC_PRIME_ROUNDS + len(VIMCALC_PRIME_BASES))
+    for p in VIMCALC_PRIME_BASES:
+        if n % p == 0:
+            return False
+    d, s = n - 1, 0
+    while d % 2 == 0:
+        d, s = d // 2, s + 1
+    bases = VIMCALC_PRIME_BASES
+    if n >= VIMCALC_PRIME_BASES_LIMIT:
+        bases = bases + [random.randrange(2, n - 1) for i in range(VIMCALC_PRIME_ROUNDS)]
+    for a in bases:
+        session.checkDeadline()
+        x = pow(a, d, n)
+        if x == 1 or x == n - 1:
+            continue
+        for i in range(s - 1):
+            x = x * x % n
+            if x == n - 1:
+                break
+        else:
+            return False
+    return True
+
+def vimcalc_nextprime(n):
+    n = vimcalc_int(n)
+    if n < 2:
+        return 2
+    if gmpy2 is not None:
+        return vimcalc_bigInt(gmpy2.next_prime(n))
+    n += 1 + n % 2
+    while not vimcalc_isPrime(n):
+        vimcalc_session().checkDeadline()
+        n += 2
+    return n
+
+#the number of primes <= n, counted in the sieve if it can reach n and by the
+#Lucy Hedgehog method, in time about n**(3/4), otherwise
+def vimcalc_primepi(n):
+    n = vimcalc_int(n)
+    if n < 2:
+        return 0
+    if n < VIMCALC_SIEVE_MAX:
+        return vimcalc_sieve(n).count(1, 0, n + 1)
+    r = math.isqrt(n)
+    vimcalc_session().checkCost(r * r.bit_length())
+    #small[v] counts up to v, large[i] up to n//i, both starting with every
+    #number but 1 and losing the multiples of each prime p in turn
+    small = [v - 1 for v in range(r + 1)]
+    large = [0] + [n // i - 1 for i in range(1, r + 1)]
+    for p in range(2, r + 1):
+        if small[p] == small[p - 1]:
+            continue
+        vimcalc_session().checkDeadline()
+        count = small[p - 1]
+        square = p * p
+        for i in range(1, min(r, n // square) + 1):
+            d = i * p
+            if d <= r:
+                large[i] -= large[d] - count
+            else:
+                large[i] -= small[n // d] - count
+        for v in range(r, square - 1, -1):
+            small[v] -= small[v // p] - count
+    return large[1]
+
+#the prime factors of n in increasing order, repeated according to multiplicity
+def vimcalc_primeFactors(n):
+    n = vimcalc_wholeArg('factor', n)
+    if n < 1:
+        raise ValueError('factor() requires a positive integer.')
+    factors = []
+    sieve = vimcalc_sieve(VIMCALC_TRIAL_LIMIT)
+    p = 2
+    while p < VIMCALC_TRIAL_LIMIT and p * p <= n:
+        if p % 1024 == 0:
+            vimcalc_session().checkDeadline()
+        if sieve[p]:
+            while n % p == 0:
+                factors.append(p)
+                n //= p
+        p += 1
+    if n > 1:
+        factors.extend(vimcalc_factorLarge(n))
+    return vimcalc_numpy().array(sorted(factors))
+
+#factors of n, which has no prime factors below the trial division limit
+def vimcalc_factorLarge(n):
+    if n < VIMCALC_TRIAL_LIMIT ** 2 or vimcalc_isPrime(n):
+        return [n]
+    d = vimcalc_pollardBrent(n)
+    return vimcalc_factorLarge(d) + vimcalc_factorLarge(n // d)
+
+#a nontrivial divisor of the composite n by Brent's variant of Pollard's rho,
+#which multiplies the differences together to take one gcd per batch of steps
+def vimcalc_pollardBrent(n):
+    while True:
+        y, c, m = random.randrange(1, n), random.randrange(1, n), 128
+        g = r = q = 1
+        while g == 1:
+            vimcalc_session().checkDeadline()
+            x = y
+            for i in range(r):
+                y = (y * y + c) % n
+            k = 0
+            while k < r and g == 1:
+                vimcalc_session().checkDeadline()
+                ys = y
+                for i in range(min(m, r - k)):
+                    y = (y * y + c) % n
+                    q = q * abs(x - y) % n
+                g = math.gcd(q, n)
+                k += m
+            r *= 2
+        if g == n:
+            #the batch overshot; step through it one gcd at a time
+            while True:
+                ys = (ys * ys + c) % n
+                g = math.gcd(abs(x - ys), n)
+                if g > 1:
+                    break
+        if g != n:
+            return g
+
+#### vectors and matrices -- NumPy is only imported when the first one is built
+
+VIMCALC_NUMPY = None
+
+def vimcalc_numpy():
+    global VIMCALC_NUMPY
+    if VIMCALC_NUMPY is None:
+        try:
+            import numpy
+        except ImportError:
+            raise VimCalcParseException('vectors require NumPy to be installed.', 0)
+        VIMCALC_NUMPY = numpy
+    return VIMCALC_NUMPY
+
+def vimcalc_isArray(v):
+    return VIMCALC_NUMPY is not None and isinstance(v, VIMCALC_NUMPY.ndarray)
+
+def vimcalc_array(elements):
+    np = vimcalc_numpy()
+    try:
+        return np.array(elements)
+    except ValueError:
+        raise VimCalcParseException('rows of a matrix must all be the same length.', 0)
+
+def vimcalc_inv(x):
+    if vimcalc_isArray(x):
+        return vimcalc_numpy().linalg.inv(x)
+    return 1/x
+
+def vimcalc_dot(x, y):
+    return vimcalc_numpy().dot(x, y)
+
+def vimcalc_det(m):
+    return vimcalc_numpy().linalg.det(m)
+
+def vimcalc_solve(a, b):
+    return vimcalc_numpy().linalg.solve(a, b)
+
+#### statistical aggregates -- these accept any number of arguments, any of which
+#### may be a sequence of values.
+
+def vimcalc_isVector(v):
+    return hasattr(v, '__iter__') and not isinstance(v, str)
+
+#float arrays, e.g. data loaded with :load, are aggregated by NumPy a chunk at
+#a time rather than a value at a time; a mapped file is then read through once
+#and never turned into Python floats
+VIMCALC_ARRAY_CHUNK = 1 << 20
+
+def vimcalc_isFloatArray(v):
+    return vimcalc_isArray(v) and v.dtype.kind == 'f'
+
+#returns (chunks, others): the chunks of the float arrays among args and the
+#remaining arguments
+def vimcalc_splitArgs(args):
+    arrays = [a.reshape(-1) for a in args if vimcalc_isFloatArray(a)]
+    others = [a for a in args if not vimcalc_isFloatArray(a)]
+    chunks = (a[i:i+VIMCALC_ARRAY_CHUNK] for a in arrays
+              for i in range(0, len(a), VIMCALC_ARRAY_CHUNK))
+    return (chunks, others)
+
+#generator flattening the arguments of an aggregate without copying sequences
+def vimcalc_iterArgs(args):
+    for a in args:
+        if vimcalc_isArray(a):
+            for x in a.flat:
+                yield x
+        elif vimcalc_isVector(a):
+            for x in vimcalc_iterArgs(a):
+                yield x
+        else:
+            yield a
+
+#math.fsum keeps the sum exact until the final rounding; integers are kept
+#aside so that an all-integer sum stays an exact integer
+def vimcalc_sum(*args):
+    chunks, args = vimcalc_splitArgs(args)
+    intTotal = [0, True]
+    def floats():
+        for x in vimcalc_iterArgs(args):
+            if isinstance(x, VIMCALC_INT_TYPES):
+                intTotal[0] += x
+            else:
+                intTotal[1] = False
+                yield x
+        for c in chunks:
+            intTotal[1] = False
+            yield float(c.sum())
+    total = math.fsum(floats())
+    if intTotal[1]:
+        return intTotal[0]
+    return math.fsum([total, intTotal[0]])
+
+#one-pass Welford update, returns (count, mean, sum of squared deviations).
+#Chunks of float arrays are summarised by NumPy and merged in (Chan et al.)
+def vimcalc_welford(args):
+    chunks, args = vimcalc_splitArgs(args)
+    n = 0
+    mean = 0.0
+    m2 = 0.0
+    for x in vimcalc_iterArgs(args):
+        n += 1
+        delta = x - mean
+        mean += delta / n
+        m2 += delta * (x - mean)
+    for c in chunks:
+        k = len(c)
+        cmean = float(c.mean())
+        cm2 = float(((c - cmean)**2).sum())
+        delta = cmean - mean
+        total = n + k
+        mean += delta * k / total
+        m2 += cm2 + delta * delta * n * k / total
+        n = total
+    return (n, mean, m2)
+
+def vimcalc_mean(*args):
+    n, mean, m2 = vimcalc_welford(args)
+    if n == 0:
+        raise ValueError('mean() requires at least one value.')
+    return mean
+
+#sample variance
+def vimcalc_var(*args):
+    n, mean, m2 = vimcalc_welford(args)
+    if n < 2:
+        raise ValueError('var() requires at least two values.')
+    return m2 / (n-1)
+
+def vimcalc_stddev(*args):
+    return math.sqrt(vimcalc_var(*args))
+
+#the values of the arguments, with each chunk of a float array reduced to one
+#value, e.g. by its minimum
+def vimcalc_reducedArgs(args, reduce):
+    chunks, args = vimcalc_splitArgs(args)
+    for x in vimcalc_iterArgs(args):
+        yield x
+    for c in chunks:
+        yield float(reduce(c))
+
+#quickselect: partially orders lst in place so that lst[k] is the kth smallest
+def vimcalc_select(lst, k):
+    lo, hi = 0, len(lst)-1
+    while lo < hi:
+        pivot = lst[random.randint(lo, hi)]
+        i, j = lo, hi
+        while i <= j:
+            while lst[i] < pivot: i += 1
+            while lst[j] > pivot: j -= 1
+            if i <= j:
+                lst[i], lst[j] = lst[j], lst[i]
+                i += 1
+                j -= 1
+        if k <= j:
+            hi = j
+        elif k >= i:
+            lo = i
+        else:
+            break
+    return lst[k]
+
+#linearly interpolated value at rank p (0 <= p <= 100)
+def vimcalc_rank(name, p, args):
+    if any(map(vimcalc_isFloatArray, args)):
+        return vimcalc_arrayRank(name, p, args)
+    values = list(vimcalc_iterArgs(args))
+    if values == []:
+        raise ValueError(name + '() requires at least one value.')
+    if p < 0 or p > 100:
+        raise ValueError(name + '() requires a percentile between 0 and 100.')
+    rank = p / 100 * (len(values)-1)
+    k = int(rank)
+    low = vimcalc_select(values, k)
+    if rank == k:
+        return low
+    #everything after k is now >= values[k]
+    high = min(values[i] for i in range(k+1, len(values)))
+    return low + (rank-k) * (high-low)
+
+#the same as vimcalc_rank but selecting in a single float array, which takes 8
+#bytes a value instead of a Python float each. That array is the only copy of
+#the values made; it is partitioned in place rather than copied again
+def vimcalc_arrayRank(name, p, args):
+    np = vimcalc_numpy()
+    chunks, others = vimcalc_splitArgs(args)
+    values = np.concatenate(list(chunks) + [np.array(list(vimcalc_iterArgs(others)), dtype=float)])
+    if len(values) == 0:
+        raise ValueError(name + '() requires at least one value.')
+    if p < 0 or p > 100:
+        raise ValueError(name + '() requires a percentile between 0 and 100.')
+    return float(np.percentile(values, p, overwrite_input=True))
+
+def vimcalc_median(*args):
+    return vimcalc_rank('median', 50, args)
+
+def vimcalc_percentile(p, *args):
+    return vimcalc_rank('percentile', p, args)
+
+#### functions of an expression -- integrate() and solve() take an expression
+#### over a variable and evaluate it at whole batches of points at once, binding
+#### the variable to a NumPy array when the expression allows it
+
+#a session which reads through to its parent but has one extra symbol bound
+class VimCalcBoundCalculator(VimCalcCalculator):
+    def __init__(self, parent, symbol):
+        VimCalcCalculator.__init__(self, {}, parent.base, parent.precision, parent.bits, parent.signed)
+        self._parent = parent
+        self._symbol = symbol
+        self.value = None
+    def lookupSymbol(self, symbol):
+        if symbol == self._symbol:
+            return self.value
+        return self._parent.lookupSymbol(symbol)
+    def journalLine(self, isResult, result=None):
+        pass
+    def result(self, line):
+        return self._parent.result(line)
+    def recentResult(self, k):
+        return self._parent.recentResult(k)
+    def checkDeadline(self):
+        self._parent.checkDeadline()
+    def checkCost(self, bits):
+        self._parent.checkCost(bits)
+
+#returns evaluate(x) giving the value of the expression with the variable
+#bound to x, which may be an array
+def vimcalc_boundEvaluator(name, tokens, symbol):
+    calc = VimCalcBoundCalculator(vimcalc_session(), symbol)
+    def evaluate(x):
+        calc.value = x
+        with calc.activated():
+            node = vimcalc_expr(tokens)
+        if not node.success or node.consumeCount != len(tokens):
+            raise VimCalcParseException('invalid expression given to ' + name + '().', 0)
+        return node.result
+    return evaluate
+
+#returns sample(points) giving the value of the expression at each point, nan
+#where it is undefined. The expression is evaluated once per batch with the
+#variable bound to an array if vimcalc_batchable allows it, unless that turns
+#out not to give the same values as evaluating point by point.
+def vimcalc_sampler(name, tokens, symbol):
+    evaluate = vimcalc_boundEvaluator(name, tokens, symbol)
+    def scalar(points):
+        values = []
+        error = None
+        for x in points:
+            try:
+                values.append(float(evaluate(x)))
+            except (VimCalcParseException, ArithmeticError, TypeError, ValueError) as e:
+                error = error or e
+                values.append(float('nan'))
+        #a mistake in the expression rather than a point outside its domain
+        if error is not None and all(map(math.isnan, values)):
+            raise error
+        return values
+
+    try:
+        np = vimcalc_numpy()
+    except VimCalcParseException:
+        return scalar
+    state = {'vectorized': vimcalc_batchable(tokens), 'checked': False}
+    def sample(points):
+        if state['vectorized']:
+            try:
+                with np.errstate(all='ignore'):
+                    values = evaluate(np.array(points, dtype=float))
+                values = vimcalc_batchValues(np.asarray(values, dtype=float), points, tokens, symbol)
+            except (VimCalcParseException, ArithmeticError, TypeError, ValueError):
+                values = None
+            if values is not None and not state['checked']:
+                state['checked'] = True
+                ends = [points[0], points[-1]]
+                for x, y in zip(scalar(ends), [values[0], values[-1]]):
+                    if not (vimcalc_sameValue(x, y) or (math.isnan(x) and math.isnan(y))):
+                        values = None
+            if values is not None:
+                return values
+            state['vectorized'] = False
+        return scalar(points)
+    return sample
+
+#whether an expression may be evaluated with its variable bound to an array
+#of points: every function it calls must have an elementwise version, as the
+#others, e.g. the aggregates, fold the whole array into one value
+def vimcalc_batchable(tokens):
+    return all(tokens[i].attrib in VIMCALC_ARRAY_FUNCTION_TABLE for i in range(len(tokens) - 1)
+               if tokens[i].ID == 'ident' and tokens[i+1].ID == 'lParen')
+
+#the list of values at each of the points from an evaluation at all of them
+#at once, or None if it did not give one value per point. Only an expression
+#that does not mention its variable may give a single value for them all.
+def vimcalc_batchValues(values, points, tokens, symbol):
+    np = vimcalc_numpy()
+    values = np.asarray(values)
+    if values.shape != (len(points),):
+        if values.shape != () or any(t.ID == 'ident' and t.attrib == symbol for t in tokens):
+            return None
+        values = np.broadcast_to(values, (len(points),))
+    return values.tolist()
+
+#whether a value computed elementwise matches the one computed on its own
+def vimcalc_sameValue(x, y):
+    try:
+        return x == y or abs(x - y) <= 1e-12 * abs(x)
+    except TypeError:
+        return False
+
+#Gauss-Kronrod 7-15 point rule on [-1, 1]: the Kronrod weights of all 15 nodes
+#and the Gauss weights of the 7 nodes shared with it
+VIMCALC_KRONROD_NODES = [0.991455371120812639206854697526329,
+                         0.949107912342758524526189684047851,
+                         0.864864423359769072789712788640926,
+                         0.741531185599394439863864773280788,
+                         0.586087235467691130294144845693013,
+                         0.405845151377397166906606412076961,
+                         0.207784955007898467600689403773245]
+VIMCALC_KRONROD_NODES = [-x for x in VIMCALC_KRONROD_NODES] + [0.0] + VIMCALC_KRONROD_NODES[::-1]
+VIMCALC_KRONROD_WEIGHTS = [0.022935322010529224963732008058970,
+                           0.063092092629978553290700663189204,
+                           0.104790010322250183839876322541518,
+                           0.140653259715525918745189590510238,
+                           0.169004726639267902826583426598550,
+                           0.190350578064785409913256402421014,
+                           0.204432940075298892414161999234649]
+VIMCALC_KRONROD_WEIGHTS = VIMCALC_KRONROD_WEIGHTS + [0.209482141084727828012999174891714] + VIMCALC_KRONROD_WEIGHTS[::-1]
+VIMCALC_GAUSS_WEIGHTS = [0.129484966168869693270611432679082,
+                         0.279705391489276667901467771423780,
+                         0.381830050505118944950369775488975]
+VIMCALC_GAUSS_WEIGHTS = [0.0, VIMCALC_GAUSS_WEIGHTS[0], 0.0, VIMCALC_GAUSS_WEIGHTS[1], 0.0,
+                         VIMCALC_GAUSS_WEIGHTS[2], 0.0, 0.417959183673469387755102040816327,
+                         0.0, VIMCALC_GAUSS_WEIGHTS[2], 0.0, VIMCALC_GAUSS_WEIGHTS[1], 0.0,
+                         VIMCALC_GAUSS_WEIGHTS[0], 0.0]
+
+#relative accuracy integrate() aims for
+VIMCALC_INTEGRATE_TOLERANCE = 1e-10
+
+#how many subintervals integrate() may use before it gives up
+VIMCALC_INTEGRATE_MAX_INTERVALS = 2000
+
+#adaptive Gauss-Kronrod quadrature; every round evaluates the nodes of all the
+#subintervals still being refined as one batch and halves those whose error
+#estimate is more than their share of the tolerance
+def vimcalc_integrate(tokens, symbol, a, b):
+    a, b = float(a), float(b)
+    if not (math.isfinite(a) and math.isfinite(b)):
+        raise ValueError('integrate() requires finite limits.')
+    if a == b:
+        return 0.0
+    sign = 1.0
+    if a > b:
+        a, b, sign = b, a, -1.0
+    sample = vimcalc_sampler('integrate', tokens, symbol)
+    done = []
+    pending = [(a, b)]
+    while pending:
+        points = [(l+r)/2 + (r-l)/2 * t for l, r in pending for t in VIMCALC_KRONROD_NODES]
+        values = sample(points)
+        if not all(map(math.isfinite, values)):
+            raise ValueError('integrate() requires an expression that is finite between the limits.')
+        estimates = []
+        for i, (l, r) in enumerate(pending):
+            f = values[15*i:15*i+15]
+            kronrod = (r-l)/2 * math.fsum(w*y for w, y in zip(VIMCALC_KRONROD_WEIGHTS, f))
+            gauss = (r-l)/2 * math.fsum(w*y for w, y in zip(VIMCALC_GAUSS_WEIGHTS, f))
+            estimates.append((l, r, kronrod, abs(kronrod-gauss)))
+        scale = math.fsum(abs(e[2]) for e in done + estimates)
+        tolerance = VIMCALC_INTEGRATE_TOLERANCE * scale
+        pending = []
+        for l, r, kronrod, error in estimates:
+            if error <= tolerance * (r-l)/(b-a) or (r-l) <= 1e-12 * (b-a):
+                done.append((l, r, kronrod, error))
+            else:
+                pending.append((l, r, kronrod, error))
+        if len(done) + 2*len(pending) > VIMCALC_INTEGRATE_MAX_INTERVALS:
+            done.extend(pending)
+            if math.fsum(e[3] for e in done) > 1e-6 * max(scale, 1e-300):
+                raise ValueError('integrate() did not converge.')
+            break
+        pending = [half for l, r, kronrod, error in pending
+                        for half in [(l, (l+r)/2), ((l+r)/2, r)]]
+    return sign * math.fsum(e[2] for e in done)
+
+#how far solve() looks for a sign change either side of its guess: the steps
+#double from a thousandth of the guess (or of 1) this many times
+VIMCALC_SOLVE_BRACKET_STEPS = 50
+
+#iterations of Brent's method before solve() settles for what it has
+VIMCALC_SOLVE_ITERATIONS = 200
+
+#a root of the expression; solve(expr,x,guess) first looks outwards from the
+#guess for a sign change, solve(expr,x,a,b) is given one
+def vimcalc_findRoot(tokens, symbol, a, b=None):
+    sample = vimcalc_sampler('solve', tokens, symbol)
+    if b is None:
+        bracket = vimcalc_bracketRoot(sample, float(a))
+        if bracket is None:
+            raise ValueError('solve() could not find a sign change near the guess.')
+        a, fa, b, fb = bracket
+    else:
+        a, b = float(a), float(b)
+        fa, fb = sample([a, b])
+    if fa == 0:
+        return a
+    if fb == 0:
+        return b
+    if math.isnan(fa) or math.isnan(fb) or (fa < 0) == (fb < 0):
+        raise ValueError('solve() requires the expression to change sign between a and b.')
+    return vimcalc_brent(lambda x: sample([x])[0], a, b, fa, fb)
+
+#the sign change closest to the guess, as (a, f(a), b, f(b)), sampling all the
+#candidate points in one batch
+def vimcalc_bracketRoot(sample, guess):
+    step = max(abs(guess), 1.0) * 1e-3
+    offsets = [step * 2**k for k in range(VIMCALC_SOLVE_BRACKET_STEPS)]
+    points = [guess] + [guess + d for d in offsets] + [guess - d for d in offsets]
+    values = sample(points)
+    if values[0] == 0:
+        return (guess, 0.0, guess, 0.0)
+    n = VIMCALC_SOLVE_BRACKET_STEPS
+    right = [(guess, values[0])] + list(zip(points[1:n+1], values[1:n+1]))
+    left = [(guess, values[0])] + list(zip(points[n+1:], values[n+1:]))
+    for k in range(n):
+        for side in [right, left]:
+            (x0, y0), (x1, y1) = side[k], side[k+1]
+            if math.isnan(y0) or math.isnan(y1):
+                continue
+            if y1 == 0 or (y0 < 0) != (y1 < 0):
+                return (min(x0, x1), y0 if x0 < x1 else y1,
+                        max(x0, x1), y1 if x0 < x1 else y0)
+    return None
+
+#Brent's method: inverse quadratic interpolation or the secant step when they
+#stay well inside the bracket [a, b], bisection otherwise
+def vimcalc_brent(f, a, b, fa, fb):
+    if abs(fa) < abs(fb):
+        a, b, fa, fb = b, a, fb, fa
+    c, fc = a, fa
+    d = c
+    bisected = True
+    for i in range(VIMCALC_SOLVE_ITERATIONS):
+        tolerance = 2e-12 + 4 * sys.float_info.epsilon * abs(b)
+        if fb == 0 or abs(b - a) <= tolerance:
+            return b
+        if fa != fc and fb != fc:
+            s = (a*fb*fc / ((fa-fb)*(fa-fc)) + b*fa*fc / ((fb-fa)*(fb-fc)) +
+                 c*fa*fb / ((fc-fa)*(fc-fb)))
+        else:
+            s = b - fb*(b-a) / (fb-fa)
+        m = (3*a + b) / 4
+        if not (min(m, b) < s < max(m, b)) or \
+                (bisected and abs(s-b) >= abs(b-c)/2) or \
+                (not bisected and abs(s-b) >= abs(c-d)/2) or \
+                (bisected and abs(b-c) < tolerance) or \
+                (not bisected and abs(c-d) < tolerance):
+            s = (a + b) / 2
+            bisected = True
+        else:
+            bisected = False
+        fs = f(s)
+        if math.isnan(fs):
+            raise ValueError('solve() requires an expression that is defined between a and b.')
+        d, c, fc = c, b, fb
+        if (fa < 0) != (fs < 0):
+            b, fb = s, fs
+        else:
+            a, fa = s, fs
+        if abs(fa) < abs(fb):
+            a, b, fa, fb = b, a, fb, fa
+    return b
+
+#polynomials as lists of coefficients, lowest power first
+def vimcalc_polyAdd(p, q):
+    if len(p) < len(q):
+        p, q = q, p
+    return [c + q[k] if k < len(q) else c for k, c in enumerate(p)]
+
+def vimcalc_polyMul(p, q):
+    result = [0] * (len(p) + len(q) - 1)
+    for j, x in enumerate(p):
+        for k, y in enumerate(q):
+            result[j+k] += x * y
+    return result
+
+def vimcalc_polyValue(p, x):
+    result = 0
+    for c in reversed(p):
+        result = result * x + c
+    return result
+
+#highest power of the index sum() and prod() will expand to
+VIMCALC_SERIES_MAX_DEGREE = 64
+
+#what the summand of sum() or prod() reduces to when the index is bound to
+#one of these: a sum over ratios r of P(i) * r**i with P a polynomial, held as
+#{r: P}. Anything else, e.g. a function of the index, raises TypeError and is
+#left to be evaluated term by term.
+class VimCalcSeriesTerm(object):
+    def __init__(self, terms):
+        self.terms = dict((r, p) for r, p in terms.items() if any(c != 0 for c in p))
+    def degree(self):
+        return max([len(p) - 1 for p in self.terms.values()] + [0])
+    def __add__(self, other):
+        other = vimcalc_seriesTerm(other)
+        if other is None:
+            return NotImplemented
+        terms = dict(self.terms)
+        for r, p in other.terms.items():
+            terms[r] = vimcalc_polyAdd(terms.get(r, []), p)
+        return VimCalcSeriesTerm(terms)
+    __radd__ = __add__
+    def __neg__(self):
+        return VimCalcSeriesTerm(dict((r, [-c for c in p]) for r, p in self.terms.items()))
+    def __sub__(self, other):
+        other = vimcalc_seriesTerm(other)
+        if other is None:
+            return NotImplemented
+        return self + (-other)
+    def __rsub__(self, other):
+        return (-self) + other
+    def __mul__(self, other):
+        other = vimcalc_seriesTerm(other)
+        if other is None:
+            return NotImplemented
+        terms = {}
+        for r, p in self.terms.items():
+            for s, q in other.terms.items():
+                terms[r*s] = vimcalc_polyAdd(terms.get(r*s, []), vimcalc_polyMul(p, q))
+        result = VimCalcSeriesTerm(terms)
+        if result.degree() > VIMCALC_SERIES_MAX_DEGREE:
+            return NotImplemented
+        return result
+    __rmul__ = __mul__
+    def __truediv__(self, other):
+        if not isinstance(other, VIMCALC_INT_TYPES + (float,)) or other == 0:
+            return NotImplemented
+        return self * (1 / other)
+    def __pow__(self, n):
+        k = vimcalc_wholeNumber(n)
+        if k is None or k < 0 or k * self.degree() > VIMCALC_SERIES_MAX_DEGREE:
+            return NotImplemented
+        result = vimcalc_seriesTerm(n ** 0)
+        for i in range(k):
+            result = result * self
+        return result
+    #base**(c1*i + c0) is the geometric term base**c0 * (base**c1)**i
+    def __rpow__(self, base):
+        if not isinstance(base, VIMCALC_INT_TYPES + (float,)) or list(self.terms) not in [[], [1]]:
+            return NotImplemented
+        p = self.terms.get(1, [0])
+        if len(p) > 2:
+            return NotImplemented
+        c0, c1 = (p + [0])[:2]
+        if base <= 0 and (vimcalc_wholeNumber(c0) is None or vimcalc_wholeNumber(c1) is None):
+            return NotImplemented
+        return VimCalcSeriesTerm({base ** c1: [base ** c0]})
+
+#x as a VimCalcSeriesTerm, or None if it is neither one nor a number
+def vimcalc_seriesTerm(x):
+    if isinstance(x, VimCalcSeriesTerm):
+        return x
+    if isinstance(x, VIMCALC_INT_TYPES + (float,)):
+        return VimCalcSeriesTerm({1: [x]})
+    return None
+
+#the sum of the term for i = a..b. With Q(x) = P(a+x), a polynomial sums to
+#the sum over k of diff(k) * choose(n, k+1), diff(k) being the kth forward
+#difference of Q at 0. With a ratio r != 1 it is r**a * (F(0) - r**n * F(n))
+#where F(x) - r*F(x+1) = Q(x), i.e. F = sum of (r/(1-r))**k * diff(k) / (1-r).
+def vimcalc_closedSum(term, a, b):
+    n = b - a + 1
+    exact = all(isinstance(c, VIMCALC_INT_TYPES) for r, p in term.terms.items() for c in [r] + p)
+    total = 0
+    for r, p in term.terms.items():
+        if exact:
+            r = fractions.Fraction(int(r))
+            p = [fractions.Fraction(int(c)) for c in p]
+        def differences(x):
+            values = [vimcalc_polyValue(p, a + x + k) for k in range(len(p))]
+            diffs = []
+            while values != []:
+                diffs.append(values[0])
+                values = [values[j+1] - values[j] for j in range(len(values) - 1)]
+            return diffs
+        if r == 1:
+            total += sum(d * math.comb(n, k+1) for k, d in enumerate(differences(0)))
+        else:
+            q = r / (1 - r)
+            def F(x):
+                return sum(q**k * d for k, d in enumerate(differences(x))) / (1 - r)
+            if exact:
+                vimcalc_session().checkCost(n * int(abs(r)).bit_length())
+            total += r**a * (F(0) - r**n * F(n))
+    if exact:
+        return int(total) if total.denominator == 1 else float(total)
+    return total
+
+#the product of the term for i = a..b if it is C * r**i or c1 * (i + c) with
+#c a whole number, otherwise None
+def vimcalc_closedProduct(term, a, b):
+    n = b - a + 1
+    if len(term.terms) != 1:
+        return None
+    (r, p), = term.terms.items()
+    if len(p) == 1:
+        if isinstance(r, VIMCALC_INT_TYPES):
+            vimcalc_session().checkCost((a + b) * n // 2 * int(abs(r)).bit_length())
+        return p[0]**n * r**((a + b) * n // 2)
+    if r != 1 or len(p) != 2:
+        return None
+    c = vimcalc_wholeNumber(p[0] / p[1])
+    if c is None or (isinstance(p[0], VIMCALC_INT_TYPES) and p[0] % p[1] != 0):
+        return None
+    low, high = a + c, b + c
+    if low <= 0 <= high:
+        return p[1] * 0
+    if low > 0:
+        value = vimcalc_factorial(high) // vimcalc_factorial(low - 1)
+    else:
+        value = (-1)**n * (vimcalc_factorial(-low) // vimcalc_factorial(-high - 1))
+    return p[1]**n * value
+
+#how many terms of series() or product() are evaluated as one batch
+VIMCALC_SERIES_CHUNK = 1 << 14
+
+#generator of the values of the expression for i = a..b, a batch at a time;
+#like vimcalc_sampler a batch is evaluated with the index bound to an array when
+#vimcalc_batchable allows it and that gives the same values as evaluating one
+#term at a time
+def vimcalc_seriesValues(evaluate, tokens, symbol, a, b):
+    session = vimcalc_session()
+    exact = vimcalc_exact()
+    index = (lambda i: i) if exact else float
+    try:
+        np = vimcalc_numpy()
+    except VimCalcParseException:
+        np = None
+    vectorized = np is not None and vimcalc_batchable(tokens)
+    start = a
+    while start <= b:
+        session.checkDeadline()
+        end = min(b, start + VIMCALC_SERIES_CHUNK - 1)
+        values = None
+        if vectorized:
+            try:
+                points = np.arange(start, end + 1, dtype=object if exact else float)
+                with np.errstate(all='ignore'):
+                    values = vimcalc_batchValues(evaluate(points), points, tokens, symbol)
+                if values is None or (not exact and not all(map(math.isfinite, values))):
+                    values = None
+                else:
+                    for i, v in [(start, values[0]), (end, values[-1])]:
+                        if not vimcalc_sameValue(evaluate(index(i)), v):
+                            values = None
+            except (VimCalcParseException, ArithmeticError, TypeError, ValueError):
+                values = None
+            vectorized = values is not None
+        if values is None:
+            values = [evaluate(index(i)) for i in range(start, end + 1)]
+        yield values
+        start = end + 1
+
+#series(i,a,b,expr) and product(i,a,b,expr): polynomial and geometric summands, and
+#products of those and of linear factors, are worked out in closed form
+def vimcalc_series(name, tokens, symbol, a, b):
+    low, high = vimcalc_wholeNumber(a), vimcalc_wholeNumber(b)
+    if low is None or high is None:
+        raise ValueError(name + '() requires whole number limits.')
+    exact = vimcalc_exact()
+    unit = 1 if exact else 1.0
+    if high < low:
+        return unit * (name == 'product')
+    evaluate = vimcalc_boundEvaluator(name, tokens, symbol)
+    try:
+        term = vimcalc_seriesTerm(evaluate(VimCalcSeriesTerm({1: [0 * unit, unit]})))
+    except (VimCalcParseException, ArithmeticError, TypeError, ValueError):
+        term = None
+    if term is not None:
+        if name == 'series':
+            return vimcalc_closedSum(term, low, high)
+        result = vimcalc_closedProduct(term, low, high)
+        if result is not None:
+            return result
+    if name == 'series':
+        return vimcalc_sum([vimcalc_sum(values) for values in vimcalc_seriesValues(evaluate, tokens, symbol, low, high)])
+    product = unit
+    for values in vimcalc_seriesValues(evaluate, tokens, symbol, low, high):
+        product *= math.prod(values)
+    return product
+
+def vimcalc_seriesOver(tokens, symbol, a, b):
+    return vimcalc_series('series', tokens, symbol, a, b)
+
+def vimcalc_productOver(tokens, symbol, a, b):
+    return vimcalc_series('product', tokens, symbol, a, b)
 
 # Global built-in function table
 #NOTE: variables do not share the same namespace as functions
@@ -673,36 +2895,1269 @@ VIMCALC_FUNCTION_TABLE = {
         'atan2' : math.atan2,
         'ceil'  : math.ceil,
         'choose': vimcalc_choose,
+        'clz'   : vimcalc_elementwise(vimcalc_clz),
         'cos'   : math.cos,
         'cosh'  : math.cosh,
+        'crt'   : vimcalc_crt,
+        'ctz'   : vimcalc_elementwise(vimcalc_ctz),
         'deg'   : math.degrees,
+        'det'   : vimcalc_det,
+        'dot'   : vimcalc_dot,
         'exp'   : math.exp,
+        'factor': vimcalc_primeFactors,
         'floor' : math.floor,
+        'gcd'   : vimcalc_gcd,
         'hypot' : math.hypot,
-        'inv'   : lambda n: 1/n,
+        'ilog10': vimcalc_ilog10,
+        'ilog2' : vimcalc_ilog2,
+        'inv'   : vimcalc_inv,
+        'iroot' : vimcalc_iroot,
+        'isprime' : vimcalc_isprime,
+        'isqrt' : vimcalc_isqrt,
+        'lcm'   : vimcalc_lcm,
         'ldexp' : math.ldexp,
         'lg'    : vimcalc_log2,
         'ln'    : vimcalc_loge,
         'log'   : math.log, #allows arbitrary base, defaults to e
-        'log10' : math.log10,
-        'max'   : max,
-        'min'   : min,
+        'log10' : vimcalc_log10,
+        'max'   : lambda *args: max(vimcalc_reducedArgs(args, lambda c: c.max())),
+        'mean'  : vimcalc_mean,
+        'median': vimcalc_median,
+        'min'   : lambda *args: min(vimcalc_reducedArgs(args, lambda c: c.min())),
+        'modinv': vimcalc_modinv,
+        'nextprime' : vimcalc_nextprime,
         'nrt'   : vimcalc_nrt,
+        'percentile' : vimcalc_percentile,
         'perms' : vimcalc_perms,
-        'pow'   : math.pow,
+        'popcount' : vimcalc_elementwise(vimcalc_popcount),
+        'pow'   : vimcalc_pow,
+        'primepi' : vimcalc_primepi,
+        'prod'  : lambda *args: math.prod(vimcalc_iterArgs(args)),
+        'powmod': vimcalc_powmod,
         'rad'   : math.radians,
         'rand'  : random.random, #random() -> x in the interval [0, 1).
+        'rotl'  : vimcalc_elementwise(vimcalc_rotl),
+        'rotr'  : vimcalc_elementwise(vimcalc_rotr),
         'round' : round,
         'sin'   : math.sin,
         'sinh'  : math.sinh,
-        'sqrt'  : math.sqrt,
+        'solve' : vimcalc_solve,
+        'sqrt'  : vimcalc_sqrt,
+        'stddev': vimcalc_stddev,
+        'sum'   : vimcalc_sum,
         'tan'   : math.tan,
-        'tanh'  : math.tanh
+        'tanh'  : math.tanh,
+        'var'   : vimcalc_var
+        }
+
+#functions applied to vectors use the elementwise NumPy equivalent, by name
+VIMCALC_ARRAY_FUNCTION_TABLE = {
+        'abs'   : 'abs',
+        'acos'  : 'arccos',
+        'asin'  : 'arcsin',
+        'atan'  : 'arctan',
+        'atan2' : 'arctan2',
+        'ceil'  : 'ceil',
+        'cos'   : 'cos',
+        'cosh'  : 'cosh',
+        'deg'   : 'degrees',
+        'exp'   : 'exp',
+        'floor' : 'floor',
+        'hypot' : 'hypot',
+        'lg'    : 'log2',
+        'ln'    : 'log',
+        'log10' : 'log10',
+        'pow'   : 'power',
+        'rad'   : 'radians',
+        'round' : 'round',
+        'sin'   : 'sin',
+        'sinh'  : 'sinh',
+        'sqrt'  : 'sqrt',
+        'tan'   : 'tan',
+        'tanh'  : 'tanh'
         }
 
-def vimcalc_lookupFunc(symbol):
+#functions with an argument that is an expression over the variable named by
+#another, see vimcalc_binder; each with its accepted argument counts, usage and
+#the positions of the expression and of the variable
+VIMCALC_BINDER_TABLE = {
+        'integrate' : (vimcalc_integrate, [4], 'integrate(expr,x,a,b)', 0, 1),
+        'product'   : (vimcalc_productOver, [4], 'product(i,a,b,expr)', 3, 0),
+        'series'    : (vimcalc_seriesOver, [4], 'series(i,a,b,expr)', 3, 0),
+        'solve'     : (vimcalc_findRoot, [3, 4], 'solve(expr,x,guess) or solve(expr,x,a,b)', 0, 1)
+        }
+
+def vimcalc_lookupFunc(symbol, args=()):
+    if symbol in VIMCALC_ARRAY_FUNCTION_TABLE and any(map(vimcalc_isArray, args)):
+        return getattr(vimcalc_numpy(), VIMCALC_ARRAY_FUNCTION_TABLE[symbol])
     if symbol in VIMCALC_FUNCTION_TABLE:
         return VIMCALC_FUNCTION_TABLE[symbol]
     else:
         error = "built-in function '" + symbol + "' does not exist."
         raise VimCalcParseException(error, 0)
+
+#### PLOTTING #################################################################
+
+# ':plot expr, x=a..b' draws the expression as a chart of Braille characters,
+# each of which holds 2x4 dots. The expression is sampled a whole batch at a
+# time (see vimcalc_sampler): first once per dot column, then again between
+# neighbouring samples that are more than a dot apart vertically, so steep
+# parts of the curve are filled in without sampling the flat parts any closer.
+
+#size of the chart in characters, not counting the axis labels. The REPL sets
+#the width to fit its window.
+VIMCALC_PLOT_SIZE = (60, 12)
+
+#rounds of sampling between samples that are too far apart
+VIMCALC_PLOT_REFINE = 6
+
+#the offset of each dot of a Braille cell, by column and row
+VIMCALC_BRAILLE_DOTS = [[0x01, 0x02, 0x04, 0x40], [0x08, 0x10, 0x20, 0x80]]
+
+def vimcalc_plotMessage(tokens):
+    usage = 'usage: :plot expr, x=a..b.'
+    #the range comes after the last top level comma
+    depth = 0
+    comma = None
+    for i, t in enumerate(tokens):
+        if t.ID in ['lParen', 'lBracket']:
+            depth += 1
+        elif t.ID in ['rParen', 'rBracket']:
+            depth -= 1
+        elif t.ID == 'comma' and depth == 0:
+            comma = i
+    if comma is None or comma == 0 or \
+            list(map(vimcalc_getID, tokens[comma+1:comma+3])) != ['ident', 'assign']:
+        raise VimCalcParseException(usage, 1)
+    ranges = [i for i in range(comma+3, len(tokens)) if tokens[i].ID == 'range']
+    if len(ranges) != 1:
+        raise VimCalcParseException(usage, 1)
+    limits = []
+    for span in [tokens[comma+3:ranges[0]], tokens[ranges[0]+1:]]:
+        exprNode = vimcalc_expr(span)
+        if span == [] or not exprNode.success or exprNode.consumeCount != len(span):
+            raise VimCalcParseException(usage, 1)
+        limits.append(float(exprNode.result))
+    low, high = limits
+    if not (math.isfinite(low) and math.isfinite(high)) or low >= high:
+        raise VimCalcParseException('the range of a plot must go from low to high.', 1)
+
+    body = tokens[:comma]
+    symbol = tokens[comma+1].attrib
+    width, height = VIMCALC_PLOT_SIZE
+    xs, ys = vimcalc_plotSamples(vimcalc_sampler('plot', body, symbol), low, high, 2 * width, 4 * height)
+    finite = sorted(y for y in ys if math.isfinite(y))
+    if finite == []:
+        raise VimCalcParseException('the expression is not defined anywhere in the range.', 1)
+    bottom, top = vimcalc_plotRange(finite)
+    rows = vimcalc_plotDots(xs, ys, low, high, bottom, top, width, height)
+
+    labels = ['%.6g' % top, '%.6g' % bottom]
+    margin = max(map(len, labels))
+    title = 'PLOT OF %s FOR %s = %.6g .. %.6g:' % (''.join(t.attrib for t in body), symbol, low, high)
+    lines = [title]
+    for r, row in enumerate(rows):
+        if r == 0:
+            label, tick = labels[0], '\u2524'
+        elif r == height - 1:
+            label, tick = labels[1], '\u2524'
+        else:
+            label, tick = '', '\u2502'
+        lines.append(label.rjust(margin) + ' ' + tick + row)
+    lines.append(' ' * margin + ' \u2514' + '\u2500' * width)
+    left, right = '%.6g' % low, '%.6g' % high
+    lines.append(' ' * (margin + 2) + left + right.rjust(width - len(left)))
+    return '\n'.join(lines)
+
+#samples of the expression over [low, high] for a chart of the given number of
+#dot columns and rows, as lists of x and y sorted by x
+def vimcalc_plotSamples(sample, low, high, columns, rows):
+    step = (high - low) / columns
+    xs = [low + (k + 0.5) * step for k in range(columns)]
+    xs = [low] + xs + [high]
+    ys = sample(xs)
+    for i in range(VIMCALC_PLOT_REFINE):
+        finite = [y for y in ys if math.isfinite(y)]
+        if finite == []:
+            break
+        bottom, top = vimcalc_plotRange(sorted(finite))
+        scale = rows / (top - bottom)
+        #midpoints of the neighbours more than a dot apart, or where the
+        #expression stops being defined
+        middles = []
+        for k in range(len(xs) - 1):
+            y0, y1 = ys[k], ys[k+1]
+            if math.isfinite(y0) and math.isfinite(y1):
+                if abs(y1 - y0) * scale <= 1:
+                    continue
+            elif math.isfinite(y0) == math.isfinite(y1):
+                continue
+            middles.append((xs[k] + xs[k+1]) / 2)
+        if middles == []:
+            break
+        points = sorted(zip(xs + middles, ys + sample(middles)))
+        xs = [p[0] for p in points]
+        ys = [p[1] for p in points]
+    return (xs, ys)
+
+#the values shown on the chart: all of them unless a few are so far out, e.g.
+#near a pole, that the rest would be flattened
+def vimcalc_plotRange(finite):
+    bottom, top = finite[0], finite[-1]
+    n = len(finite)
+    low, high = finite[n // 50], finite[n - 1 - n // 50]
+    if high > low and top - bottom > 4 * (high - low):
+        margin = (high - low) / 10
+        bottom, top = max(bottom, low - margin), min(top, high + margin)
+    if top == bottom:
+        bottom, top = bottom - 1, top + 1
+    return (bottom, top)
+
+#the rows of Braille characters of the chart, drawing a line between
+#neighbouring samples unless it would cross most of the chart (a jump)
+def vimcalc_plotDots(xs, ys, low, high, bottom, top, width, height):
+    columns, rows = 2 * width, 4 * height
+    cells = [[0] * width for r in range(height)]
+    def dot(c, r):
+        if 0 <= c < columns and 0 <= r < rows:
+            cells[r // 4][c // 2] |= VIMCALC_BRAILLE_DOTS[c % 2][r % 4]
+    def column(x):
+        return min(int((x - low) / (high - low) * columns), columns - 1)
+    def row(y):
+        return (top - y) / (top - bottom) * (rows - 1)
+    #dotted axes where they fall inside the chart
+    if bottom < 0 < top:
+        r = int(round(row(0)))
+        for c in range(0, columns, 2):
+            dot(c, r)
+    if low < 0 < high:
+        c = column(0)
+        for r in range(0, rows, 2):
+            dot(c, r)
+    for k in range(len(xs)):
+        if not math.isfinite(ys[k]):
+            continue
+        r0 = row(ys[k])
+        r1 = r0
+        if k + 1 < len(xs) and math.isfinite(ys[k+1]) and abs(row(ys[k+1]) - r0) < rows / 2:
+            r1 = row(ys[k+1])
+        #fill the column from this sample halfway to the next
+        c = column(xs[k])
+        middle = (r0 + r1) / 2
+        first, last = sorted([r0, middle])
+        for r in range(max(int(round(first)), 0), min(int(round(last)), rows - 1) + 1):
+            dot(c, r)
+        if k + 1 < len(xs) and r1 != r0:
+            c = column(xs[k+1])
+            first, last = sorted([middle, r1])
+            for r in range(max(int(round(first)), 0), min(int(round(last)), rows - 1) + 1):
+                dot(c, r)
+    return [''.join(chr(0x2800 + bits) for bits in line) for line in cells]
+
+#### LOADING DATA #############################################################
+
+# ':load name = path' binds a column of numbers from a file to a variable as a
+# NumPy array backed by a memory mapped file, so only the pages in use are held
+# in memory:
+#   - '.csv', '.tsv' and '.txt' files are read a chunk of rows at a time, with
+#     the chosen column ('path[col]', a column number from 0 or a heading, 0 by
+#     default) written out as float64 to an anonymous temporary file
+#   - any other file is mapped directly as raw native float64 values
+
+VIMCALC_TEXT_DELIMITERS = {'.csv': ',', '.tsv': '\t', '.txt': None}
+
+#the number of rows converted between writes to the temporary file
+VIMCALC_LOAD_CHUNK = 1 << 16
+
+def vimcalc_loadMessage(line):
+    m = re.match(r':load\s+([A-Za-z_][A-Za-z0-9_]*\'?)\s*=\s*(.*?)\s*$', line)
+    if not m or m.group(2) == '':
+        raise VimCalcParseException('usage: :load name = path or :load name = path[col].', 1)
+    symbol, path = m.groups()
+    column = None
+    c = re.match(r'(.*?)\[\s*([^\]]*?)\s*\]$', path)
+    if c and not os.path.exists(os.path.expanduser(path)):
+        path, column = c.groups()
+    path = os.path.expanduser(path)
+    extension = os.path.splitext(path)[1].lower()
+    try:
+        if extension in VIMCALC_TEXT_DELIMITERS:
+            values = vimcalc_loadText(path, VIMCALC_TEXT_DELIMITERS[extension], column)
+        elif column is not None:
+            raise VimCalcParseException('only text files have columns.', 1)
+        else:
+            values = vimcalc_loadBinary(path)
+    except (IOError, OSError) as e:
+        raise VimCalcParseException("cannot read '%s': %s." % (path, e.strerror or e), 1)
+    vimcalc_storeSymbol(symbol, values)
+    return 'LOADED %d VALUES INTO %s.' % (len(values), symbol)
+
+def vimcalc_loadBinary(path):
+    np = vimcalc_numpy()
+    size = os.path.getsize(path)
+    if size == 0 or size % 8 != 0:
+        raise VimCalcParseException("'%s' is not a file of float64 values." % path, 1)
+    return np.memmap(path, dtype=np.float64, mode='r')
+
+def vimcalc_loadText(path, delimiter, column):
+    np = vimcalc_numpy()
+    index = 0
+    if column is not None and column.lstrip('-').isdigit():
+        index = int(column)
+        column = None
+    spool = tempfile.TemporaryFile()
+    try:
+        with open(path, newline='') as f:
+            if delimiter is None:
+                rows = (line.split() for line in f)
+            else:
+                rows = csv.reader(f, delimiter=delimiter)
+            chunk = array.array('d')
+            count = 0
+            for lineNumber, row in enumerate(rows, 1):
+                if row == []:
+                    continue
+                if lineNumber == 1 and not vimcalc_isNumber(row, index):
+                    #a row of headings
+                    if column is not None:
+                        if column not in row:
+                            raise VimCalcParseException("'%s' has no column '%s'." % (path, column), 1)
+                        index = row.index(column)
+                        column = None
+                    continue
+                if column is not None:
+                    raise VimCalcParseException("'%s' has no row of headings." % path, 1)
+                try:
+                    chunk.append(float(row[index]) if row[index].strip() != '' else math.nan)
+                except (IndexError, ValueError):
+                    raise VimCalcParseException("line %d of '%s' has no number in column %d." %
+                                                (lineNumber, path, index), 1)
+                if len(chunk) == VIMCALC_LOAD_CHUNK:
+                    chunk.tofile(spool)
+                    count += len(chunk)
+                    chunk = array.array('d')
+            chunk.tofile(spool)
+            count += len(chunk)
+        if count == 0:
+            raise VimCalcParseException("'%s' has no values." % path, 1)
+        spool.flush()
+        #the mapping keeps the data after the file is closed
+        return np.memmap(spool, dtype=np.float64, mode='r', shape=(count,))
+    finally:
+        spool.close()
+
+def vimcalc_isNumber(row, index):
+    try:
+        float(row[index])
+        return True
+    except (IndexError, ValueError):
+        return False
+
+#### REPL HISTORY #############################################################
+
+# History of evaluated expressions shared by every VimCalc buffer. The most
+# recent 'capacity' entries are kept in a ring buffer, indexed by a sorted list
+# of the distinct expressions so that prefix searches only look at matching
+# entries. If a path is given every entry is also appended to that file, which
+# other Vim sessions pick up the next time they search.
+class VimCalcHistory(object):
+    def __init__(self, capacity, path=''):
+        self._capacity = max(1, capacity)
+        self._path = path
+        self._offset = 0      #bytes of the history file already read
+        self._fileLines = 0
+        self.clear()
+        if self._path != '':
+            self.refresh()
+    def clear(self):
+        self._ring = [None] * self._capacity
+        self._count = 0       #sequence number of the next entry
+        self._latest = {}     #expression -> sequence number of last use
+        self._sorted = []     #distinct expressions, sorted
+    def __len__(self):
+        return min(self._count, self._capacity)
+    def record(self, expr, persist=True):
+        if expr == '':
+            return
+        if persist and self._path != '':
+            self.refresh()
+            self._append(expr)
+        self._add(expr)
+        if self._fileLines > 2*self._capacity:
+            self._compact()
+    def previous(self, prefix='', before=None):
+        #returns (seq, expr) of the latest entry older than 'before' starting
+        #with prefix, or None
+        if before is None:
+            before = self._count
+        return self._search(prefix, before-1, -1)
+    def following(self, prefix, after):
+        #returns (seq, expr) of the oldest entry newer than 'after' starting
+        #with prefix, or None
+        return self._search(prefix, after+1, 1)
+    def refresh(self):
+        #reads entries appended to the history file since it was last read
+        try:
+            size = os.path.getsize(self._path)
+        except OSError:
+            return
+        if size < self._offset:
+            #the file has been compacted by another session
+            self.clear()
+            self._offset = 0
+            self._fileLines = 0
+        if size == self._offset:
+            return
+        with open(self._path, 'rb') as f:
+            f.seek(self._offset)
+            data = f.read()
+        #ignore a partially written last line
+        data = data[:data.rfind(b'\n')+1]
+        self._offset += len(data)
+        lines = data.decode('utf-8', 'replace').split('\n')[:-1]
+        self._fileLines += len(lines)
+        #index the whole block at once rather than one insertion at a time
+        for line in lines[-self._capacity:]:
+            self._add(line, False)
+        self._sorted = sorted(self._latest)
+    def _add(self, expr, index=True):
+        if expr == '':
+            return
+        slot = self._count % self._capacity
+        if self._count >= self._capacity:
+            evicted = self._ring[slot]
+            if self._latest.get(evicted) == self._count - self._capacity:
+                del self._latest[evicted]
+                if index:
+                    del self._sorted[bisect.bisect_left(self._sorted, evicted)]
+        self._ring[slot] = expr
+        if index and expr not in self._latest:
+            bisect.insort(self._sorted, expr)
+        self._latest[expr] = self._count
+        self._count += 1
+    def _search(self, prefix, start, step):
+        #only the latest use of each expression is offered
+        oldest = max(0, self._count - self._capacity)
+        if prefix == '':
+            seq = start
+            while oldest <= seq < self._count:
+                expr = self._ring[seq % self._capacity]
+                if self._latest[expr] == seq:
+                    return (seq, expr)
+                seq += step
+            return None
+        best = None
+        i = bisect.bisect_left(self._sorted, prefix)
+        while i < len(self._sorted) and self._sorted[i].startswith(prefix):
+            seq = self._latest[self._sorted[i]]
+            if (seq - start) * step >= 0 and (best is None or (seq - best) * step < 0):
+                best = seq
+            i += 1
+        if best is None:
+            return None
+        return (best, self._ring[best % self._capacity])
+    def _append(self, expr):
+        try:
+            with open(self._path, 'ab') as f:
+                f.write((expr.replace('\n', ' ') + '\n').encode('utf-8'))
+                self._offset = f.tell()
+                self._fileLines += 1
+        except OSError:
+            pass
+    def _compact(self):
+        #rewrites the file with only the entries still in memory
+        entries = [self._ring[seq % self._capacity]
+                   for seq in range(max(0, self._count - self._capacity), self._count)]
+        temp = self._path + '.tmp'
+        try:
+            with open(temp, 'wb') as f:
+                f.write(''.join(e + '\n' for e in entries).encode('utf-8'))
+                offset = f.tell()
+            os.replace(temp, self._path)
+            self._offset = offset
+            self._fileLines = len(entries)
+        except OSError:
+            pass
+
+#### LIVE PREVIEW #############################################################
+
+# While the prompt line is being edited the REPL shows what it would evaluate
+# to. A VimCalcPreviewer remembers the tokens of the previous version of the
+# line and only tokenizes again from just before the first changed character.
+# Outputs are memoised on the token stream and the state of the session, so
+# e.g. editing whitespace or deleting what was just typed costs nothing. For
+# plain expressions the value of every prefix ending before a top level + or -
+# is kept too, so when the end of a long sum is edited only the terms from the
+# edit on are evaluated again.
+#
+# Previews are evaluated in a VimCalcPreviewCalculator, which reads the
+# variables and settings of the session being previewed but keeps its own
+# assignments to itself. It gives up once its time budget is spent, when it is
+# told that a key has been pressed, or before an integer power or factorial
+# that would obviously take too long (e.g. 9**9**9).
+
+#seconds an evaluation may take
+VIMCALC_PREVIEW_BUDGET = 0.003
+
+#powers and factorials with results larger than this are not previewed
+VIMCALC_PREVIEW_MAX_BITS = 1 << 20
+
+#how many outputs to memoise
+VIMCALC_PREVIEW_CACHE_SIZE = 64
+
+class VimCalcPreviewCancelled(Exception):
+    pass
+
+class VimCalcPreviewCalculator(VimCalcCalculator):
+    def __init__(self, parent, deadline, cancelled=None):
+        VimCalcCalculator.__init__(self, {}, parent.base, parent.precision, parent.bits, parent.signed)
+        self._parent = parent
+        self._deadline = deadline
+        self._cancelled = cancelled
+        self._checks = 0
+    def lookupSymbol(self, symbol):
+        if symbol in self._symbols:
+            return self._symbols[symbol]
+        return self._parent.lookupSymbol(symbol)
+    def storeSymbol(self, symbol, value):
+        self._symbols[symbol] = value
+    def journalLine(self, isResult, result=None):
+        pass
+    def result(self, line):
+        return self._parent.result(line)
+    def recentResult(self, k):
+        return self._parent.recentResult(k)
+    def checkDeadline(self):
+        if time.monotonic() > self._deadline:
+            raise VimCalcPreviewCancelled()
+        #asking whether a key is waiting is comparatively slow
+        self._checks += 1
+        if self._cancelled is not None and self._checks % 16 == 0 and self._cancelled():
+            raise VimCalcPreviewCancelled()
+    def checkCost(self, bits):
+        if bits > VIMCALC_PREVIEW_MAX_BITS:
+            raise VimCalcPreviewCancelled()
+        self.checkDeadline()
+
+#tokens that can end an operand; a + or - after one of them is binary
+VIMCALC_OPERAND_ENDS = ['decnumber', 'hexnumber', 'octnumber', 'binnumber',
+                        'ident', 'rParen', 'rBracket', 'factorial']
+
+#indices of the top level binary + and - tokens of a plain expression, or None
+#if the line is an assignment
+def vimcalc_termSplits(tokens):
+    if vimcalc_symbolCheck('let', 0, tokens) or \
+            (vimcalc_symbolCheck('ident', 0, tokens) and len(tokens) > 1 and
+             tokens[1].ID in VIMCALC_ASSIGN_OPS):
+        return None
+    splits = []
+    depth = 0
+    for i, t in enumerate(tokens):
+        if t.ID in ('lParen', 'lBracket'):
+            depth += 1
+        elif t.ID in ('rParen', 'rBracket'):
+            depth -= 1
+        elif t.ID in ('plus', 'subtract') and depth == 0 and i > 0 and \
+                tokens[i-1].ID in VIMCALC_OPERAND_ENDS:
+            splits.append(i)
+    return splits
+
+#length of the longest common prefix of two strings
+def vimcalc_commonPrefix(a, b):
+    lo = 0
+    hi = min(len(a), len(b))
+    if a[:hi] == b[:hi]:
+        return hi
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[:mid] == b[:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+#a collection of the cyclic garbage can take longer than the whole preview
+#budget, so it is put off until the preview is done
+@contextlib.contextmanager
+def vimcalc_collectLater():
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+class VimCalcPreviewer(object):
+    def __init__(self, session=None):
+        self._session = session
+        self._expr = ''
+        self._tokens = []
+        self._ends = []
+        self._outputs = collections.OrderedDict()
+        self._state = None
+        self._prefixTokens = []
+        self._prefixes = []
+        self._terms = {}
+        VIMCALC_MEMO_CACHES.add(self)
+
+    #(bytes, count) of the memoised outputs
+    def cacheSize(self):
+        return (vimcalc_deepSize(self._outputs) + vimcalc_deepSize(self._prefixes) + vimcalc_deepSize(self._terms),
+                len(self._outputs))
+
+    #tokens of expr, reusing those of the previous line left untouched
+    def tokenize(self, expr):
+        common = vimcalc_commonPrefix(self._expr, expr)
+        keep = bisect.bisect_right(self._ends, common - VIMCALC_LEXER_LOOKAHEAD)
+        start = self._ends[keep-1] if keep > 0 else 0
+        tokens, ends = vimcalc_scan(expr, start)
+        self._expr = expr
+        self._tokens = self._tokens[:keep] + tokens
+        self._ends = self._ends[:keep] + ends
+        if tokens != [] and tokens[-1].ID == 'ERROR':
+            return [tokens[-1]]
+        return self._tokens
+
+    #the output expr would give, or None if there is nothing worth showing:
+    #blank lines, directives, errors and evaluations that were cancelled.
+    #cancelled is an optional function returning True once the preview is no
+    #longer wanted.
+    def preview(self, expr, budget=None, cancelled=None):
+        tokens = self.tokenize(expr)
+        if tokens == [] or tokens[0].ID == 'ERROR' or tokens[0].ID in VIMCALC_DIRECTIVES:
+            return None
+        session = self._session or vimcalc_session()
+        #whitespace never appears inside a token, so this tells streams apart
+        key = (' '.join([t.attrib for t in tokens]), session.version,
+               id(session.symbols), session.base, session.precision, session.bits, session.signed)
+        if key in self._outputs:
+            self._outputs.move_to_end(key)
+            return self._outputs[key]
+
+        if budget is None:
+            budget = VIMCALC_PREVIEW_BUDGET
+        calc = VimCalcPreviewCalculator(session, time.monotonic() + budget, cancelled)
+        try:
+            with calc.activated(), vimcalc_collectLater():
+                output = self._evaluate(tokens, key[1:])
+        except VimCalcPreviewCancelled:
+            return None
+        except RecursionError:
+            return None
+
+        self._outputs[key] = output
+        if len(self._outputs) > VIMCALC_PREVIEW_CACHE_SIZE:
+            self._outputs.popitem(last=False)
+        return output
+
+    def _evaluate(self, tokens, state):
+        splits = vimcalc_termSplits(tokens)
+        if splits is None:
+            lineNode, error = vimcalc_evaluateTokens(tokens)
+            return None if error is not None else vimcalc_output(lineNode, None)
+
+        #values of the prefixes left untouched since the last preview
+        same = 0
+        terms = {}
+        if state == self._state:
+            old = self._prefixTokens
+            limit = min(len(old), len(tokens))
+            while same < limit and (old[same] is tokens[same] or
+                    (old[same].ID == tokens[same].ID and old[same].attrib == tokens[same].attrib)):
+                same += 1
+            terms = dict(self._terms)
+        prefixes = [(i, value) for i, value in self._prefixes if i <= same]
+        self._prefixes = []
+        start, value = prefixes[-1] if prefixes != [] else (0, None)
+
+        #terms are also remembered by their tokens, so that an edit near the
+        #start of the line only works out the terms it touched
+        keys = []
+        begin = 0
+        try:
+            for end in splits + [len(tokens)]:
+                operand = tokens[begin:end] if begin == 0 else tokens[begin+1:end]
+                key = ' '.join([t.attrib for t in operand])
+                keys.append(key)
+                if end > start:
+                    vimcalc_session().checkDeadline()
+                    if key not in terms:
+                        node = vimcalc_term(operand)
+                        if not node.success or node.consumeCount != len(operand):
+                            return None
+                        terms[key] = node.result
+                    if begin == 0:
+                        value = terms[key]
+                    else:
+                        value = VIMCALC_SUM_OPS[VIMCALC_SUM_SYMS.index(tokens[begin].ID)](value, terms[key])
+                    if end < len(tokens):
+                        prefixes.append((end, value))
+                begin = end
+            #the terms of lines left half typed are kept until one evaluates
+            terms = {key: terms[key] for key in keys if key in terms}
+        except (VimCalcParseException, ArithmeticError, ValueError, TypeError):
+            return None
+        finally:
+            self._state = state
+            self._prefixTokens = tokens
+            self._prefixes = prefixes
+            self._terms = terms
+        return vimcalc_output(VimCalcParseNode(True, value, len(tokens)), None)
+
+#### ONE-SHOT EVALUATION ######################################################
+
+# vimcalc#Eval() gives the value of an expression straight away, e.g. for a
+# statusline or a mapping. Like the live preview it never assigns variables or
+# changes ans, and gives up on expressions that take too long. Values are
+# remembered until a variable or a setting of the session changes, so asking
+# again for the same expressions, as a statusline does on every redraw, only
+# costs a lookup. Tokens come from the session's cache.
+
+VIMCALC_EVAL_BUDGET = 0.02
+
+VIMCALC_EVAL_CACHE_SIZE = 256
+
+class VimCalcEvaluator(object):
+    def __init__(self, session=None):
+        self._session = session
+        self._values = collections.OrderedDict()
+        self._lock = threading.Lock()
+        VIMCALC_MEMO_CACHES.add(self)
+
+    #(bytes, count) of the memoised values
+    def cacheSize(self):
+        with self._lock:
+            return (vimcalc_deepSize(self._values), len(self._values))
+
+    #the value of expr as it would be displayed, or None if there is none:
+    #directives, errors and evaluations taking more than budget seconds
+    def value(self, expr, budget=None):
+        session = self._session or vimcalc_session()
+        key = (expr, session.version, id(session.symbols), session.base, session.precision,
+               session.bits, session.signed)
+        with self._lock:
+            if key in self._values:
+                self._values.move_to_end(key)
+                return self._values[key]
+        value = self._evaluate(session, expr, budget)
+        with self._lock:
+            self._values[key] = value
+            if len(self._values) > VIMCALC_EVAL_CACHE_SIZE:
+                self._values.popitem(last=False)
+        return value
+
+    def _evaluate(self, session, expr, budget):
+        tokens = session.tokenize(expr)
+        if tokens == [] or tokens[0].ID == 'ERROR' or tokens[0].ID in VIMCALC_DIRECTIVES:
+            return None
+        if budget is None:
+            budget = VIMCALC_EVAL_BUDGET
+        calc = VimCalcPreviewCalculator(session, time.monotonic() + budget)
+        try:
+            with calc.activated():
+                lineNode, error = vimcalc_evaluateTokens(tokens)
+                if error is not None:
+                    return None
+                return vimcalc_process(lineNode.result)
+        except (VimCalcPreviewCancelled, RecursionError):
+            return None
+
+#### EVALUATING LINES OF OTHER BUFFERS ########################################
+
+#evaluates lines in order, returning (newLines, errors). With a separator each
+#result is appended to its line after the separator, replacing the result of
+#a previous run, otherwise lines are replaced by their result. Directives and
+#blank lines are left as they are, as are lines that fail to evaluate; errors
+#is a list of (index, message) for the latter.
+def vimcalc_evalLines(lines, separator=None):
+    with vimcalc_session().activated():
+        return vimcalc_evalLinesInSession(lines, separator)
+
+def vimcalc_evalLinesInSession(lines, separator):
+    newLines = []
+    errors = []
+    for i, line in enumerate(lines):
+        expr = line
+        if expr.strip() == '':
+            newLines.append(line)
+            continue
+        node, error = vimcalc_evaluate(expr)
+        if error is not None and separator and separator in line:
+            #previously annotated, evaluate it again without the old result
+            expr = line[:line.rindex(separator)]
+            node, error = vimcalc_evaluate(expr)
+        if error is not None:
+            errors.append((i, error))
+            newLines.append(line)
+        elif not node.storeInAns and node.assignedSymbol == None:
+            newLines.append(line)
+        else:
+            value = vimcalc_process(node.result)
+            if separator:
+                newLines.append(expr.rstrip() + separator + value)
+            elif node.storeInAns:
+                newLines.append(value)
+            else:
+                newLines.append(node.assignedSymbol + ' = ' + value)
+    return (newLines, errors)
+
+#### BATCH EVALUATION FUNCTIONS ################################################
+
+# Lines that do not read a symbol written earlier in the batch can be evaluated
+# in any order, so they are farmed out to a process pool. Every worker starts
+# from a snapshot of the current session's state; the symbols each
+# parallel line writes are then replayed in input order so that the remaining
+# (dependent) lines see exactly the state a sequential run would have given.
+# NOTE: this is intended for batch jobs importing this module, not for use from
+# inside a running Vim.
+
+VIMCALC_ASSIGN_OPS = ['assign', 'pAssign', 'sAssign', 'mAssign', 'dAssign',
+                      'modAssign', 'expAssign', 'andAssign', 'orAssign',
+                      'xorAssign']
+
+VIMCALC_DIRECTIVES = ['decDir', 'hexDir', 'octDir', 'binDir', 'intDir',
+                      'floatDir', 'statusDir', 'varDir', 'quitDir', 'undoDir',
+                      'redoDir', 'plotDir', 'loadDir', 'bitsDir', 'memDir']
+
+#returns (reads, writes, isDirective) for a tokenized line
+def vimcalc_lineSymbols(tokens):
+    if tokens != [] and tokens[0].ID in VIMCALC_DIRECTIVES:
+        return (set(), set(), True)
+
+    target = None
+    start = 0
+    if list(map(vimcalc_getID, tokens[0:2])) == ['let', 'ident']:
+        start = 1
+    if vimcalc_symbolCheck('ident', start, tokens) and \
+            start+1 < len(tokens) and tokens[start+1].ID in VIMCALC_ASSIGN_OPS:
+        target = tokens[start].attrib
+
+    reads = set()
+    for i, t in enumerate(tokens):
+        if t.ID == 'ident' and not vimcalc_symbolCheck('lParen', i+1, tokens):
+            reads.add(t.attrib)
+        #earlier results are only kept by the session evaluating in order
+        if t.ID == 'resultRef' or (t.ID == 'ident' and t.attrib == 'ans' and
+                                   vimcalc_symbolCheck('lBracket', i+1, tokens)):
+            reads.add('$')
+    if target is None:
+        return (reads, set(['ans']), False)
+    if tokens[start+1].ID == 'assign':
+        reads.discard(target)
+    return (reads, set([target]), False)
+
+#returns a list of booleans: True if the line at that index can be evaluated
+#against the snapshot taken before the batch started
+def vimcalc_independentLines(lines):
+    plan = []
+    written = set()
+    barrier = False
+    for line in lines:
+        tokens = vimcalc_tokenize(line)
+        if vimcalc_symbolCheck('ERROR', 0, tokens):
+            plan.append(not barrier)
+            continue
+        reads, writes, isDirective = vimcalc_lineSymbols(tokens)
+        plan.append(not barrier and not isDirective and not (reads & written) and '$' not in reads)
+        #directives change how everything after them is evaluated
+        barrier = barrier or isDirective
+        written |= writes
+    return plan
+
+def vimcalc_isError(output):
+    return output.startswith('Syntax error: ') or output.startswith('Parse error: ')
+
+#the session a pool worker was seeded with
+VIMCALC_BATCH_SESSION = None
+
+def vimcalc_batchInit(symbols, base, precision, bits, signed):
+    global VIMCALC_BATCH_SESSION
+    VIMCALC_BATCH_SESSION = VimCalcCalculator(symbols, base, precision, bits, signed)
+
+def vimcalc_batchEval(expr):
+    output = VIMCALC_BATCH_SESSION.parse(expr)
+    tokens = vimcalc_tokenize(expr)
+    if vimcalc_isError(output) or vimcalc_symbolCheck('ERROR', 0, tokens):
+        return (output, None, None)
+    symbol = list(vimcalc_lineSymbols(tokens)[1])[0]
+    return (output, symbol, VIMCALC_BATCH_SESSION.symbols[symbol])
+
+#every worksheet starts again from the session the worker was seeded with
+def vimcalc_worksheetEval(lines):
+    session = VIMCALC_BATCH_SESSION.clone()
+    return [session.parse(line) for line in lines]
+
+def vimcalc_processPool(workers):
+    from concurrent.futures import ProcessPoolExecutor
+    return ProcessPoolExecutor(max_workers=workers,
+                               initializer=vimcalc_batchInit,
+                               initargs=vimcalc_session().snapshot())
+
+#evaluates a list of lines, returning the outputs in input order. Identical to
+#calling vimcalc_parse on each line in turn.
+def vimcalc_parseBatch(lines, workers=None, chunksize=64):
+    plan = vimcalc_independentLines(lines)
+    independent = [i for i in range(len(lines)) if plan[i]]
+    if workers == 1 or len(independent) < 2:
+        return [vimcalc_parse(line) for line in lines]
+
+    with vimcalc_processPool(workers) as pool:
+        evaluated = pool.map(vimcalc_batchEval,
+                             [lines[i] for i in independent],
+                             chunksize=chunksize)
+        evaluated = dict(zip(independent, evaluated))
+
+    outputs = []
+    for i, line in enumerate(lines):
+        if plan[i]:
+            output, symbol, value = evaluated[i]
+            if symbol is not None:
+                vimcalc_storeSymbol(symbol, value)
+            vimcalc_session().journalLine(symbol is not None, value)
+            outputs.append(output)
+        else:
+            outputs.append(vimcalc_parse(line))
+    return outputs
+
+#evaluates several independent worksheets (lists of lines) in parallel. Each
+#worksheet starts from the current state and never affects it.
+def vimcalc_parseWorksheets(worksheets, workers=None):
+    if workers == 1 or len(worksheets) < 2:
+        outputs = []
+        for lines in worksheets:
+            session = vimcalc_session().clone()
+            outputs.append([session.parse(line) for line in lines])
+        return outputs
+    with vimcalc_processPool(workers) as pool:
+        return list(pool.map(vimcalc_worksheetEval, worksheets))
+
+#### EVALUATION SERVER ########################################################
+
+# 'python3 vimcalc.py --serve' keeps a single evaluator running that any number
+# of Vims and scripts can share, so its sessions, caches and sieve stay warm.
+# It listens on a Unix socket (readable only by its owner) and speaks JSON-RPC
+# 2.0, one message per line:
+#   {"jsonrpc": "2.0", "id": 1, "method": "parse", "params": {"expr": "1+1"}}
+#   {"jsonrpc": "2.0", "id": 1, "result": "ans = 2.0"}
+# Every method takes an optional "session" name; clients using the same name
+# share its symbols and settings. The session called "default" is the server
+# module's own.
+#
+# Clients keep their connections open in a small pool, and evaluate in their
+# own process whenever the server cannot be reached, refuses a call or does
+# not answer in time. A call is only sent again on a new connection when the
+# pooled one was found closed before anything was sent on it, so a line like
+# 'x += 1' is never applied twice.
+
+VIMCALC_SERVER_SESSION = 'default'
+
+#idle connections a client keeps open
+VIMCALC_CLIENT_POOL_SIZE = 4
+
+#seconds to wait for the server to accept a connection
+VIMCALC_CLIENT_CONNECT_TIMEOUT = 0.5
+
+#seconds to wait for the answer to a call without a time budget of its own
+VIMCALC_CLIENT_TIMEOUT = 60.0
+
+#seconds allowed on top of the budget of a preview or one-shot evaluation
+VIMCALC_CLIENT_MARGIN = 0.02
+
+#seconds between checks whether the server has been asked to stop
+VIMCALC_SERVER_POLL = 0.2
+
+def vimcalc_socketPath():
+    directory = os.environ.get('XDG_RUNTIME_DIR') or tempfile.gettempdir()
+    return os.path.join(directory, 'vimcalc-%d.sock' % getattr(os, 'getuid', lambda: 0)())
+
+class VimCalcRPCError(Exception):
+    def __init__(self, code, message):
+        Exception.__init__(self, message)
+        self.code = code
+        self.message = message
+
+#a call that was sent but not answered, which the server may still carry out
+class VimCalcRPCUnanswered(Exception):
+    pass
+
+class VimCalcServer(object):
+    def __init__(self, path=None):
+        self._path = path or vimcalc_socketPath()
+        self._sessions = {VIMCALC_SERVER_SESSION: VIMCALC_DEFAULT_SESSION}
+        self._previewers = {}
+        self._evaluators = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        #a socket left behind by a server that has gone away is replaced
+        if os.path.exists(self._path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self._path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                os.unlink(self._path)
+            else:
+                raise OSError("a server is already listening on '%s'." % self._path)
+            finally:
+                probe.close()
+        self._listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        mask = os.umask(0o077)
+        try:
+            self._listener.bind(self._path)
+        finally:
+            os.umask(mask)
+        self._listener.listen(16)
+        self._listener.settimeout(VIMCALC_SERVER_POLL)
+    def getPath(self):
+        return self._path
+    path = property(getPath, doc='Path of the socket [string].')
+
+    def serveForever(self):
+        try:
+            while not self._stopped.is_set():
+                try:
+                    conn, address = self._listener.accept()
+                except socket.timeout:
+                    continue
+                conn.settimeout(None)
+                threading.Thread(target=self._serveConnection, args=(conn,), daemon=True).start()
+        finally:
+            self._listener.close()
+            if os.path.exists(self._path):
+                os.unlink(self._path)
+
+    def shutdown(self):
+        self._stopped.set()
+
+    def _serveConnection(self, conn):
+        with conn, conn.makefile('rb') as reader:
+            for line in reader:
+                if line.strip() == b'':
+                    continue
+                response = self.respond(line)
+                try:
+                    conn.sendall(json.dumps(response).encode('utf-8') + b'\n')
+                except OSError:
+                    break
+
+    #the response to one request line
+    def respond(self, line):
+        requestID = None
+        try:
+            try:
+                request = json.loads(line)
+            except ValueError:
+                raise VimCalcRPCError(-32700, 'Parse error')
+            if not isinstance(request, dict) or not isinstance(request.get('method'), str):
+                raise VimCalcRPCError(-32600, 'Invalid Request')
+            requestID = request.get('id')
+            params = request.get('params', {})
+            if not isinstance(params, dict):
+                raise VimCalcRPCError(-32602, 'Invalid params')
+            return {'jsonrpc': '2.0', 'id': requestID, 'result': self.call(request['method'], params)}
+        except VimCalcRPCError as e:
+            return {'jsonrpc': '2.0', 'id': requestID, 'error': {'code': e.code, 'message': e.message}}
+        except Exception as e:
+            return {'jsonrpc': '2.0', 'id': requestID, 'error': {'code': -32603, 'message': str(e)}}
+
+    def call(self, method, params):
+        params = dict(params)
+        name = params.pop('session', VIMCALC_SERVER_SESSION)
+        try:
+            if method == 'parse':
+                return self.session(name).parse(params.pop('expr'))
+            if method == 'evalLines':
+                with self.session(name).activated():
+                    return vimcalc_evalLinesInSession(params.pop('lines'), params.pop('separator', None))
+            if method == 'preview':
+                return self.previewer(name).preview(params.pop('expr'), params.pop('budget', VIMCALC_PREVIEW_BUDGET))
+            if method == 'value':
+                return self.evaluator(name).value(params.pop('expr'), params.pop('budget', None))
+            if method == 'ping':
+                return 'pong'
+            if method == 'shutdown':
+                self.shutdown()
+                return None
+        except (KeyError, TypeError, AttributeError):
+            raise VimCalcRPCError(-32602, 'Invalid params')
+        raise VimCalcRPCError(-32601, 'Method not found')
+
+    def session(self, name):
+        with self._lock:
+            if name not in self._sessions:
+                self._sessions[name] = VimCalcCalculator()
+            return self._sessions[name]
+
+    def previewer(self, name):
+        session = self.session(name)
+        with self._lock:
+            if name not in self._previewers:
+                self._previewers[name] = VimCalcPreviewer(session)
+            return self._previewers[name]
+
+    def evaluator(self, name):
+        session = self.session(name)
+        with self._lock:
+            if name not in self._evaluators:
+                self._evaluators[name] = VimCalcEvaluator(session)
+            return self._evaluators[name]
+
+class VimCalcClient(object):
+    def __init__(self, path=None, poolSize=VIMCALC_CLIENT_POOL_SIZE):
+        self._path = path or vimcalc_socketPath()
+        self._poolSize = poolSize
+        self._pool = collections.deque()
+        self._lock = threading.Lock()
+        self._lastID = 0
+
+    #calls a method on the server, raising OSError if the call cannot be sent,
+    #VimCalcRPCUnanswered if it is sent but not answered within timeout seconds
+    #and VimCalcRPCError if the server refuses it
+    def call(self, method, timeout=None, **params):
+        with self._lock:
+            self._lastID += 1
+            requestID = self._lastID
+            pooled = self._pool.popleft() if self._pool else None
+        message = json.dumps({'jsonrpc': '2.0', 'id': requestID,
+                              'method': method, 'params': params}).encode('utf-8') + b'\n'
+        #the server may have restarted since the connection was pooled
+        if pooled is not None and vimcalc_isClosed(pooled[0]):
+            pooled[0].close()
+            pooled = None
+        connection = pooled or self._connect()
+        try:
+            self._send(connection, message)
+        except OSError:
+            if pooled is None:
+                raise
+            #the line never got through whole, so it cannot have been evaluated
+            connection = self._connect()
+            self._send(connection, message)
+        try:
+            response = self._receive(connection, timeout or VIMCALC_CLIENT_TIMEOUT)
+        except socket.timeout:
+            raise VimCalcRPCUnanswered('the evaluation server did not answer in time and may still carry out the call.')
+        except OSError:
+            raise VimCalcRPCUnanswered('the evaluation server closed the connection and may have carried out the call.')
+        with self._lock:
+            if len(self._pool) < self._poolSize:
+                self._pool.append(connection)
+                connection = None
+        if connection is not None:
+            connection[0].close()
+        if 'error' in response:
+            raise VimCalcRPCError(response['error'].get('code'), response['error'].get('message'))
+        return response.get('result')
+
+    def close(self):
+        with self._lock:
+            while self._pool:
+                self._pool.popleft()[0].close()
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.settimeout(VIMCALC_CLIENT_CONNECT_TIMEOUT)
+            sock.connect(self._path)
+            sock.settimeout(VIMCALC_CLIENT_TIMEOUT)
+        except OSError:
+            sock.close()
+            raise
+        return (sock, sock.makefile('rb'))
+
+    def _send(self, connection, message):
+        try:
+            connection[0].sendall(message)
+        except OSError:
+            connection[0].close()
+            raise
+
+    def _receive(self, connection, timeout):
+        sock, reader = connection
+        try:
+            sock.settimeout(timeout)
+            line = reader.readline()
+            if line == b'':
+                raise ConnectionResetError('the server closed the connection.')
+            return json.loads(line)
+        except socket.timeout:
+            #the answer may still come, so the connection cannot be used again
+            sock.close()
+            raise
+        except (OSError, ValueError):
+            sock.close()
+            raise ConnectionResetError('the server closed the connection.')
+
+#whether the other end of an idle connection has closed it
+def vimcalc_isClosed(sock):
+    try:
+        if not select.select([sock], [], [], 0)[0]:
+            return False
+        return sock.recv(1, socket.MSG_PEEK) == b''
+    except OSError:
+        return True
+
+VIMCALC_CLIENTS = {}
+
+#the shared client for the socket at path
+def vimcalc_client(path=None):
+    path = path or vimcalc_socketPath()
+    if path not in VIMCALC_CLIENTS:
+        VIMCALC_CLIENTS[path] = VimCalcClient(path)
+    return VIMCALC_CLIENTS[path]
+
+#methods which change the state of the server. Once one of them has been sent
+#it is never carried out here as well, even if the server does not answer.
+VIMCALC_STATEFUL_METHODS = ['parse', 'evalLines']
+
+#calls a method on the server at path, or returns fallback() if there is none,
+#it refuses the call or it does not answer within timeout seconds. A stateful
+#call that was sent but not answered gives unanswered(message) instead, by
+#default the message as an error.
+def vimcalc_remote(path, fallback, method, timeout=None, unanswered=None, **params):
+    if not hasattr(socket, 'AF_UNIX'):
+        return fallback()
+    try:
+        return vimcalc_client(path).call(method, timeout, **params)
+    except VimCalcRPCUnanswered as e:
+        if method not in VIMCALC_STATEFUL_METHODS:
+            return fallback()
+        message = 'Server error: ' + str(e)
+        return message if unanswered is None else unanswered(message)
+    except (OSError, VimCalcRPCError):
+        return fallback()
+
+def vimcalc_remoteParse(expr, path=None, session=VIMCALC_SERVER_SESSION):
+    return vimcalc_remote(path, lambda: vimcalc_parse(expr), 'parse', expr=expr, session=session)
+
+def vimcalc_remoteEvalLines(lines, separator=None, path=None, session=VIMCALC_SERVER_SESSION):
+    newLines, errors = vimcalc_remote(path, lambda: vimcalc_evalLines(lines, separator),
+                                      'evalLines', unanswered=lambda message: (lines, [(0, message)]),
+                                      lines=lines, separator=separator, session=session)
+    return (newLines, [tuple(e) for e in errors])
+
+#python3 vimcalc.py --serve, or python3 vimcalc.py expr... which evaluates each
+#expression (or each line of stdin) through the server if one is running
+def vimcalc_main(argv):
+    import argparse
+    parser = argparse.ArgumentParser(prog='vimcalc.py', description='VimCalc evaluator.')
+    parser.add_argument('--socket', help='path of the server socket')
+    parser.add_argument('--session', default=VIMCALC_SERVER_SESSION, help='session to evaluate in')
+    parser.add_argument('--serve', action='store_true', help='run the server')
+    parser.add_argument('exprs', nargs='*', help='expressions to evaluate')
+    args = parser.parse_args(argv)
+    if args.serve:
+        server = VimCalcServer(args.socket)
+        try:
+            server.serveForever()
+        except KeyboardInterrupt:
+            pass
+        return 0
+    exprs = args.exprs or (line.rstrip('\n') for line in sys.stdin)
+    for expr in exprs:
+        print(vimcalc_remoteParse(expr, args.socket, args.session))
+    return 0
+
+#NOTE: Vim's py3file also runs this file as __main__
+if __name__ == '__main__' and os.path.basename(sys.argv[0]) == 'vimcalc.py':
+    sys.exit(vimcalc_main(sys.argv[1:]))
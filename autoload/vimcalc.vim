@@ -22,12 +22,51 @@ endif
 if !exists("g:VCalc_Max_History")
     let g:VCalc_Max_History = 100
 endif
+if !exists("g:VCalc_History_File")
+    let g:VCalc_History_File = expand("~/.vimcalc_history")
+endif
+if !exists("g:VCalc_Max_Scrollback")
+    let g:VCalc_Max_Scrollback = 1000
+endif
+if !exists("g:VCalc_Scrollback_Archive")
+    let g:VCalc_Scrollback_Archive = ""
+endif
 if !exists("g:VCalc_CWInsert")
     let g:VCalc_CWInsert = 0
 endif
 if !exists("g:VCalc_InsertOnEnter")
     let g:VCalc_InsertOnEnter = 0
 endif
+if !exists("g:VCalc_Eval_Separator")
+    let g:VCalc_Eval_Separator = " = "
+endif
+if !exists("g:VCalc_Preview")
+    let g:VCalc_Preview = 1
+endif
+if !exists("g:VCalc_Preview_Delay")
+    let g:VCalc_Preview_Delay = 50
+endif
+if !exists("g:VCalc_Preview_Budget")
+    let g:VCalc_Preview_Budget = 3
+endif
+if !exists("g:VCalc_Plot_Width")
+    let g:VCalc_Plot_Width = 0 "0 fits the plot to the window
+endif
+if !exists("g:VCalc_Plot_Height")
+    let g:VCalc_Plot_Height = 12
+endif
+if !exists("g:VCalc_Server")
+    let g:VCalc_Server = 0
+endif
+if !exists("g:VCalc_Server_Socket")
+    let g:VCalc_Server_Socket = "" "empty for the default path
+endif
+if !exists("g:VCalc_Memory_Budget")
+    let g:VCalc_Memory_Budget = 256 "megabytes, 0 for no limit
+endif
+if !exists("g:VCalc_Memory_Policy")
+    let g:VCalc_Memory_Policy = 'spill' "or 'drop'
+endif
 if !exists("g:VCalc_WindowPosition")
     let g:VCalc_WindowPosition = 'top' "other possible values: left,right,bottom
 endif
@@ -79,14 +118,41 @@ function! vimcalc#VCalc_Open()
         call setline(line('$'), g:VCalc_Prompt)
     endif
 
-    let b:VCalc_History = []
     let b:VCalc_History_Index = -1
+    let b:VCalc_History_Prefix = ""
 
     call <SID>VCalc_SetLocalSettings()
     call <SID>VCalc_DefineMappingsAndAutoCommands()
     call <SID>VCalc_JumpToPrompt(1)
 endfunction
 
+"evaluates lines line1 to line2 of the current buffer in one go. Results are
+"appended after g:VCalc_Eval_Separator, or replace the lines if replace is set.
+function! vimcalc#VCalc_Eval(line1, line2, replace)
+    let valid = <SID>VCalc_ValidateVim()
+    if valid == -1
+        return
+    endif
+
+    python3 vimcalc_evalRange()
+endfunction
+
+"returns the value of expr as a string, or the optional default ('' if not
+"given) when it has none. Nothing is assigned and no buffer is touched, so it
+"can be used in a statusline or an <expr> mapping.
+function! vimcalc#Eval(expr, ...)
+    let default = a:0 > 0 ? a:1 : ''
+    if !has('python3')
+        return default
+    endif
+    let value = py3eval('vimcalc_oneShot(vim.eval("a:expr"))')
+    return value ==# '' ? default : value
+endfunction
+
+function! vimcalc#VCalc_EvalOperator(type)
+    call vimcalc#VCalc_Eval(line("'["), line("']"), 0)
+endfunction
+
 function! s:VCalc_SetLocalSettings()
     silent! setlocal buftype=nofile
     silent! setlocal nobuflisted
@@ -94,6 +160,7 @@ function! s:VCalc_SetLocalSettings()
     silent! setlocal bufhidden=wipe
     silent! setlocal nonumber
     silent! setlocal nowrap
+    silent! setlocal synmaxcol=200
     setlocal filetype=vimcalc
 endfunction
 
@@ -115,6 +182,11 @@ function! s:VCalc_DefineMappingsAndAutoCommands()
 
     au BufEnter <buffer> :call <SID>VCalc_InsertOnEnter()
 
+    if g:VCalc_Preview && <SID>VCalc_PreviewSupported()
+        au TextChangedI <buffer> :call <SID>VCalc_SchedulePreview()
+        au InsertLeave,BufLeave <buffer> :call <SID>VCalc_CancelPreview()
+    endif
+
     call <SID>VCalc_CreateCWInsertMappings()
 endfunction
 
@@ -136,6 +208,7 @@ function! s:VCalc_REPL(continueInsert)
         let expr = strpart(expr, matchend(expr, g:VCalc_Prompt))
     endif
 
+    call <SID>VCalc_CancelPreview()
     call <SID>VCalc_RecordHistory(expr)
     "TODO: this breaks if a double quoted string is inputed.
     exe "python3 vimcalc_repl(\"" . expr . "\")"
@@ -147,12 +220,29 @@ function! s:VCalc_REPL(continueInsert)
     endif
 
     let failed = append(line('$'), g:VCalc_Prompt)
+    call <SID>VCalc_TrimScrollback()
 
     let b:VCalc_History_Index = -1
 
     call <SID>VCalc_JumpToPrompt(a:continueInsert)
 endfunction
 
+"old output is dropped in chunks of a quarter of the limit so that the buffer
+"is not rewritten on every evaluation
+function! s:VCalc_TrimScrollback()
+    if g:VCalc_Max_Scrollback <= 0
+        return
+    endif
+    let excess = line('$') - g:VCalc_Max_Scrollback
+    if excess <= g:VCalc_Max_Scrollback / 4
+        return
+    endif
+    if g:VCalc_Scrollback_Archive != ''
+        call writefile(getline(1, excess), expand(g:VCalc_Scrollback_Archive), 'a')
+    endif
+    silent exe '1,' . excess . 'delete _'
+endfunction
+
 function! s:VCalc_JumpToPrompt(withInsert)
     call setpos(".", [0, line('$'), col('$'), 0])
     if a:withInsert == 1
@@ -161,28 +251,85 @@ function! s:VCalc_JumpToPrompt(withInsert)
 endfunction
 
 function! s:VCalc_RecordHistory(expr)
-    call insert(b:VCalc_History, a:expr)
-    if len(b:VCalc_History) > g:VCalc_Max_History
-        call remove(b:VCalc_History, -1)
-    endif
+    python3 vimcalc_history().record(vim.eval("a:expr"))
 endfunction
 
+"history navigation only offers entries starting with whatever had been typed
+"at the prompt when it began
 function! s:VCalc_PreviousHistory()
-    if b:VCalc_History_Index < len(b:VCalc_History)-1
-        let b:VCalc_History_Index += 1
-        let failed = setline(line('$'), g:VCalc_Prompt . b:VCalc_History[b:VCalc_History_Index])
-        call <SID>VCalc_JumpToPrompt(1)
+    if b:VCalc_History_Index == -1
+        let b:VCalc_History_Prefix = strpart(getline('$'), strlen(g:VCalc_Prompt))
     endif
+    python3 vimcalc_historyStep(1)
+    call <SID>VCalc_JumpToPrompt(1)
 endfunction
 
 function! s:VCalc_NextHistory()
-    if b:VCalc_History_Index > 0
-        let b:VCalc_History_Index -= 1
-        let failed = setline(line('$'), g:VCalc_Prompt . b:VCalc_History[b:VCalc_History_Index])
+    if b:VCalc_History_Index != -1
+        python3 vimcalc_historyStep(0)
         call <SID>VCalc_JumpToPrompt(1)
     endif
 endfunction
 
+"the result of the prompt line is shown as virtual text while it is edited
+function! s:VCalc_PreviewSupported()
+    if has('nvim')
+        return exists('*nvim_buf_set_extmark')
+    endif
+    return has('timers') && has('textprop') && has('patch-9.0.0121')
+endfunction
+
+"keystrokes restart the timer, so the preview is only worked out once typing
+"pauses for g:VCalc_Preview_Delay milliseconds
+function! s:VCalc_SchedulePreview()
+    call <SID>VCalc_CancelPreview()
+    let b:VCalc_Preview_Timer = timer_start(g:VCalc_Preview_Delay,
+                \ function('s:VCalc_ShowPreview', [bufnr('')]))
+endfunction
+
+function! s:VCalc_CancelPreview()
+    if exists('b:VCalc_Preview_Timer')
+        call timer_stop(b:VCalc_Preview_Timer)
+        unlet b:VCalc_Preview_Timer
+    endif
+    call <SID>VCalc_SetPreview('')
+endfunction
+
+function! s:VCalc_ShowPreview(bufnr, timer)
+    if bufnr('') != a:bufnr || mode() !~# '^i' || line('.') != line('$')
+        return
+    endif
+    unlet! b:VCalc_Preview_Timer
+    let expr = getline('$')
+    if match(expr, g:VCalc_Prompt) != 0
+        return
+    endif
+    let expr = strpart(expr, matchend(expr, g:VCalc_Prompt))
+    call <SID>VCalc_SetPreview(py3eval('vimcalc_preview(vim.eval("l:expr"))'))
+endfunction
+
+function! s:VCalc_SetPreview(text)
+    if has('nvim')
+        if !exists('s:VCalc_Preview_Namespace')
+            let s:VCalc_Preview_Namespace = nvim_create_namespace('vimcalc_preview')
+        endif
+        call nvim_buf_clear_namespace(0, s:VCalc_Preview_Namespace, 0, -1)
+        if a:text != ''
+            call nvim_buf_set_extmark(0, s:VCalc_Preview_Namespace, line('$') - 1, 0,
+                        \ {'virt_text': [[a:text, 'vcalcPreview']], 'virt_text_pos': 'eol'})
+        endif
+    elseif <SID>VCalc_PreviewSupported()
+        if empty(prop_type_get('vcalcPreview'))
+            call prop_type_add('vcalcPreview', {'highlight': 'vcalcPreview'})
+        endif
+        call prop_remove({'type': 'vcalcPreview', 'all': 1})
+        if a:text != ''
+            call prop_add(line('$'), 0, {'type': 'vcalcPreview', 'text': '  ' . a:text,
+                        \ 'text_align': 'after'})
+        endif
+    endif
+endfunction
+
 function! s:VCalc_InsertOnEnter()
     if g:VCalc_InsertOnEnter
         call <SID>VCalc_JumpToPrompt(1)
@@ -221,9 +368,35 @@ python3 << EOF
 
 import vim
 
+#the size of :plot charts, leaving room for the axis labels
+def vimcalc_plotSize():
+    global VIMCALC_PLOT_SIZE
+    width = int(vim.eval("g:VCalc_Plot_Width"))
+    if width <= 0:
+        width = int(vim.eval("winwidth(0)")) - 16
+    VIMCALC_PLOT_SIZE = (max(width, 8), max(int(vim.eval("g:VCalc_Plot_Height")), 2))
+
+#the default memory budget of sessions, see :mem
+def vimcalc_memoryBudget():
+    global VIMCALC_MEMORY_BUDGET, VIMCALC_MEMORY_POLICY
+    VIMCALC_MEMORY_BUDGET = int(float(vim.eval("g:VCalc_Memory_Budget")) * (1 << 20))
+    VIMCALC_MEMORY_POLICY = vim.eval("g:VCalc_Memory_Policy")
+
+#the socket of the server to evaluate through, or None to evaluate in Vim
+def vimcalc_serverSocket():
+    if not int(vim.eval("g:VCalc_Server")):
+        return None
+    return vim.eval("expand(g:VCalc_Server_Socket)") or vimcalc_socketPath()
+
 def vimcalc_repl(expr):
     if expr != "":
-        result = vimcalc_parse(expr)
+        vimcalc_plotSize()
+        vimcalc_memoryBudget()
+        server = vimcalc_serverSocket()
+        if server is None:
+            result = vimcalc_parse(expr)
+        else:
+            result = vimcalc_remoteParse(expr, server)
         #if result is of the form: "!!!.*!!!" it is a vim command to execute.
         m = re.match(r"^!!!(.*)!!!$", result)
         if m:
@@ -231,9 +404,88 @@ def vimcalc_repl(expr):
             vim.command(m.group(1))
             vim.command("let w:vcalc_vim_command = 1")
         else:
-            for str in result.split("\n"):
-                vim.command("call append(line('$'), \"" + str + "\")")
+            vim.current.buffer.append(result.split("\n"))
             vim.command("if exists(\"w:vcalc_vim_command\") | unlet w:vcalc_vim_command | endif")
+
+def vimcalc_evalRange():
+    first = int(vim.eval("a:line1"))
+    last = int(vim.eval("a:line2"))
+    if int(vim.eval("a:replace")):
+        separator = None
+    else:
+        separator = vim.eval("g:VCalc_Eval_Separator")
+    buf = vim.current.buffer
+    lines = buf[first-1:last]
+    server = vimcalc_serverSocket()
+    if server is None:
+        newLines, errors = vimcalc_evalLines(lines, separator)
+    else:
+        newLines, errors = vimcalc_remoteEvalLines(lines, separator, server)
+    if newLines != lines:
+        buf[first-1:last] = newLines
+    if errors != []:
+        index, message = errors[0]
+        msg = "VCalcEval: line %d: %s" % (first + index, message)
+        if len(errors) > 1:
+            msg += " (%d lines failed)" % len(errors)
+        vim.command("echohl WarningMsg | echomsg '" + msg.replace("'", "''") + "' | echohl None")
+
+VIMCALC_REPL_PREVIEWER = VimCalcPreviewer()
+
+#returns the preview text for the prompt line or '' if there is none. It is
+#abandoned as soon as another key is pressed.
+def vimcalc_preview(expr):
+    budget = int(vim.eval("g:VCalc_Preview_Budget")) / 1000.0
+    cancelled = lambda: vim.eval("getchar(1)") != "0"
+    server = vimcalc_serverSocket()
+    if server is None:
+        output = VIMCALC_REPL_PREVIEWER.preview(expr, budget, cancelled)
+    else:
+        output = vimcalc_remote(server, lambda: VIMCALC_REPL_PREVIEWER.preview(expr, budget, cancelled),
+                                'preview', budget + VIMCALC_CLIENT_MARGIN, expr=expr, budget=budget)
+    if output is None or "\n" in output:
+        return ""
+    return output
+
+VIMCALC_REPL_EVALUATOR = VimCalcEvaluator()
+
+#the value of expr for vimcalc#Eval(), '' if it has none
+def vimcalc_oneShot(expr):
+    server = vimcalc_serverSocket()
+    if server is None:
+        value = VIMCALC_REPL_EVALUATOR.value(expr)
+    else:
+        value = vimcalc_remote(server, lambda: VIMCALC_REPL_EVALUATOR.value(expr), 'value',
+                               VIMCALC_EVAL_BUDGET + VIMCALC_CLIENT_MARGIN, expr=expr)
+    return '' if value is None else value
+
+VIMCALC_REPL_HISTORY = None
+
+def vimcalc_history():
+    global VIMCALC_REPL_HISTORY
+    if VIMCALC_REPL_HISTORY is None:
+        VIMCALC_REPL_HISTORY = VimCalcHistory(int(vim.eval("g:VCalc_Max_History")),
+                                              vim.eval("g:VCalc_History_File"))
+    return VIMCALC_REPL_HISTORY
+
+def vimcalc_historyStep(older):
+    history = vimcalc_history()
+    index = int(vim.eval("b:VCalc_History_Index"))
+    prefix = vim.eval("b:VCalc_History_Prefix")
+    if older:
+        if index == -1:
+            history.refresh()
+            entry = history.previous(prefix)
+        else:
+            entry = history.previous(prefix, index)
+        if entry is None:
+            return
+    else:
+        entry = history.following(prefix, index)
+        if entry is None:
+            entry = (-1, prefix)
+    vim.command("let b:VCalc_History_Index = " + str(entry[0]))
+    vim.current.buffer[-1] = vim.eval("g:VCalc_Prompt") + entry[1]
 EOF
 endfunction
 call VCalc_Repl()
@@ -10,3 +10,27 @@ endif
 let g:loaded_vimcalc = 1
 
 command! -nargs=0 -bar Calc call vimcalc#VCalc_Open()
+command! -range -bang -bar VCalcEval call vimcalc#VCalc_Eval(<line1>, <line2>, <bang>0)
+
+nnoremap <silent> <Plug>VCalcEval :<C-u>set operatorfunc=vimcalc#VCalc_EvalOperator<CR>g@
+nnoremap <silent> <Plug>VCalcEvalLine :VCalcEval<CR>
+xnoremap <silent> <Plug>VCalcEval :VCalcEval<CR>
+inoremap <silent> <Plug>VCalcInsert <C-R>=vimcalc#Eval(input('Calc: '))<CR>
+
+"the default mappings never replace one of the user's own
+if get(g:, 'VCalc_Mappings', 1)
+    if !hasmapto('<Plug>VCalcEval', 'n') && maparg('<Leader>=', 'n') ==# ''
+        nmap <Leader>= <Plug>VCalcEval
+    endif
+    "not <Leader>==, which would make <Leader>= wait to see if another = follows
+    if !hasmapto('<Plug>VCalcEvalLine', 'n') && maparg('<Leader>+', 'n') ==# ''
+        nmap <Leader>+ <Plug>VCalcEvalLine
+    endif
+    if !hasmapto('<Plug>VCalcEval', 'x') && maparg('<Leader>=', 'x') ==# ''
+        xmap <Leader>= <Plug>VCalcEval
+    endif
+endif
+"<C-G> starts Vim's own insert mode commands, so this one is only on request
+if get(g:, 'VCalc_Insert_Mapping', 0) && !hasmapto('<Plug>VCalcInsert', 'i')
+    imap <C-G>= <Plug>VCalcInsert
+endif
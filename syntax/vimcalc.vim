@@ -15,15 +15,21 @@ syntax keyword vcalcAns ans
 syntax keyword vcalcE   e
 syntax keyword vcalcPi  pi
 syntax keyword vcalcPhi phi
+syntax match   vcalcResultRef "\$[0-9]\+"
 
 syntax keyword vcalcLet let
 
-syntax keyword vcalcFuncs abs acos asin atan atan2 ceil choose cos cosh deg exp floor hypot inv ldexp lg ln log log10 max min nrt perms pow rad rand round sin sinh sqrt tan tanh
+syntax keyword vcalcFuncs abs acos asin atan atan2 ceil choose clz cos cosh crt ctz deg det dot exp factor floor gcd hypot ilog10 ilog2 integrate inv iroot isprime isqrt lcm ldexp lg ln log log10 max mean median min modinv nextprime nrt percentile perms popcount pow powmod primepi prod product rad rand rotl rotr round series sin sinh solve sqrt stddev sum tan tanh var
 
-syntax match vcalcDirectives "\(:hex\|:oct\|:bin\|:dec\|:int\|:float\|:status\|:s\|:vars\|:q\)\s*$"
+syntax match vcalcDirectives "\(:hex\|:oct\|:bin\|:dec\|:int\|:float\|:status\|:s\|:vars\(\s*@\s*[0-9]\+\)\=\|:q\|:undo\|:redo\)\s*$"
+
+syntax match vcalcDirectives "^\s*:plot\>"
+syntax match vcalcDirectives "^\s*:load\>"
+syntax match vcalcDirectives "^\s*:bits\>"
+syntax match vcalcDirectives "^\s*:mem\>"
 
 syntax match vcalcOps "\*\*=\|%=\|/=\|\*=\|-=\|+=\|<<\|>>\|\*\*\|=\|!\|%\|/\|\*\|-\|+"
-syntax match vcalcDelim "(\|)"
+syntax match vcalcDelim "(\|)\|\[\|\]"
 
 syntax match vcalcDecNum "[0-9]*\.\?\([0-9]\+\)\?\([eE][+-]\?[0-9]\+\)\?"
 syntax match vcalcHexNum "0[xX][0-9a-fA-F]\+"
@@ -32,6 +38,7 @@ syntax match vcalcBinNum "0[bB][01]\+"
 
 syntax match vcalcSynErr "^Syntax error: .*"
 syntax match vcalcParErr "^Parse error: .*"
+syntax match vcalcWarning "^WARNING: .*"
 
 if g:VCalc_Prompt != ''
     silent execute "syn match vcalcPrompt '" . g:VCalc_Prompt . "'"
@@ -44,10 +51,17 @@ syntax match vcalcOctDirOutput    "CHANGED OUTPUT BASE TO OCTAL."
 syntax match vcalcBinDirOutput    "CHANGED OUTPUT BASE TO BINARY."
 syntax match vcalcFloatDirOutput  "CHANGED OUTPUT PRECISION TO FLOATING POINT."
 syntax match vcalcIntDirOutput    "CHANGED OUTPUT PRECISION TO INTEGER."
-syntax match vcalcStatusVariables display contained "DECIMAL\|HEXADECIMAL\|OCTAL\|INTEGER\|FLOATING POINT"
+syntax match vcalcBitsDirOutput   "CHANGED WORD SIZE TO .*\."
+syntax match vcalcStatusVariables display contained "DECIMAL\|HEXADECIMAL\|OCTAL\|INTEGER\|FLOATING POINT\|[0-9]\+ BITS \(UN\)\=SIGNED"
 syntax region vcalcStatusDirOutput start="STATUS:" end="\." contains=vcalcStatusVariables
 
-syntax region vcalcVarsDirOutput  start="^VARIABLES:$" end="^$" contains=vcalcDecNum,vcalcHexNum,vcalcOctNum,vcalcBinNum
+syntax region vcalcVarsDirOutput  start="^VARIABLES\( AT LINE [0-9]\+\)\=:$" end="^$" contains=vcalcDecNum,vcalcHexNum,vcalcOctNum,vcalcBinNum
+syntax match vcalcUndoDirOutput   "^\(UNDID\|REDID\) LINE [0-9]\+:\|^NOTHING TO \(UNDO\|REDO\)\."
+syntax match vcalcPlotDirOutput   "^PLOT OF .* FOR .*:$"
+syntax match vcalcLoadDirOutput   "^LOADED [0-9]\+ VALUES INTO .*\.$"
+syntax region vcalcMemDirOutput   start="^\(MEMORY\|SYMBOLS BY SIZE\):$" end="^$"
+syntax match vcalcMemDirOutput    "^CHANGED MEMORY BUDGET TO .*\.$\|^VALUES OVER THE MEMORY BUDGET WILL BE .*\.$"
+syntax match vcalcMemDirOutput    "^\(UN\)\=PINNED .*\.$\|^\(STARTED\|STOPPED\) TRACING MEMORY\.$"
 
 if version >= 600
 	command -nargs=+ HiLink highlight default link <args>
@@ -60,6 +74,7 @@ HiLink vcalcAns         vcalcSymbol
 HiLink vcalcE           vcalcSymbol
 HiLink vcalcPi          vcalcSymbol
 HiLink vcalcPhi         vcalcSymbol
+HiLink vcalcResultRef   vcalcSymbol
 HiLink vcalcSymbol      Constant
 
 "Keywords
@@ -90,18 +105,32 @@ HiLink vcalcSynErr      vcalcError
 HiLink vcalcParErr      vcalcError
 HiLink vcalcError       Error
 
+"Warnings
+HiLink vcalcWarning     WarningMsg
+
 HiLink vcalcDecDirOutput    vcalcDirOutput
 HiLink vcalcHexDirOutput    vcalcDirOutput
 HiLink vcalcOctDirOutput    vcalcDirOutput
 HiLink vcalcBinDirOutput    vcalcDirOutput
 HiLink vcalcFloatDirOutput  vcalcDirOutput
 HiLink vcalcIntDirOutput    vcalcDirOutput
+HiLink vcalcBitsDirOutput   vcalcDirOutput
 HiLink vcalcStatusDirOutput vcalcDirOutput
 HiLink vcalcVarsDirOutput   vcalcDirOutput
+HiLink vcalcUndoDirOutput   vcalcDirOutput
+HiLink vcalcPlotDirOutput   vcalcDirOutput
+HiLink vcalcLoadDirOutput   vcalcDirOutput
+HiLink vcalcMemDirOutput    vcalcDirOutput
 HiLink vcalcDirOutput       PreProc
 
 HiLink vcalcStatusVariables Statement
 
+"Live preview of the prompt line
+HiLink vcalcPreview         Comment
+
 delcommand HiLink
 
+"the REPL buffer can get long, only look a little way back to synchronise
+syntax sync minlines=20 maxlines=200
+
 let b:current_syntax = "vimcalc"